@@ -0,0 +1,84 @@
+"""
+Analytics Codes
+Compact storage encodings for analytics rows: small-integer actions and privacy-truncated IPs
+"""
+import ipaddress
+import os
+from typing import Optional
+
+from sqlalchemy import SmallInteger
+from sqlalchemy.types import TypeDecorator
+
+# Stored codes: append only, never renumber
+ACTION_CODES = {
+    "other": 0,  # Actions recorded before codes existed that aren't listed here
+    "view": 1,
+    "call": 2,
+    "whatsapp": 3,
+    "email": 4,
+    "download_vcard": 5,
+    "scan_qr": 6,
+    # Social link clicks on the card page
+    "linkedin": 20,
+    "twitter": 21,
+    "x": 22,
+    "facebook": 23,
+    "instagram": 24,
+    "youtube": 25,
+    "tiktok": 26,
+    "github": 27,
+    "telegram": 28,
+    "snapchat": 29,
+    "website": 30,
+}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+
+# Keep only the network part of stored IPs (/24 for IPv4, /48 for IPv6)
+TRUNCATE_IPS = os.getenv("ANALYTICS_TRUNCATE_IPS", "false").lower() == "true"
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+
+class ActionCode(TypeDecorator):
+    """An action name in Python, its SMALLINT code in the database."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return ACTION_CODES[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return ACTION_NAMES.get(value, "other")
+
+
+def normalize_action(value: str) -> str:
+    """A client-supplied action name; names not listed (e.g. new social platforms) are recorded as "other"."""
+    action = value.strip().lower()
+    return action if action in ACTION_CODES else "other"
+
+
+def known_action(value: str) -> str:
+    """Validate an action name used as a filter."""
+    action = value.strip().lower()
+    if action not in ACTION_CODES:
+        raise ValueError(f"Unknown action '{value}'")
+    return action
+
+
+def storable_ip(value: Optional[str]) -> Optional[str]:
+    """The address as stored: validated and, if configured, truncated to its network."""
+    if not value:
+        return None
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    if not TRUNCATE_IPS:
+        return str(address)
+    prefix = IPV4_PREFIX if address.version == 4 else IPV6_PREFIX
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False).network_address)
@@ -0,0 +1,80 @@
+"""
+Analytics Dimensions
+Dictionary-encoded device and region names: each distinct string is stored once and events keep its id
+"""
+import os
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+from cache import LRUCache
+from database import after_commit
+
+MAX_NAME_LENGTH = 100
+
+
+def normalize(name: Optional[str]) -> Optional[str]:
+    if name is None:
+        return None
+    name = name.strip()[:MAX_NAME_LENGTH]
+    return name or None
+
+
+class Dimension:
+    """Name → id lookup table with an in-process cache.
+
+    Ids never change once assigned, so cached entries don't expire; the cache
+    is bounded because names come from clients.
+    """
+
+    def __init__(self, model, maxsize: int):
+        self.model = model
+        self.ids = LRUCache(maxsize)
+
+    async def ids_for(self, session: AsyncSession, names: Iterable[Optional[str]]) -> Dict[str, int]:
+        """Ids of the given names, creating missing rows. Does not commit.
+
+        New ids are cached only once the caller commits, so a rollback can't
+        leave the cache pointing at rows that were never written.
+        """
+        found: Dict[str, int] = {}
+        missing = set()
+        for name in names:
+            if name is None or name in found:
+                continue
+            cached = self.ids.get(name)
+            if cached is None:
+                missing.add(name)
+            else:
+                found[name] = cached
+        if not missing:
+            return found
+
+        model = self.model
+        result = await session.execute(
+            insert(model)
+            .values([{"name": name} for name in sorted(missing)])  # Sorted: concurrent inserts lock in one order
+            .on_conflict_do_nothing(index_elements=[model.name])
+            .returning(model.name, model.id)
+        )
+        created = dict(result.all())
+        existing = missing - created.keys()
+        if existing:
+            result = await session.execute(select(model.name, model.id).where(model.name.in_(existing)))
+            created.update(result.all())
+
+        def remember():
+            for name, id_ in created.items():
+                self.ids.put(name, id_)
+        after_commit(session, remember)
+        found.update(created)
+        return found
+
+
+CACHE_SIZE = int(os.getenv("ANALYTICS_DIMENSION_CACHE_SIZE", "10000"))
+
+devices = Dimension(db.AnalyticsDevice, CACHE_SIZE)
+regions = Dimension(db.AnalyticsRegion, CACHE_SIZE)
@@ -0,0 +1,151 @@
+"""
+Analytics Ingestion Filter
+Drops crawler hits and repeated hits before they are written, counting what was dropped
+"""
+import ipaddress
+import logging
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Link-preview fetchers, search crawlers, uptime monitors and scripted clients
+BOT_USER_AGENTS = re.compile(
+    r"bot\b|bot/|crawl|spider|slurp|archiver|scrape|preview|"
+    r"facebookexternalhit|facebookcatalog|embedly|quora link|outbrain|pinterest|vkshare|w3c_validator|"
+    r"^whatsapp/|skypeuripreview|bitlybot|nuzzel|redditbot|"
+    r"uptime|pingdom|statuscake|monitor|site24x7|datadog|newrelic|check_http|nagios|"
+    r"headless|phantomjs|lighthouse|pagespeed|google-inspectiontool|"
+    r"^curl/|^wget/|^python-|^python/|^go-http-client|^java/|^okhttp|^axios/|^node-fetch|"
+    r"^libwww-perl|^httpie|^postman|^insomnia|^apache-httpclient",
+    re.IGNORECASE,
+)
+
+DEDUP_WINDOW_SECONDS = float(os.getenv("ANALYTICS_DEDUP_WINDOW_SECONDS", "30"))
+DEDUP_MAX_KEYS = int(os.getenv("ANALYTICS_DEDUP_MAX_KEYS", "100000"))
+
+# Hits seen before checking whether they all came from one private address,
+# i.e. from a proxy whose X-Forwarded-For is not trusted
+PROXY_CHECK_HITS = 100
+
+REASON_BOT = "bot"
+REASON_DUPLICATE = "duplicate"
+
+
+def is_bot(user_agent: Optional[str]) -> bool:
+    """Crawlers, previewers and tools; a missing user agent counts as one too."""
+    return not user_agent or BOT_USER_AGENTS.search(user_agent) is not None
+
+
+def is_private_ip(ip: str) -> bool:
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback
+
+
+class SlidingWindowDedup:
+    """Remembers when each key was last accepted, for `window` seconds.
+
+    Keys are kept in acceptance order, so expired ones are trimmed from the
+    front; at `maxsize` the oldest key is forgotten early, which can only let
+    an extra event through, never drop one wrongly.
+    """
+
+    def __init__(self, window: float, maxsize: int, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.maxsize = maxsize
+        self.clock = clock
+        self._accepted: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def seen(self, key: Hashable) -> bool:
+        """True if `key` was accepted within the window; otherwise accept it now."""
+        now = self.clock()
+        accepted = self._accepted
+        while accepted:
+            oldest_key, at = next(iter(accepted.items()))
+            if now - at < self.window:
+                break
+            del accepted[oldest_key]
+        if key in accepted:
+            return True
+        accepted[key] = now
+        if len(accepted) > self.maxsize:
+            accepted.popitem(last=False)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._accepted)
+
+
+class IngestFilter:
+    """Decides per hit whether it is recorded, and counts what it drops."""
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS, maxsize: int = DEDUP_MAX_KEYS):
+        self.dedup = SlidingWindowDedup(window, maxsize)
+        self.accepted = 0
+        self.dropped: Counter = Counter()
+        # The address every hit so far came from, until a second one shows up
+        self._only_ip: Optional[str] = None
+        self._only_ip_hits = 0
+        self.proxy_ip: Optional[str] = None
+
+    def check(self, user_agent: Optional[str], ip: Optional[str], card: Hashable, action: str) -> Optional[str]:
+        """The reason to drop this hit, or None to record it.
+
+        `card` is anything identifying the card hit (slugs, short code), so
+        the check can run before the card is looked up.
+        """
+        if ip and self._only_ip_hits >= 0:
+            self._check_single_ip(ip)
+        if is_bot(user_agent):
+            reason = REASON_BOT
+        elif ip and self.dedup.seen((ip, card, action)):
+            reason = REASON_DUPLICATE
+        else:
+            self.accepted += 1
+            return None
+        self.dropped[(reason, action)] += 1
+        return reason
+
+    def _check_single_ip(self, ip: str) -> None:
+        """Warn once if the first PROXY_CHECK_HITS hits all came from the same private address.
+
+        That means the server sees the proxy (or the frontend server) rather
+        than visitors, so deduplication, unique visitors and regions all
+        collapse onto one address: FORWARDED_ALLOW_IPS must include it.
+        """
+        if self._only_ip is None:
+            self._only_ip = ip
+        if ip != self._only_ip:
+            self._only_ip_hits = -1
+            return
+        self._only_ip_hits += 1
+        if self._only_ip_hits >= PROXY_CHECK_HITS:
+            self._only_ip_hits = -1
+            if is_private_ip(ip):
+                self.proxy_ip = ip
+                logger.warning(
+                    "All of the first %d tracked hits came from %s; it is probably a proxy. "
+                    "Add it to FORWARDED_ALLOW_IPS so visitors' addresses are used.",
+                    PROXY_CHECK_HITS, ip,
+                )
+
+    def stats(self) -> Dict:
+        dropped: Dict[str, Dict[str, int]] = {}
+        for (reason, action), count in self.dropped.items():
+            dropped.setdefault(reason, {})[action] = count
+        return {
+            "accepted": self.accepted,
+            "dropped": dropped,
+            "dedup_keys": len(self.dedup),
+            "dedup_window_seconds": self.dedup.window,
+            "proxy_ip": self.proxy_ip,
+        }
+
+
+ingest_filter = IngestFilter()
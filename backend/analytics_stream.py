@@ -0,0 +1,199 @@
+"""
+Live Analytics Stream
+Fans tracked events out to dashboard SSE connections, across worker processes
+
+Tracking sends the events with NOTIFY in its own transaction; every worker
+LISTENs and pushes them to the streams it holds, so a dashboard sees events
+recorded by any worker, and only once they are committed.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from database import is_ready, lock_engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "analytics_events"
+# NOTIFY payloads must stay below 8000 bytes
+MAX_NOTIFY_BYTES = 7000
+# Checks that the listening connection is alive; it is reopened after this long when lost
+LISTEN_CHECK_SECONDS = 15.0
+
+# Per-connection backlog of event frames; older frames are dropped beyond this
+MAX_PENDING_EVENTS = 100
+
+# Bursts arriving within this window are flushed to the client together
+COALESCE_SECONDS = 0.25
+
+# Comment frame sent on idle connections so proxies don't time them out
+HEARTBEAT_SECONDS = 15.0
+
+
+def format_sse(event: str, data: Any) -> bytes:
+    """Encode a single Server-Sent Events frame."""
+    payload = json.dumps(data, default=str, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+def _event_data(event) -> Dict[str, Any]:
+    return {
+        "id": event.id,
+        "employee_id": event.employee_id,
+        "company_id": event.company_id,
+        "timestamp": event.timestamp,
+        "device": event.device,
+        "region": event.region,
+        "action": event.action,
+    }
+
+
+def notify_payloads(events: Iterable) -> List[str]:
+    """Tracked events (`services.AnalyticsRow`) as JSON arrays, each small enough for one NOTIFY."""
+    payloads: List[str] = []
+    batch: List[str] = []
+    size = 2
+    for event in events:
+        item = json.dumps(_event_data(event), default=str, separators=(",", ":"))
+        if batch and size + len(item) + 1 > MAX_NOTIFY_BYTES:
+            payloads.append(f"[{','.join(batch)}]")
+            batch, size = [], 2
+        batch.append(item)
+        size += len(item) + 1
+    if batch:
+        payloads.append(f"[{','.join(batch)}]")
+    return payloads
+
+
+class StreamSubscription:
+    """A single dashboard connection subscribed to one company's events."""
+
+    def __init__(self, company_id: uuid.UUID, counters: Dict[str, int]):
+        self.company_id = company_id
+        self.counters = dict(counters)
+        self.dropped = 0
+        self.closed = False
+        self._events: deque = deque(maxlen=MAX_PENDING_EVENTS)
+        self._dirty: Set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    def push(self, frame: bytes, action: str) -> None:
+        """Queue an already-encoded event frame and bump the action counter.
+
+        Never blocks: when the client falls behind, the oldest queued event
+        frames are discarded, while counters keep accumulating exactly.
+        """
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(frame)
+        self.counters[action] = self.counters.get(action, 0) + 1
+        self._dirty.add(action)
+        self._wakeup.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+
+    async def frames(self) -> AsyncIterator[bytes]:
+        """Yield SSE frames until the subscription is closed."""
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+
+            # Let a burst settle so its counter updates go out as one frame
+            await asyncio.sleep(COALESCE_SECONDS)
+            self._wakeup.clear()
+
+            while self._events:
+                yield self._events.popleft()
+
+            if self.dropped:
+                yield format_sse("dropped", {"count": self.dropped})
+                self.dropped = 0
+
+            if self._dirty:
+                changed = {action: self.counters[action] for action in self._dirty}
+                self._dirty.clear()
+                yield format_sse("counters", changed)
+
+
+class AnalyticsBroker:
+    """Routes tracked events to the subscriptions of the owning company."""
+
+    def __init__(self):
+        self._topics: Dict[uuid.UUID, Set[StreamSubscription]] = {}
+
+    def subscribe(
+        self,
+        company_id: uuid.UUID,
+        counters: Optional[Dict[str, int]] = None
+    ) -> StreamSubscription:
+        subscription = StreamSubscription(company_id, counters or {})
+        self._topics.setdefault(company_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: StreamSubscription) -> None:
+        subscription.close()
+        subscribers = self._topics.get(subscription.company_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[subscription.company_id]
+
+    def subscriber_count(self, company_id: uuid.UUID) -> int:
+        return len(self._topics.get(company_id, ()))
+
+    def _fan_out(self, company_id: uuid.UUID, data: Dict[str, Any]) -> None:
+        """Push an event to this worker's subscribers of its company.
+
+        The frame is encoded once and shared by all connections.
+        """
+        subscribers = self._topics.get(company_id)
+        if not subscribers:
+            return
+        frame = format_sse("analytics", data)
+        for subscription in subscribers:
+            subscription.push(frame, data["action"])
+
+    def _deliver(self, connection, pid, channel, payload: str) -> None:
+        """NOTIFY callback: events committed by any worker."""
+        if not self._topics:
+            return
+        for data in json.loads(payload):
+            self._fan_out(uuid.UUID(data["company_id"]), data)
+
+    async def run(self) -> None:
+        """Background loop: LISTEN for tracked events on a dedicated, unpooled connection."""
+        while not is_ready():
+            await asyncio.sleep(1)
+        while True:
+            try:
+                async with lock_engine.connect() as conn:
+                    # The driver connection directly: SQLAlchemy would open a
+                    # transaction, and notifications wait for it to end
+                    listener = (await conn.get_raw_connection()).driver_connection
+                    await listener.add_listener(CHANNEL, self._deliver)
+                    while True:
+                        await asyncio.sleep(LISTEN_CHECK_SECONDS)
+                        await listener.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Analytics stream listener lost; reconnecting")
+            await asyncio.sleep(LISTEN_CHECK_SECONDS)
+
+    def close_all(self) -> None:
+        """End every open stream (used on shutdown)."""
+        for subscribers in list(self._topics.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+        self._topics.clear()
+
+
+broker = AnalyticsBroker()
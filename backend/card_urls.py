@@ -0,0 +1,101 @@
+"""
+Stored Card URL Refresh
+Rewrites the absolute URLs stored on every card in one UPDATE when the host settings change
+
+Usage:
+    python card_urls.py          # refresh if API_HOST/FRONTEND_HOST/... changed
+    python card_urls.py --force  # refresh regardless
+
+Also runs once at API startup; the settings fingerprint of the last refresh is
+kept in sync_state so unchanged deployments skip the UPDATE.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, update, func, literal
+from sqlalchemy.dialects.postgresql import insert
+
+import database_models as db
+from database import AsyncSessionLocal, engine, is_ready
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+SYNC_NAME = "card_urls"
+ADVISORY_LOCK_KEY = 0x5EC0_0002
+
+
+def _refresh_statement():
+    """UPDATE cards ... FROM employees, companies, deriving every URL from the slugs."""
+    api = literal(settings.api_base_url)
+    frontend = literal(settings.frontend_base_url)
+    short_code = (
+        select(db.ShortLink.code)
+        .where(db.ShortLink.employee_id == db.Card.employee_id, db.ShortLink.target == "vcard")
+        .scalar_subquery()
+    )
+    return (
+        update(db.Card)
+        .where(db.Card.employee_id == db.Employee.id)
+        .where(db.Employee.company_id == db.Company.id)
+        .values(
+            url=func.concat(frontend, "/card/", db.Company.slug, "/", db.Employee.public_slug),
+            vcard_url=func.concat(api, "/api/card/", db.Company.slug, "/", db.Employee.public_slug, "/vcard"),
+            # concat() would turn a missing code into a bare prefix; || keeps it NULL
+            qr_code=func.coalesce(api + "/s/" + short_code, db.Card.qr_code),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def refresh_stored_urls(force: bool = False) -> Optional[int]:
+    """Rewrite card URLs if the settings changed since the last refresh.
+
+    Returns the number of cards updated, or None when already current.
+    """
+    async with AsyncSessionLocal() as session:
+        # Concurrent workers queue here and then find the fingerprint current
+        await session.execute(select(func.pg_advisory_xact_lock(ADVISORY_LOCK_KEY)))
+        state = await session.get(db.SyncState, SYNC_NAME)
+        if not force and state and state.cursor == settings.fingerprint:
+            return None
+
+        result = await session.execute(_refresh_statement())
+        now = datetime.utcnow()
+        await session.execute(
+            insert(db.SyncState)
+            .values(name=SYNC_NAME, cursor=settings.fingerprint, last_started_at=now, last_completed_at=now)
+            .on_conflict_do_update(
+                index_elements=[db.SyncState.name],
+                set_={"cursor": settings.fingerprint, "last_started_at": now, "last_completed_at": now},
+            )
+        )
+        await session.commit()
+    logger.info("Rewrote URLs of %d cards for %s", result.rowcount, settings.api_base_url)
+    return result.rowcount
+
+
+async def run() -> None:
+    """Startup task: refresh once the database is reachable."""
+    while not is_ready():
+        await asyncio.sleep(1)
+    try:
+        await refresh_stored_urls()
+    except Exception:
+        logger.exception("Card URL refresh failed")
+
+
+async def _main(force: bool) -> None:
+    updated = await refresh_stored_urls(force)
+    print(f"✅ Updated {updated} cards" if updated is not None else "✅ Card URLs already current")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rewrite stored card URLs from the current host settings")
+    parser.add_argument("--force", action="store_true", help="refresh even if the settings are unchanged")
+    asyncio.run(_main(parser.parse_args().force))
@@ -1,8 +1,14 @@
 import os
 import asyncio
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from fastapi import Request
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
-from typing import AsyncGenerator
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+from typing import AsyncGenerator, Callable
+
+from pool_metrics import metrics as pool_metrics, route_label
 
 # Get DATABASE_URL from environment and convert to asyncpg format
 DATABASE_URL = os.getenv(
@@ -18,8 +24,14 @@ elif DATABASE_URL.startswith("postgresql://"):
 
 print(f"🔗 Connecting to database: {DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'localhost'}")
 
+# Prepared statements cached per connection by the asyncpg dialect, so hot
+# lookups skip parse/plan. Set to 0 behind PgBouncer in transaction mode.
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
 engine = create_async_engine(
-    DATABASE_URL,
+    make_url(DATABASE_URL).update_query_dict(
+        {"prepared_statement_cache_size": str(PREPARED_STATEMENT_CACHE_SIZE)}
+    ),
     echo=False,  # Set to False in production to reduce logs
     future=True,
     pool_pre_ping=True,
@@ -27,6 +39,12 @@ engine = create_async_engine(
     max_overflow=10,
 )
 
+pool_metrics.install(engine)
+
+# Unpooled connections for session-level advisory locks held through a long
+# job, so the lock holder doesn't take a slot from the request pool
+lock_engine = create_async_engine(engine.url, poolclass=NullPool)
+
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
@@ -34,8 +52,14 @@ AsyncSessionLocal = sessionmaker(
 Base = declarative_base()
 
 
-async def get_db() -> AsyncGenerator:
-    """Dependency injection for database session."""
+async def get_db(request: Request) -> AsyncGenerator:
+    """Dependency injection for database session.
+
+    The session checks out a pooled connection at its first query and keeps
+    it until the transaction ends; see `release_connection`.
+    """
+    route = request.scope.get("route")
+    route_label.set(f"{request.method} {route.path}" if route else request.url.path)
     async with AsyncSessionLocal() as session:
         try:
             yield session
@@ -43,12 +67,76 @@ async def get_db() -> AsyncGenerator:
             await session.close()
 
 
+def after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """Run `callback` once the caller's transaction commits; dropped on rollback.
+
+    Services only flush, so side effects outside the database (caches, live
+    streams) must wait for the commit owned by the route.
+    """
+    session.sync_session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_commit(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("after_commit", None)
+
+
+async def release_connection(session: AsyncSession) -> None:
+    """Return the session's connection to the pool, e.g. before slow external calls.
+
+    Commits the current transaction (including anything pending), so call it
+    only between units of work. Loaded objects stay usable because sessions
+    don't expire on commit; the next query checks out a connection again.
+    """
+    if session.in_transaction():
+        await session.commit()
+
+
+_ready = False
+
+
+def is_ready() -> bool:
+    """Whether the database has been reached since startup."""
+    return _ready
+
+
+async def wait_for_db(retry_delay: float = 3):
+    """Poll the database until it accepts connections, then mark the app ready.
+
+    Runs in the background so the server binds and serves /api/health
+    immediately; /api/ready reports 503 until this completes.
+    """
+    global _ready
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            _ready = True
+            print("✅ Database reachable")
+            return
+        except Exception as e:
+            print(f"⏳ Database connection attempt {attempt} failed: {e}")
+            await asyncio.sleep(retry_delay)
+
+
 async def init_db():
-    """Create all database tables with retry logic."""
+    """Create all database tables with retry logic.
+
+    Schema creation is not part of app startup; run `python migrate.py`.
+    """
     max_retries = 30  # Increased retries for Railway startup
     retry_delay = 3  # seconds
     
-    print("🚀 Starting up... initializing database")
+    print("🚀 Initializing database schema")
     
     for attempt in range(max_retries):
         try:
@@ -1,36 +1,50 @@
-from sqlalchemy import Column, String, Boolean, DateTime, JSON, ForeignKey, Text, func, Numeric
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Boolean, DateTime, Date, JSON, ForeignKey, Text, func, Numeric, LargeBinary, Index, Integer, Float, text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, INET
 from sqlalchemy.orm import relationship
 from datetime import datetime
-import uuid
 
+from analytics_codes import ActionCode
 from database import Base
+from ids import uuid7
 
 
 class Company(Base):
     __tablename__ = "companies"
+    # Fetch server-set timestamps with RETURNING at flush, so services don't need a refresh
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String(255), nullable=False)
     domain = Column(String(255), unique=True, nullable=True)
+    domain_verification_token = Column(String(64), nullable=True)  # Published in a DNS TXT record to prove ownership
+    domain_verified_at = Column(DateTime, nullable=True)  # The domain is only served once set
     logo_url = Column(Text, nullable=True)
     brand_color = Column(String(7), nullable=True)
     slug = Column(String(255), unique=True, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime, nullable=True)  # Set when a purge is queued; the row goes when it finishes
+    timezone = Column(String(64), nullable=False, server_default="UTC")  # IANA name; analytics buckets follow it
 
     # Relationships
-    employees = relationship("Employee", back_populates="company", cascade="all, delete-orphan")
-    users = relationship("User", back_populates="company", cascade="all, delete-orphan")
-    subscriptions = relationship("Subscription", back_populates="company", cascade="all, delete-orphan")
-    analytics = relationship("AnalyticsEvent", back_populates="company", cascade="all, delete-orphan")
-    payment_methods = relationship("PaymentMethod", back_populates="company", cascade="all, delete-orphan")
+    # passive_deletes: children go through ON DELETE CASCADE instead of being loaded and deleted one by one
+    employees = relationship("Employee", back_populates="company", cascade="all, delete-orphan", passive_deletes=True)
+    users = relationship("User", back_populates="company", cascade="all, delete-orphan", passive_deletes=True)
+    subscriptions = relationship("Subscription", back_populates="company", cascade="all, delete-orphan", passive_deletes=True)
+    analytics = relationship("AnalyticsEvent", back_populates="company", cascade="all, delete-orphan", passive_deletes=True)
+    payment_methods = relationship("PaymentMethod", back_populates="company", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Prefix (LIKE 'acme-%') lookups for slug allocation
+        Index("ix_companies_slug_pattern", "slug", postgresql_ops={"slug": "varchar_pattern_ops"}),
+    )
 
 
 class Employee(Base):
     __tablename__ = "employees"
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     full_name = Column(String(255), nullable=False)
     job_title = Column(String(255), nullable=True)
@@ -46,14 +60,20 @@ class Employee(Base):
 
     # Relationships
     company = relationship("Company", back_populates="employees")
-    cards = relationship("Card", back_populates="employee", cascade="all, delete-orphan")
-    analytics = relationship("AnalyticsEvent", back_populates="employee", cascade="all, delete-orphan")
+    cards = relationship("Card", back_populates="employee", cascade="all, delete-orphan", passive_deletes=True)
+    analytics = relationship("AnalyticsEvent", back_populates="employee", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Prefix (LIKE 'jane-smith-%') lookups for slug allocation
+        Index("ix_employees_public_slug_pattern", "public_slug", postgresql_ops={"public_slug": "varchar_pattern_ops"}),
+    )
 
 
 class Card(Base):
     __tablename__ = "cards"
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=False)
     url = Column(Text, nullable=False)
     qr_code = Column(Text, nullable=True)
@@ -65,10 +85,24 @@ class Card(Base):
     employee = relationship("Employee", back_populates="cards")
 
 
+class ShortLink(Base):
+    """Short code (`/s/{code}`) encoded in QR payloads instead of the long card URLs."""
+    __tablename__ = "short_links"
+
+    code = Column(String(16), primary_key=True)
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=False)
+    target = Column(String(16), nullable=False, default="vcard")  # vcard | card
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("employee_id", "target", name="uq_short_links_employee_target"),
+    )
+
+
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=True)
     email = Column(String(255), unique=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
@@ -83,8 +117,9 @@ class User(Base):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     
     # Plan Information
@@ -119,43 +154,60 @@ class Subscription(Base):
     # Relationships
     company = relationship("Company", back_populates="subscriptions")
     invoices = relationship("Invoice", back_populates="subscription", cascade="all, delete-orphan")
-    payment_methods = relationship("PaymentMethod", back_populates="company", foreign_keys="PaymentMethod.company_id")
+    payment_methods = relationship(
+        "PaymentMethod",
+        primaryjoin="Subscription.company_id == foreign(PaymentMethod.company_id)",
+        viewonly=True,
+    )
 
 
 class Invoice(Base):
     __tablename__ = "invoices"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     subscription_id = Column(UUID(as_uuid=True), ForeignKey("subscriptions.id", ondelete="SET NULL"), nullable=True)
     
     # Stripe Integration
-    stripe_invoice_id = Column(String(255), nullable=True, unique=True)
+    stripe_invoice_id = Column(String(255), nullable=True, unique=True)  # NULL for the upcoming preview
+    stripe_subscription_id = Column(String(255), nullable=True)
     stripe_payment_intent_id = Column(String(255), nullable=True)
     
     # Invoice Details
     amount = Column(Numeric(10, 2), nullable=False)
     currency = Column(String(3), default="USD")
-    status = Column(String(50), nullable=False)  # paid | pending | failed | draft
+    status = Column(String(50), nullable=False)  # draft | open | paid | failed | void | upcoming
     
     # URLs
     invoice_pdf_url = Column(Text, nullable=True)
     hosted_invoice_url = Column(Text, nullable=True)
     
     # Dates
+    period_start = Column(DateTime, nullable=True)
+    period_end = Column(DateTime, nullable=True)
     paid_at = Column(DateTime, nullable=True)
     due_date = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, server_default=func.now())  # Stripe's creation time for mirrored invoices
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     # Relationships
     subscription = relationship("Subscription", back_populates="invoices")
 
+    __table_args__ = (
+        # Keyset pagination of a company's billing history
+        Index("ix_invoices_company_created", "company_id", "created_at", "id"),
+        # At most one upcoming-invoice preview per Stripe subscription
+        Index(
+            "uq_invoices_upcoming", "stripe_subscription_id",
+            unique=True, postgresql_where=text("status = 'upcoming'"),
+        ),
+    )
+
 
 class PaymentMethod(Base):
     __tablename__ = "payment_methods"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     
     # Stripe Integration
@@ -177,21 +229,154 @@ class PaymentMethod(Base):
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     # Relationships
-    company = relationship("Company", foreign_keys=[company_id])
+    company = relationship("Company", back_populates="payment_methods", foreign_keys=[company_id])
 
 
 class AnalyticsEvent(Base):
     __tablename__ = "analytics"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
     employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=True)
     timestamp = Column(DateTime, server_default=func.now())
-    device = Column(String(100), nullable=True)
-    region = Column(String(100), nullable=True)
-    action = Column(String(50), nullable=False)  # view | call | whatsapp | email | download_vcard | scan_qr
-    ip_address = Column(String(45), nullable=True)
+    # Compact encodings; services.AnalyticsRow presents them as strings again
+    device_id = Column(Integer, ForeignKey("analytics_devices.id"), nullable=True)
+    region_id = Column(Integer, ForeignKey("analytics_regions.id"), nullable=True)
+    action = Column(ActionCode, nullable=False)  # analytics_codes.ACTION_CODES
+    ip_address = Column(INET, nullable=True)
 
     # Relationships
     company = relationship("Company", back_populates="analytics")
     employee = relationship("Employee", back_populates="analytics")
+
+    __table_args__ = (
+        # Per-tenant reports and batched purges; the employee index also serves the FK cascade
+        Index("ix_analytics_company_timestamp", "company_id", "timestamp"),
+        Index("ix_analytics_employee_timestamp", "employee_id", "timestamp"),
+    )
+
+
+class AnalyticsDevice(Base):
+    """Distinct device names referenced by analytics rows."""
+    __tablename__ = "analytics_devices"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+
+class AnalyticsRegion(Base):
+    """Distinct region names referenced by analytics rows."""
+    __tablename__ = "analytics_regions"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+
+class AnalyticsSketch(Base):
+    """Daily HyperLogLog / top-k sketch for a card (employee) or a whole company."""
+    __tablename__ = "analytics_sketches"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=True)  # NULL = company-wide
+    day = Column(Date, nullable=False)
+    kind = Column(String(20), nullable=False)  # visitors | regions | devices
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index(
+            "uq_analytics_sketches_employee", "employee_id", "day", "kind",
+            unique=True, postgresql_where=text("employee_id IS NOT NULL"),
+        ),
+        Index(
+            "uq_analytics_sketches_company", "company_id", "day", "kind",
+            unique=True, postgresql_where=text("employee_id IS NULL"),
+        ),
+    )
+
+
+class StripeEvent(Base):
+    """Raw Stripe webhook event, queued for processing by the webhook worker."""
+    __tablename__ = "stripe_events"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    stripe_event_id = Column(String(255), unique=True, nullable=False)
+    type = Column(String(100), nullable=False)
+    customer_id = Column(String(255), nullable=True)  # Events are applied in order per customer
+    stripe_created = Column(DateTime, nullable=False)
+    payload = Column(JSON, nullable=False)
+
+    # Processing state
+    status = Column(String(20), nullable=False, default="pending")  # pending | processing | processed | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, server_default=func.now())
+    locked_at = Column(DateTime, nullable=True)
+    processed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_stripe_events_unfinished", "customer_id", "stripe_created",
+            postgresql_where=text("status IN ('pending', 'processing')"),
+        ),
+    )
+
+
+class SyncState(Base):
+    """Progress of a resumable background sync, keyed by job name."""
+    __tablename__ = "sync_state"
+
+    name = Column(String(100), primary_key=True)
+    cursor = Column(String(255), nullable=True)  # Last object id handled by the unfinished pass
+    last_started_at = Column(DateTime, nullable=True)
+    last_completed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class PurgeJob(Base):
+    """Background deletion of a company's data, in batches."""
+    __tablename__ = "purge_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    company_id = Column(UUID(as_uuid=True), nullable=False)  # No FK: the job outlives the company
+    company_name = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending | running | done | failed
+    analytics_deleted = Column(Integer, nullable=False, default=0)
+    employees_deleted = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    locked_at = Column(DateTime, nullable=True)  # Heartbeat of the worker running it
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_purge_jobs_company", "company_id"),
+        Index(
+            "ix_purge_jobs_unfinished", "created_at",
+            postgresql_where=text("status IN ('pending', 'running')"),
+        ),
+    )
+
+
+class CardTrend(Base):
+    """Latest activity trend of a card, recomputed daily by trends.py."""
+    __tablename__ = "card_trends"
+
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), primary_key=True)
+    company_id = Column(UUID(as_uuid=True), ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(20), nullable=False)  # trending | dropping | inactive | new | normal
+    recent_count = Column(Integer, nullable=False)  # Events in the recent window
+    baseline_mean = Column(Float, nullable=True)  # Mean and std of rolling window totals before it
+    baseline_std = Column(Float, nullable=True)
+    growth_rate = Column(Float, nullable=True)  # recent / baseline mean - 1, smoothed by one event
+    z_score = Column(Float, nullable=True)
+    last_active = Column(Date, nullable=True)  # Last day with events within the history loaded
+    computed_for = Column(Date, nullable=False)  # Last (UTC) day included
+    computed_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_card_trends_company_status", "company_id", "status"),
+    )
@@ -0,0 +1,85 @@
+"""
+Analytics Enrichment
+Device class from the User-Agent and region from the client IP, derived server-side and cached
+"""
+import os
+import re
+from typing import Optional, Tuple
+
+import geoip
+from cache import LRUCache
+
+DEVICE_MOBILE = "mobile"
+DEVICE_TABLET = "tablet"
+DEVICE_DESKTOP = "desktop"
+DEVICE_OTHER = "other"
+DEVICES = {DEVICE_MOBILE, DEVICE_TABLET, DEVICE_DESKTOP, DEVICE_OTHER}
+
+# Client-sent regions are only kept as ISO 3166 country codes, like the geoip ones
+_COUNTRY_CODE = re.compile(r"^[A-Za-z]{2}$")
+
+# Checked in order: tablets first, since many tablet user agents also say "Mobile" or "Android"
+_TABLET = re.compile(r"ipad|tablet|kindle|silk/|playbook|nexus (7|9|10)|sm-t\d|android(?!.*mobi)", re.IGNORECASE)
+_MOBILE = re.compile(r"mobi|iphone|ipod|android|windows phone|blackberry|bb10|opera mini|iemobile", re.IGNORECASE)
+_DESKTOP = re.compile(r"windows nt|macintosh|mac os x|x11|cros|linux", re.IGNORECASE)
+
+_devices = LRUCache(int(os.getenv("ENRICHMENT_UA_CACHE_SIZE", "10000")))
+_regions = LRUCache(int(os.getenv("ENRICHMENT_IP_CACHE_SIZE", "100000")))
+_NOT_FOUND = ""  # Cached marker for addresses outside the database
+
+geo_database = geoip.open_default()
+
+
+def device_class(user_agent: Optional[str]) -> Optional[str]:
+    """mobile | tablet | desktop | other, or None without a user agent."""
+    if not user_agent:
+        return None
+    device = _devices.get(user_agent)
+    if device is None:
+        if _TABLET.search(user_agent):
+            device = DEVICE_TABLET
+        elif _MOBILE.search(user_agent):
+            device = DEVICE_MOBILE
+        elif _DESKTOP.search(user_agent):
+            device = DEVICE_DESKTOP
+        else:
+            device = DEVICE_OTHER
+        _devices.put(user_agent, device)
+    return device
+
+
+def region(ip: Optional[str]) -> Optional[str]:
+    """Country code of an address, if a geoip database is installed and covers it."""
+    if not ip or geo_database is None:
+        return None
+    found = _regions.get(ip)
+    if found is None:
+        found = geo_database.lookup(ip) or _NOT_FOUND
+        _regions.put(ip, found)
+    return found or None
+
+
+def describe(user_agent: Optional[str], ip: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(device class, region) of a visitor."""
+    return device_class(user_agent), region(ip)
+
+
+def client_values(device: Optional[str], region: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(device class, region) sent by a client, each dropped unless it is from the fixed set.
+
+    Keeps client input from adding arbitrary rows to the lookup tables.
+    """
+    device = (device or "").strip().lower()
+    region = (region or "").strip()
+    return (
+        device if device in DEVICES else None,
+        region.upper() if _COUNTRY_CODE.match(region) else None,
+    )
+
+
+def stats() -> dict:
+    return {
+        "geoip_database": geo_database.path if geo_database else None,
+        "device_cache": {"size": len(_devices), "hits": _devices.hits, "misses": _devices.misses},
+        "region_cache": {"size": len(_regions), "hits": _regions.hits, "misses": _regions.misses},
+    }
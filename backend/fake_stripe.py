@@ -0,0 +1,526 @@
+"""
+Fake Stripe Server
+In-memory stand-in for the parts of the Stripe API used by StripeService
+
+Usage:
+    python fake_stripe.py
+
+Then run the API with:
+    STRIPE_API_BASE=http://localhost:12111
+    STRIPE_SECRET_KEY=sk_test_fake          (any value; the SDK requires one)
+    STRIPE_WEBHOOK_SECRET=whsec_fake        (shared with this server)
+
+Opening a checkout session's `url` (or POSTing to
+/_fake/checkout/{id}/complete) completes it: the subscription and a paid
+invoice are created and signed webhooks are delivered to
+FAKE_STRIPE_WEBHOOK_URL. Latency and error injection are set with the
+FAKE_STRIPE_LATENCY_MS / FAKE_STRIPE_ERROR_RATE env vars or at runtime
+with POST /_fake/config.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+
+from subscription_config import PLAN_PRICES, STRIPE_PRICE_IDS
+
+PORT = int(os.getenv("FAKE_STRIPE_PORT", "12111"))
+BASE_URL = os.getenv("FAKE_STRIPE_BASE_URL", f"http://localhost:{PORT}")
+WEBHOOK_URL = os.getenv("FAKE_STRIPE_WEBHOOK_URL", "http://localhost:8000/api/webhooks/stripe")
+WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "whsec_fake")
+
+DEFAULT_UNIT_AMOUNT = 1000
+PERIOD_SECONDS = {"month": 30 * 86400, "year": 365 * 86400}
+
+
+class FakeStripeError(Exception):
+    def __init__(self, status_code: int, message: str, error_type: str = "invalid_request_error"):
+        self.status_code = status_code
+        self.message = message
+        self.error_type = error_type
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def parse_form(pairs: List[tuple]) -> Dict[str, Any]:
+    """Turn Stripe's bracket notation (`items[0][price]=x`) into nested dicts and lists."""
+    root: Dict[str, Any] = {}
+    for key, value in pairs:
+        parts = key.replace("]", "").split("[")
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _listify(root)
+
+
+def _listify(node: Any) -> Any:
+    if not isinstance(node, dict):
+        return node
+    node = {key: _listify(value) for key, value in node.items()}
+    if node and all(key.isdigit() for key in node):
+        return [node[key] for key in sorted(node, key=int)]
+    return node
+
+
+def _price_catalog() -> Dict[str, Dict[str, Any]]:
+    """Unit amounts and intervals for the price ids configured in subscription_config."""
+    catalog = {}
+    for currency, ids in STRIPE_PRICE_IDS.items():
+        for key, price_id in ids.items():
+            plan, cycle = key.rsplit("_", 1)
+            catalog[price_id] = {
+                "currency": currency.lower(),
+                "unit_amount": int(round(PLAN_PRICES[currency][plan][cycle] * 100)),
+                "interval": "year" if cycle == "yearly" else "month",
+            }
+    return catalog
+
+
+def sign_payload(payload: str, secret: str, timestamp: Optional[int] = None) -> str:
+    """Build a `Stripe-Signature` header value for a webhook payload."""
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class FakeStripe:
+    """In-memory Stripe account."""
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_STRIPE_LATENCY_MS", "0"))
+        self.error_rate = float(os.getenv("FAKE_STRIPE_ERROR_RATE", "0"))
+        self.webhook_url = WEBHOOK_URL
+        self.webhook_secret = WEBHOOK_SECRET
+        self.prices = _price_catalog()
+        self.reset()
+
+    def reset(self) -> None:
+        self.objects: Dict[str, Dict[str, Dict[str, Any]]] = {
+            "customer": {}, "checkout.session": {}, "subscription": {},
+            "invoice": {}, "billing_portal.session": {}, "payment_method": {},
+        }
+        self.webhooks_sent = 0
+        self.webhook_failures = 0
+
+    # ========== Storage ==========
+
+    def store(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        self.objects[obj["object"]][obj["id"]] = obj
+        return obj
+
+    def get(self, kind: str, object_id: str) -> Dict[str, Any]:
+        obj = self.objects[kind].get(object_id)
+        if obj is None:
+            raise FakeStripeError(404, f"No such {kind.split('.')[-1]}: '{object_id}'")
+        return obj
+
+    def list(self, kind: str, params: Dict[str, Any], **filters) -> Dict[str, Any]:
+        """Newest-first list with Stripe's `limit` / `starting_after` pagination."""
+        items = sorted(self.objects[kind].values(), key=lambda o: (o["created"], o["id"]), reverse=True)
+        items = [o for o in items if all(v is None or o.get(k) == v for k, v in filters.items())]
+        if params.get("starting_after"):
+            ids = [o["id"] for o in items]
+            if params["starting_after"] in ids:
+                items = items[ids.index(params["starting_after"]) + 1:]
+        limit = min(int(params.get("limit", 10)), 100)
+        return {"object": "list", "data": items[:limit], "has_more": len(items) > limit, "url": f"/v1/{kind}s"}
+
+    # ========== Objects ==========
+
+    def price(self, price_id: str) -> Dict[str, Any]:
+        info = self.prices.get(price_id, {"currency": "usd", "unit_amount": DEFAULT_UNIT_AMOUNT, "interval": "month"})
+        return {
+            "id": price_id, "object": "price", "currency": info["currency"],
+            "unit_amount": info["unit_amount"], "recurring": {"interval": info["interval"]},
+        }
+
+    def create_subscription(
+        self, customer: str, price_id: str, trial_days: int = 0, metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        now = int(time.time())
+        price = self.price(price_id)
+        trial_end = now + trial_days * 86400 if trial_days else None
+        period_end = trial_end or now + PERIOD_SECONDS[price["recurring"]["interval"]]
+        subscription_id = _new_id("sub")
+        return self.store({
+            "id": subscription_id, "object": "subscription", "customer": customer,
+            "status": "trialing" if trial_end else "active",
+            "items": {"object": "list", "data": [{"id": _new_id("si"), "object": "subscription_item", "price": price}]},
+            "currency": price["currency"], "metadata": metadata or {},
+            "created": now, "start_date": now, "trial_end": trial_end,
+            "current_period_start": now, "current_period_end": period_end,
+            "cancel_at_period_end": False, "cancel_at": None, "canceled_at": None, "ended_at": None,
+        })
+
+    def create_invoice(self, subscription: Dict[str, Any], paid: bool = True) -> Dict[str, Any]:
+        now = int(time.time())
+        price = subscription["items"]["data"][0]["price"]
+        amount = 0 if subscription["status"] == "trialing" else price["unit_amount"]
+        invoice_id = _new_id("in")
+        return self.store({
+            "id": invoice_id, "object": "invoice",
+            "customer": subscription["customer"], "subscription": subscription["id"],
+            "status": "paid" if paid else "open", "currency": price["currency"],
+            "amount_due": amount, "amount_paid": amount if paid else 0, "total": amount,
+            "created": now, "due_date": None,
+            "period_start": subscription["current_period_start"], "period_end": subscription["current_period_end"],
+            "status_transitions": {"finalized_at": now, "paid_at": now if paid else None},
+            "payment_intent": _new_id("pi"),
+            "invoice_pdf": f"{BASE_URL}/_fake/invoices/{invoice_id}.pdf",
+            "hosted_invoice_url": f"{BASE_URL}/_fake/invoices/{invoice_id}",
+            "subscription_details": {"metadata": subscription["metadata"]},
+        })
+
+    def upcoming_invoice(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        """Preview of the renewal invoice (has no id, like Stripe's)."""
+        price = subscription["items"]["data"][0]["price"]
+        renews_at = subscription["current_period_end"]
+        return {
+            "id": None, "object": "invoice", "customer": subscription["customer"],
+            "subscription": subscription["id"], "status": "draft",
+            "currency": price["currency"], "amount_due": price["unit_amount"], "amount_paid": 0,
+            "total": price["unit_amount"], "created": renews_at, "next_payment_attempt": renews_at,
+            "period_start": renews_at,
+            "period_end": renews_at + PERIOD_SECONDS[price["recurring"]["interval"]],
+            "subscription_details": {"metadata": subscription["metadata"]},
+        }
+
+    # ========== Webhooks ==========
+
+    def event(self, event_type: str, obj: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": _new_id("evt"), "object": "event", "api_version": "2023-10-16",
+            "type": event_type, "created": int(time.time()),
+            "data": {"object": obj}, "livemode": False, "pending_webhooks": 1,
+        }
+
+    async def send_webhooks(self, events: List[Dict[str, Any]]) -> None:
+        """Deliver events in order, signed like Stripe does."""
+        async with httpx.AsyncClient(timeout=10) as client:
+            for event in events:
+                payload = json.dumps(event)
+                try:
+                    response = await client.post(
+                        self.webhook_url,
+                        content=payload,
+                        headers={
+                            "Content-Type": "application/json",
+                            "Stripe-Signature": sign_payload(payload, self.webhook_secret),
+                        },
+                    )
+                    response.raise_for_status()
+                    self.webhooks_sent += 1
+                except httpx.HTTPError as e:
+                    self.webhook_failures += 1
+                    print(f"❌ Webhook {event['type']} failed: {e}")
+
+    def complete_checkout(self, session_id: str) -> List[Dict[str, Any]]:
+        session = self.get("checkout.session", session_id)
+        if session["status"] == "complete":
+            raise FakeStripeError(400, "This Checkout Session is already complete")
+
+        subscription_data = session.get("subscription_data") or {}
+        subscription = self.create_subscription(
+            session["customer"],
+            session["line_items"][0]["price"],
+            trial_days=int(subscription_data.get("trial_period_days") or 0),
+            metadata=subscription_data.get("metadata") or session["metadata"],
+        )
+        invoice = self.create_invoice(subscription)
+        session.update({
+            "status": "complete", "payment_status": "paid",
+            "subscription": subscription["id"], "invoice": invoice["id"],
+            "amount_total": invoice["total"],
+        })
+        return [
+            self.event("customer.subscription.created", subscription),
+            self.event("invoice.created", invoice),
+            self.event("invoice.paid", invoice),
+            self.event("checkout.session.completed", session),
+        ]
+
+
+state = FakeStripe()
+app = FastAPI(title="Fake Stripe")
+
+
+@app.exception_handler(FakeStripeError)
+async def stripe_error_handler(request: Request, exc: FakeStripeError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": {"type": exc.error_type, "message": exc.message}},
+    )
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    if request.url.path.startswith("/v1/"):
+        if state.latency_ms:
+            await asyncio.sleep(state.latency_ms / 1000)
+        if state.error_rate and random.random() < state.error_rate:
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"type": "api_error", "message": "Injected failure"}},
+            )
+    return await call_next(request)
+
+
+async def _params(request: Request) -> Dict[str, Any]:
+    pairs = list(request.query_params.multi_items())
+    if request.method in ("POST", "DELETE"):
+        pairs += parse_qsl((await request.body()).decode(), keep_blank_values=True)
+    return parse_form(pairs)
+
+
+def _emit(background: List[Dict[str, Any]]) -> None:
+    asyncio.get_running_loop().create_task(state.send_webhooks(background))
+
+
+# ========== Customers ==========
+
+@app.post("/v1/customers")
+async def create_customer(request: Request):
+    params = await _params(request)
+    return state.store({
+        "id": _new_id("cus"), "object": "customer", "created": int(time.time()),
+        "email": params.get("email"), "name": params.get("name"),
+        "metadata": params.get("metadata") or {},
+        "invoice_settings": {"default_payment_method": None},
+    })
+
+
+@app.get("/v1/customers/{customer_id}")
+async def get_customer(customer_id: str):
+    return state.get("customer", customer_id)
+
+
+@app.post("/v1/customers/{customer_id}")
+async def update_customer(customer_id: str, request: Request):
+    customer = state.get("customer", customer_id)
+    params = await _params(request)
+    for key in ("email", "name"):
+        if key in params:
+            customer[key] = params[key]
+    customer["metadata"].update(params.get("metadata") or {})
+    customer["invoice_settings"].update(params.get("invoice_settings") or {})
+    return customer
+
+
+# ========== Checkout & Portal ==========
+
+@app.post("/v1/checkout/sessions")
+async def create_checkout_session(request: Request):
+    params = await _params(request)
+    state.get("customer", params.get("customer", ""))
+    line_items = params.get("line_items") or []
+    if not line_items:
+        raise FakeStripeError(400, "Missing required param: line_items.")
+
+    price = state.price(line_items[0]["price"])
+    session_id = _new_id("cs_test")
+    return state.store({
+        "id": session_id, "object": "checkout.session", "created": int(time.time()),
+        "customer": params["customer"], "mode": params.get("mode", "subscription"),
+        "line_items": line_items, "subscription_data": params.get("subscription_data"),
+        "success_url": params.get("success_url"), "cancel_url": params.get("cancel_url"),
+        "metadata": params.get("metadata") or {},
+        "currency": price["currency"], "amount_total": price["unit_amount"],
+        "status": "open", "payment_status": "unpaid", "subscription": None,
+        "url": f"{BASE_URL}/_fake/checkout/{session_id}",
+    })
+
+
+@app.post("/v1/billing_portal/sessions")
+async def create_portal_session(request: Request):
+    params = await _params(request)
+    state.get("customer", params.get("customer", ""))
+    session_id = _new_id("bps")
+    return state.store({
+        "id": session_id, "object": "billing_portal.session", "created": int(time.time()),
+        "customer": params["customer"], "return_url": params.get("return_url"),
+        "url": f"{BASE_URL}/_fake/portal/{session_id}",
+    })
+
+
+# ========== Subscriptions ==========
+
+@app.get("/v1/subscriptions")
+async def list_subscriptions(request: Request):
+    params = await _params(request)
+    status = params.get("status")
+    return state.list(
+        "subscription", params,
+        customer=params.get("customer"),
+        status=None if status in (None, "all") else status,
+    )
+
+
+@app.post("/v1/subscriptions")
+async def create_subscription(request: Request):
+    params = await _params(request)
+    state.get("customer", params.get("customer", ""))
+    trial_days = 0
+    if params.get("trial_end"):
+        trial_days = max(0, round((int(params["trial_end"]) - time.time()) / 86400))
+    subscription = state.create_subscription(
+        params["customer"], params["items"][0]["price"], trial_days, params.get("metadata"),
+    )
+    invoice = state.create_invoice(subscription)
+    _emit([
+        state.event("customer.subscription.created", subscription),
+        state.event("invoice.paid", invoice),
+    ])
+    return subscription
+
+
+@app.get("/v1/subscriptions/{subscription_id}")
+async def get_subscription(subscription_id: str):
+    return state.get("subscription", subscription_id)
+
+
+@app.post("/v1/subscriptions/{subscription_id}")
+async def update_subscription(subscription_id: str, request: Request):
+    subscription = state.get("subscription", subscription_id)
+    params = await _params(request)
+    if "cancel_at_period_end" in params:
+        cancel = params["cancel_at_period_end"].lower() == "true"
+        subscription["cancel_at_period_end"] = cancel
+        subscription["cancel_at"] = subscription["current_period_end"] if cancel else None
+    if params.get("items"):
+        item = subscription["items"]["data"][0]
+        item["price"] = state.price(params["items"][0]["price"])
+    subscription["metadata"].update(params.get("metadata") or {})
+    _emit([state.event("customer.subscription.updated", subscription)])
+    return subscription
+
+
+@app.delete("/v1/subscriptions/{subscription_id}")
+async def cancel_subscription(subscription_id: str):
+    subscription = state.get("subscription", subscription_id)
+    now = int(time.time())
+    subscription.update({"status": "canceled", "canceled_at": now, "ended_at": now})
+    _emit([state.event("customer.subscription.deleted", subscription)])
+    return subscription
+
+
+# ========== Invoices ==========
+
+@app.get("/v1/invoices")
+async def list_invoices(request: Request):
+    params = await _params(request)
+    return state.list(
+        "invoice", params,
+        customer=params.get("customer"),
+        subscription=params.get("subscription"),
+        status=params.get("status"),
+    )
+
+
+@app.get("/v1/invoices/upcoming")
+async def upcoming_invoice(request: Request):
+    params = await _params(request)
+    active = [
+        s for s in state.objects["subscription"].values()
+        if s["customer"] == params.get("customer") and s["status"] in ("active", "trialing", "past_due")
+        and not s["cancel_at_period_end"]
+    ]
+    if not active:
+        raise FakeStripeError(404, "No upcoming invoices for customer")
+
+    return state.upcoming_invoice(max(active, key=lambda s: s["created"]))
+
+
+@app.get("/v1/invoices/{invoice_id}")
+async def get_invoice(invoice_id: str):
+    return state.get("invoice", invoice_id)
+
+
+# ========== Payment Methods ==========
+
+@app.post("/v1/payment_methods/{payment_method_id}/attach")
+async def attach_payment_method(payment_method_id: str, request: Request):
+    params = await _params(request)
+    state.get("customer", params.get("customer", ""))
+    return state.store({
+        "id": payment_method_id, "object": "payment_method", "created": int(time.time()),
+        "type": "card", "customer": params["customer"],
+        "card": {"brand": "visa", "last4": "4242", "exp_month": 12, "exp_year": 2030},
+    })
+
+
+# ========== Test Controls ==========
+
+@app.get("/_fake/checkout/{session_id}")
+async def open_checkout(session_id: str):
+    """Browser flow: completing the hosted page redirects to the success URL."""
+    events = state.complete_checkout(session_id)
+    await state.send_webhooks(events)
+    return RedirectResponse(state.get("checkout.session", session_id)["success_url"], status_code=303)
+
+
+@app.post("/_fake/checkout/{session_id}/complete")
+async def complete_checkout(session_id: str):
+    events = state.complete_checkout(session_id)
+    await state.send_webhooks(events)
+    return {"session": state.get("checkout.session", session_id), "events": [e["type"] for e in events]}
+
+
+@app.post("/_fake/subscriptions/{subscription_id}/upcoming")
+async def send_upcoming(subscription_id: str):
+    """Emit the `invoice.upcoming` webhook Stripe sends a few days before renewal."""
+    invoice = state.upcoming_invoice(state.get("subscription", subscription_id))
+    await state.send_webhooks([state.event("invoice.upcoming", invoice)])
+    return invoice
+
+
+@app.get("/_fake/portal/{session_id}")
+async def open_portal(session_id: str):
+    return RedirectResponse(state.get("billing_portal.session", session_id)["return_url"], status_code=303)
+
+
+@app.get("/_fake/config")
+async def get_config():
+    return {
+        "latency_ms": state.latency_ms,
+        "error_rate": state.error_rate,
+        "webhook_url": state.webhook_url,
+        "webhooks_sent": state.webhooks_sent,
+        "webhook_failures": state.webhook_failures,
+        "objects": {kind: len(objects) for kind, objects in state.objects.items()},
+    }
+
+
+@app.post("/_fake/config")
+async def set_config(request: Request):
+    params = await request.json()
+    if "latency_ms" in params:
+        state.latency_ms = float(params["latency_ms"])
+    if "error_rate" in params:
+        state.error_rate = float(params["error_rate"])
+    if "webhook_url" in params:
+        state.webhook_url = params["webhook_url"]
+    return await get_config()
+
+
+@app.post("/_fake/reset")
+async def reset():
+    state.reset()
+    return {"status": "reset"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
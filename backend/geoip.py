@@ -0,0 +1,167 @@
+"""
+Offline IP Geolocation
+Country lookups from a local IP-range file: memory-mapped and binary-searched, no network service
+
+Building the file (from a start_ip,end_ip,country CSV such as the free
+DB-IP "IP to Country Lite" download):
+    python geoip.py build dbip-country-lite.csv geoip.bin
+    python geoip.py lookup geoip.bin 203.0.113.7
+
+File layout (big-endian):
+    magic "BCGEOIP1" | uint32 record count | uint16 name count
+    names: uint8 length + ASCII, repeated
+    records: 16-byte start | 16-byte end | uint16 name index, sorted by start
+Addresses are 16 bytes, IPv4 as IPv4-mapped IPv6, so raw bytes compare in
+address order and the search never converts them to integers.
+"""
+import argparse
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BCGEOIP1"
+HEADER = struct.Struct(">8sIH")
+RECORD = struct.Struct(">16s16sH")
+NAME_LENGTH = struct.Struct(">B")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geoip.bin")
+
+
+def packed(address: str) -> bytes:
+    """16-byte form of an IPv4 or IPv6 address; raises ValueError if invalid."""
+    ip = ipaddress.ip_address(address.strip())
+    if ip.version == 4:
+        ip = ipaddress.IPv6Address(b"\0" * 10 + b"\xff\xff" + ip.packed)
+    return ip.packed
+
+
+class GeoIPDatabase:
+    """Read-only view of a range file; lookups are a binary search over the mapping."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, name_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a geoip range file")
+        offset = HEADER.size
+        self.names: List[str] = []
+        for _ in range(name_count):
+            (length,) = NAME_LENGTH.unpack_from(self._map, offset)
+            offset += NAME_LENGTH.size
+            self.names.append(self._map[offset:offset + length].decode("ascii"))
+            offset += length
+        self._records = offset
+
+    def lookup(self, address: str) -> Optional[str]:
+        """Country code for an address, or None if unknown or invalid."""
+        try:
+            key = packed(address)
+        except ValueError:
+            return None
+        # Last record whose start <= key
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._map[self._records + mid * RECORD.size:self._records + mid * RECORD.size + 16]
+            if start <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        _, end, name = RECORD.unpack_from(self._map, self._records + (lo - 1) * RECORD.size)
+        return self.names[name] if key <= end else None
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def open_default() -> Optional[GeoIPDatabase]:
+    """The database at GEOIP_DB_PATH, or None (enrichment without regions) if there is none."""
+    path = os.getenv("GEOIP_DB_PATH", DEFAULT_PATH)
+    if not os.path.exists(path):
+        logger.info("No geoip database at %s; regions won't be derived from IPs", path)
+        return None
+    try:
+        return GeoIPDatabase(path)
+    except (OSError, ValueError, struct.error):
+        logger.exception("Could not open geoip database %s", path)
+        return None
+
+
+# ========== Builder ==========
+
+def build(rows: Iterable[Tuple[str, str, str]], path: str) -> int:
+    """Write a range file from (start_ip, end_ip, name) rows; returns the record count.
+
+    Adjacent ranges with the same name are merged; ranges overlapping an
+    earlier one are skipped.
+    """
+    ranges = []
+    for start, end, name in rows:
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            ranges.append((packed(start), packed(end), name))
+        except ValueError:
+            continue
+    ranges.sort()
+
+    merged: List[list] = []
+    for start, end, name in ranges:
+        if merged and start <= merged[-1][1]:
+            continue  # Overlap
+        if (
+            merged and merged[-1][2] == name
+            and int.from_bytes(start, "big") == int.from_bytes(merged[-1][1], "big") + 1
+        ):
+            merged[-1][1] = end
+        else:
+            merged.append([start, end, name])
+
+    names = sorted({name for _, _, name in merged})
+    index = {name: i for i, name in enumerate(names)}
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(merged), len(names)))
+        for name in names:
+            encoded = name.encode("ascii")
+            f.write(NAME_LENGTH.pack(len(encoded)) + encoded)
+        for start, end, name in merged:
+            f.write(RECORD.pack(start, end, index[name]))
+    return len(merged)
+
+
+def _read_csv(path: str):
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) >= 3 and not row[0].startswith("#"):
+                yield row[0], row[1], row[2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the offline geoip database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="convert a start_ip,end_ip,country CSV")
+    build_parser.add_argument("csv")
+    build_parser.add_argument("output", nargs="?", default=DEFAULT_PATH)
+    lookup_parser = commands.add_parser("lookup", help="look up addresses")
+    lookup_parser.add_argument("database")
+    lookup_parser.add_argument("addresses", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build(_read_csv(args.csv), args.output)
+        print(f"✅ Wrote {count} ranges to {args.output}")
+    else:
+        database = GeoIPDatabase(args.database)
+        for address in args.addresses:
+            print(f"{address}\t{database.lookup(address) or '-'}")
@@ -0,0 +1,38 @@
+"""
+Primary Key Generation
+Time-ordered UUIDs (version 7), so new rows land at the right edge of primary key indexes
+"""
+import secrets
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """A UUIDv7: 48-bit Unix milliseconds, a 12-bit counter and 62 random bits.
+
+    The counter keeps ids from one process increasing within a millisecond
+    (and across small clock steps backwards); it starts at a random value in
+    its lower half so several processes still interleave rather than collide.
+    """
+    global _last_ms, _counter
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms, _counter = ms, secrets.randbits(11)
+        else:
+            _counter += 1
+            if _counter > 0xFFF:
+                # Counter exhausted: borrow the next millisecond
+                _last_ms, _counter = _last_ms + 1, secrets.randbits(11)
+        ms, counter = _last_ms, _counter
+    return uuid.UUID(int=(ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | secrets.randbits(62))
+
+
+def timestamp_ms(value: uuid.UUID) -> int:
+    """Creation time of a UUIDv7 in Unix milliseconds."""
+    return value.int >> 80
@@ -1,20 +1,71 @@
 import os
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.trustedhost import TrustedHostMiddleware
 
-from database import init_db
-from routes import router
+import card_urls
+import purge
+import trends
+from analytics_stream import broker
+from database import wait_for_db
+from profiling import LOOP_MONITOR_ENABLED, loop_monitor
+from reconciler import RECONCILE_ENABLED, reconciler
+from routes import router, short_link_router
+from sketch_service import aggregator
+from stripe_service import get_stripe
+from tenant_hosts import TenantHostMiddleware, host_map
+from webhook_worker import worker as webhook_worker
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_stripe() -> None:
+    """Import the Stripe SDK off the request path, reporting it if that fails."""
+    try:
+        await asyncio.to_thread(get_stripe)
+    except Exception:
+        logger.exception("Could not import the Stripe SDK; billing requests will fail")
+
 
 # Lifespan event
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    await init_db()
+    # Startup: bind immediately; the schema is created by `python migrate.py`
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    db_waiter = asyncio.create_task(wait_for_db())
+    sketch_flusher = asyncio.create_task(aggregator.run())
+    stream_listener = asyncio.create_task(broker.run())
+    webhook_processor = asyncio.create_task(webhook_worker.run())
+    host_refresher = asyncio.create_task(host_map.run())
+    card_url_refresher = asyncio.create_task(card_urls.run())
+    purger = asyncio.create_task(purge.worker.run())
+    stripe_reconciler = asyncio.create_task(reconciler.run()) if RECONCILE_ENABLED else None
+    trend_scorer = asyncio.create_task(trends.run()) if trends.TRENDS_ENABLED else None
+    stripe_warmer = asyncio.create_task(warm_up_stripe())
     yield
     # Shutdown
     print("👋 Shutting down...")
+    loop_monitor.stop()
+    db_waiter.cancel()
+    stripe_warmer.cancel()
+    webhook_processor.cancel()
+    host_refresher.cancel()
+    card_url_refresher.cancel()
+    purger.cancel()
+    if stripe_reconciler:
+        stripe_reconciler.cancel()
+    if trend_scorer:
+        trend_scorer.cancel()
+    stream_listener.cancel()
+    broker.close_all()
+    sketch_flusher.cancel()
+    # Let an interrupted flush put its sketches back before the final one
+    with suppress(asyncio.CancelledError):
+        await sketch_flusher
+    await aggregator.flush()
 
 
 # Create FastAPI app
@@ -34,14 +85,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Trusted hosts middleware
-app.add_middleware(
-    TrustedHostMiddleware,
-    allowed_hosts=os.getenv("ALLOWED_HOSTS", "localhost,127.0.0.1,192.168.1.123").split(","),
-)
+# Trusted hosts (ALLOWED_HOSTS plus company custom domains) and custom-domain card routing
+app.add_middleware(TenantHostMiddleware)
 
 # Include router
 app.include_router(router)
+app.include_router(short_link_router)
 
 
 @app.get("/")
@@ -0,0 +1,196 @@
+"""
+Database Migration Command
+Creates the schema explicitly instead of on app startup
+
+Usage:
+    python migrate.py                   # create tables, apply upgrades
+    python migrate.py rekey-analytics   # one-off: time-ordered ids for existing analytics rows
+    python migrate.py compact-analytics # one-off: convert a pre-existing analytics table to the compact encoding
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import text
+
+import database_models  # noqa: F401  (registers all tables on Base.metadata)
+from analytics_codes import ACTION_CODES
+from database import init_db, engine
+
+# Columns and indexes added to tables that already exist in deployed
+# databases (create_all only creates missing tables). Each must be idempotent.
+UPGRADES = [
+    # Complete invoice mirror
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS stripe_subscription_id VARCHAR(255)",
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS period_start TIMESTAMP",
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS period_end TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_invoices_company_created ON invoices (company_id, created_at, id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_invoices_upcoming ON invoices (stripe_subscription_id) "
+    "WHERE status = 'upcoming'",
+    # Slug allocation
+    "CREATE INDEX IF NOT EXISTS ix_companies_slug_pattern ON companies (slug varchar_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_employees_public_slug_pattern ON employees (public_slug varchar_pattern_ops)",
+    # Company purge
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_analytics_company_timestamp ON analytics (company_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_analytics_employee_timestamp ON analytics (employee_id, timestamp)",
+    # Analytics time series
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS timezone VARCHAR(64) NOT NULL DEFAULT 'UTC'",
+    # Custom domain verification
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS domain_verification_token VARCHAR(64)",
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS domain_verified_at TIMESTAMP",
+]
+
+
+async def upgrade_schema():
+    async with engine.begin() as conn:
+        for statement in UPGRADES:
+            await conn.execute(text(statement))
+    print("✅ Schema upgrades applied")
+
+
+# UUIDv7 for a given time: 48-bit Unix milliseconds over a random v4 UUID,
+# with the version nibble turned from 4 (0100) into 7 (0111)
+UUID7_AT_FUNCTION = """
+CREATE OR REPLACE FUNCTION uuid7_at(ts timestamp) RETURNS uuid
+LANGUAGE sql VOLATILE AS $$
+    SELECT encode(
+        set_bit(set_bit(
+            overlay(uuid_send(gen_random_uuid())
+                    placing substring(int8send(floor(extract(epoch FROM ts) * 1000)::bigint) FROM 3)
+                    FROM 1 FOR 6),
+            52, 1), 53, 1),
+        'hex')::uuid
+$$
+"""
+
+
+async def rekey_analytics():
+    """Give existing analytics rows UUIDv7 ids derived from their timestamps.
+
+    Nothing references analytics ids, so they are rewritten in place and the
+    table is then compacted, leaving the primary key index in insert order.
+    Both steps take an exclusive lock on analytics: run in a maintenance
+    window. Other tables keep their ids; only new rows get UUIDv7 keys.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text(UUID7_AT_FUNCTION))
+        result = await conn.execute(text(
+            "UPDATE analytics SET id = uuid7_at(coalesce(timestamp, now()::timestamp)) "
+            "WHERE substring(id::text, 15, 1) <> '7'"
+        ))
+    print(f"✅ Rekeyed {result.rowcount} analytics rows")
+    # VACUUM can't run inside a transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM (FULL, ANALYZE) analytics"))
+    print("✅ analytics compacted")
+    await engine.dispose()
+
+
+# Text -> inet, NULL for anything Postgres won't parse (instead of failing the cast);
+# a session-local function, gone with the connection
+SAFE_INET_FUNCTION = """
+CREATE OR REPLACE FUNCTION pg_temp.safe_inet(value text) RETURNS inet
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    RETURN trim(value)::inet;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$
+"""
+
+
+async def has_legacy_analytics(conn) -> bool:
+    """True while analytics still has the text columns from before the compact encoding."""
+    return bool(await conn.scalar(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'analytics' AND column_name = 'device'"
+    )))
+
+
+async def compact_analytics():
+    """Convert a pre-existing analytics table to the compact encoding.
+
+    Device and region names move into lookup tables, `action` becomes its
+    SMALLINT code and `ip_address` an INET. The rows are copied once into a
+    new table, which then replaces the old one, so no rewrite or VACUUM
+    FULL follows. Writes to analytics wait for the copy (reads don't); the
+    swap itself only needs a brief exclusive lock. Run it in a maintenance
+    window, before serving the new code. Does nothing once converted.
+    """
+    async with engine.begin() as conn:
+        if not await has_legacy_analytics(conn):
+            print("✅ analytics already uses the compact encoding")
+            await engine.dispose()
+            return
+        await conn.execute(text("LOCK TABLE analytics IN SHARE MODE"))
+        for column, table in (("device", "analytics_devices"), ("region", "analytics_regions")):
+            await conn.execute(text(
+                f"INSERT INTO {table} (name) "
+                f"SELECT DISTINCT left(trim({column}), 100) FROM analytics WHERE trim({column}) <> '' "
+                f"ON CONFLICT (name) DO NOTHING"
+            ))
+        await conn.execute(text(SAFE_INET_FUNCTION))
+        await conn.execute(text("""
+            CREATE TABLE analytics_compact (
+                id uuid NOT NULL,
+                company_id uuid NOT NULL REFERENCES companies (id) ON DELETE CASCADE,
+                employee_id uuid REFERENCES employees (id) ON DELETE CASCADE,
+                timestamp timestamp DEFAULT now(),
+                device_id integer REFERENCES analytics_devices (id),
+                region_id integer REFERENCES analytics_regions (id),
+                action smallint NOT NULL,
+                ip_address inet
+            )
+        """))
+        action_cases = " ".join(f"WHEN '{name}' THEN {code}" for name, code in ACTION_CODES.items())
+        result = await conn.execute(text(f"""
+            INSERT INTO analytics_compact
+            SELECT a.id, a.company_id, a.employee_id, a.timestamp, d.id, r.id,
+                   CASE lower(a.action) {action_cases} ELSE 0 END,
+                   pg_temp.safe_inet(a.ip_address)
+            FROM analytics a
+            LEFT JOIN analytics_devices d ON d.name = left(trim(a.device), 100)
+            LEFT JOIN analytics_regions r ON r.name = left(trim(a.region), 100)
+        """))
+        # Keys and indexes are built once over the finished table
+        await conn.execute(text("ALTER TABLE analytics_compact ADD CONSTRAINT analytics_compact_pkey PRIMARY KEY (id)"))
+        await conn.execute(text("CREATE INDEX ix_analytics_compact_company_timestamp ON analytics_compact (company_id, timestamp)"))
+        await conn.execute(text("CREATE INDEX ix_analytics_compact_employee_timestamp ON analytics_compact (employee_id, timestamp)"))
+        await conn.execute(text("DROP TABLE analytics"))
+        await conn.execute(text("ALTER TABLE analytics_compact RENAME TO analytics"))
+        for old, new in (
+            ("analytics_compact_pkey", "analytics_pkey"),
+            ("ix_analytics_compact_company_timestamp", "ix_analytics_company_timestamp"),
+            ("ix_analytics_compact_employee_timestamp", "ix_analytics_employee_timestamp"),
+        ):
+            await conn.execute(text(f"ALTER INDEX {old} RENAME TO {new}"))
+        for column in ("company_id", "employee_id", "device_id", "region_id"):
+            await conn.execute(text(
+                f"ALTER TABLE analytics RENAME CONSTRAINT analytics_compact_{column}_fkey TO analytics_{column}_fkey"
+            ))
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ANALYZE analytics"))
+    print(f"✅ Converted {result.rowcount} analytics rows to the compact encoding")
+    await engine.dispose()
+
+
+async def run_migrations():
+    await init_db()
+    await upgrade_schema()
+    async with engine.connect() as conn:
+        if await has_legacy_analytics(conn):
+            print("⚠️  analytics still uses the legacy encoding; run `python migrate.py compact-analytics`")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and upgrade the database schema")
+    parser.add_argument(
+        "command", nargs="?", choices=["rekey-analytics", "compact-analytics"], help="one-off data migration to run instead"
+    )
+    args = parser.parse_args()
+    commands = {"rekey-analytics": rekey_analytics, "compact-analytics": compact_analytics}
+    asyncio.run(commands.get(args.command, run_migrations)())
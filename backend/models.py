@@ -1,8 +1,11 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional, List, Dict, Any
 import datetime
 import uuid
 
+from analytics_codes import normalize_action
+from timeseries import valid_timezone
+
 
 # ========== Pydantic Models (API Request/Response) ==========
 
@@ -18,21 +21,35 @@ class CompanyUpdate(BaseModel):
     domain: Optional[str] = None
     logo_url: Optional[str] = None
     brand_color: Optional[str] = None
+    timezone: Optional[str] = None  # IANA name, e.g. "Asia/Kuwait"
+
+    _timezone = field_validator("timezone")(valid_timezone)
 
 
 class CompanyResponse(BaseModel):
     id: uuid.UUID
     name: str
     domain: Optional[str]
+    domain_verified_at: Optional[datetime.datetime] = None
     logo_url: Optional[str]
     brand_color: Optional[str]
     slug: str
+    timezone: str
     created_at: datetime.datetime
 
     class Config:
         from_attributes = True
 
 
+class DomainVerificationResponse(BaseModel):
+    domain: str
+    verified: bool
+    verified_at: Optional[datetime.datetime] = None
+    record_type: str = "TXT"
+    record_name: str  # DNS record to create
+    record_value: str
+
+
 class EmployeeCreate(BaseModel):
     full_name: str
     job_title: Optional[str] = None
@@ -161,10 +178,27 @@ class InvoiceResponse(BaseModel):
         from_attributes = True
 
 
+class PurgeJobResponse(BaseModel):
+    id: uuid.UUID
+    company_id: uuid.UUID
+    status: str  # pending | running | done | failed
+    analytics_deleted: int
+    employees_deleted: int
+    last_error: Optional[str]
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime]
+    finished_at: Optional[datetime.datetime]
+
+    class Config:
+        from_attributes = True
+
+
 class AnalyticsEventCreate(BaseModel):
     device: Optional[str] = None
     region: Optional[str] = None
-    action: str  # view | call | whatsapp | email | download_vcard | scan_qr
+    action: str  # view | call | whatsapp | email | download_vcard | scan_qr | social platform
+
+    _action = field_validator("action")(normalize_action)
 
 
 class AnalyticsResponse(BaseModel):
@@ -178,3 +212,18 @@ class AnalyticsResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class CardTrendResponse(BaseModel):
+    employee_id: uuid.UUID
+    status: str  # trending | dropping | inactive | new | normal
+    recent_count: int
+    baseline_mean: Optional[float]
+    baseline_std: Optional[float]
+    growth_rate: Optional[float]
+    z_score: Optional[float]
+    last_active: Optional[datetime.date]
+    computed_for: datetime.date
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,69 @@
+"""
+Plan Catalog
+Public plan and pricing document, serialized once and served with an ETag
+"""
+import hashlib
+import json
+from typing import Dict, NamedTuple, Optional
+
+import subscription_config as config
+
+# Prices change only on deploy; clients revalidate with If-None-Match after that
+CACHE_CONTROL = "public, max-age=3600, stale-while-revalidate=86400"
+
+
+class CatalogDocument(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def _pricing(plan: str, currency: str) -> dict:
+    prices = config.PLAN_PRICES[currency].get(plan, {})
+    return {
+        "monthly": prices.get("monthly", 0),
+        "yearly": prices.get("yearly", 0),
+        "symbol": config.CURRENCY_SYMBOLS.get(currency, currency),
+    }
+
+
+def build_plans(currencies) -> list:
+    """Plan list in the shape returned by GET /subscriptions/plans."""
+    return [
+        {
+            "id": plan,
+            "name": display["name"],
+            "description": display["description"],
+            "features": config.PLAN_FEATURES.get(plan, []),
+            "pricing": {currency: _pricing(plan, currency) for currency in currencies},
+            "trial_days": config.TRIAL_DAYS if display["trial"] else 0,
+        }
+        for plan, display in config.PLAN_DISPLAY.items()
+    ]
+
+
+def _document(currencies) -> CatalogDocument:
+    body = json.dumps({"plans": build_plans(currencies)}, separators=(",", ":")).encode()
+    return CatalogDocument(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+class PlanCatalog:
+    """Serialized catalog for all currencies plus one variant per currency."""
+
+    def __init__(self):
+        self.documents: Dict[Optional[str], CatalogDocument] = {}
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recompute every variant from subscription_config."""
+        currencies = list(config.PLAN_PRICES)
+        documents = {None: _document(currencies)}
+        for currency in currencies:
+            documents[currency] = _document([currency])
+        self.documents = documents
+
+    def get(self, currency: Optional[str] = None) -> Optional[CatalogDocument]:
+        """The document for a currency (all currencies if None); None if unsupported."""
+        return self.documents.get(currency.upper() if currency else None)
+
+
+catalog = PlanCatalog()
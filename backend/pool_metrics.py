@@ -0,0 +1,70 @@
+"""
+Connection Pool Metrics
+How long each route holds pooled database connections, to spot endpoints that can starve the pool
+"""
+import time
+from contextvars import ContextVar
+from typing import Any, Dict
+
+from sqlalchemy import event
+
+# Set per request by `database.get_db`; connections taken elsewhere count as background work
+route_label: ContextVar[str] = ContextVar("route_label", default="background")
+
+
+class PoolMetrics:
+    """Per-route connection hold times, measured from pool checkout to checkin."""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, float]] = {}
+        self.pool = None
+
+    def install(self, engine) -> None:
+        self.pool = engine.sync_engine.pool
+        event.listen(self.pool, "checkout", self._on_checkout)
+        event.listen(self.pool, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, record, proxy) -> None:
+        record.info["held_since"] = time.perf_counter()
+        record.info["held_by"] = route_label.get()
+
+    def _on_checkin(self, dbapi_connection, record) -> None:
+        started = record.info.pop("held_since", None)
+        if started is None:
+            return
+        held = time.perf_counter() - started
+        route = record.info.pop("held_by", "background")
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = {"checkouts": 0, "total_s": 0.0, "max_s": 0.0}
+        stats["checkouts"] += 1
+        stats["total_s"] += held
+        if held > stats["max_s"]:
+            stats["max_s"] = held
+
+    def stats(self) -> Dict[str, Any]:
+        routes = [
+            {
+                "route": route,
+                "checkouts": int(s["checkouts"]),
+                "total_ms": round(s["total_s"] * 1000, 1),
+                "avg_ms": round(s["total_s"] / s["checkouts"] * 1000, 2),
+                "max_ms": round(s["max_s"] * 1000, 1),
+            }
+            for route, s in self.routes.items()
+        ]
+        routes.sort(key=lambda r: r["total_ms"], reverse=True)
+        pool = {}
+        if self.pool is not None:
+            pool = {
+                "size": self.pool.size(),
+                "checked_out": self.pool.checkedout(),
+                "overflow": self.pool.overflow(),
+            }
+        return {"pool": pool, "routes": routes}
+
+    def reset(self) -> None:
+        self.routes.clear()
+
+
+metrics = PoolMetrics()
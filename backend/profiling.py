@@ -0,0 +1,142 @@
+"""
+Event Loop Instrumentation
+Opt-in event-loop lag monitor, blocking-callback detector and sampling profiler
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Enable with LOOP_MONITOR=true; the profiler endpoint works regardless
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "20"))
+
+MAX_PROFILE_SECONDS = 60
+
+
+class LoopMonitor:
+    """Measures event-loop lag and logs the stack of callbacks that block it.
+
+    A heartbeat task records how late the loop wakes it up; a watchdog thread
+    notices when the heartbeat stops advancing and captures the loop thread's
+    stack while it is still blocked.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS,
+        interval_ms: float = LOOP_MONITOR_INTERVAL_MS,
+    ):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            self._last_beat = now
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopping.wait(self.interval):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # Report each stall once, while the offending callback is still running
+            reported_beat = beat
+            self.blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>\n"
+            logger.warning(
+                "Event loop blocked for %.0f ms (threshold %.0f ms); loop thread stack:\n%s",
+                stalled * 1000, self.threshold * 1000, stack,
+            )
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None,
+            "threshold_ms": self.threshold * 1000,
+            "samples": self.samples,
+            "avg_lag_ms": (self.total_lag / self.samples * 1000) if self.samples else 0.0,
+            "max_lag_ms": self.max_lag * 1000,
+            "blocked_count": self.blocked_count,
+        }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+_profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds: float, interval_ms: float = 10) -> str:
+    """Sample every thread's stack and return it in collapsed (flamegraph.pl) format.
+
+    Blocking; run it in a worker thread. Only one profile runs at a time.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        counts: Counter = Counter()
+        interval = interval_ms / 1000
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+    finally:
+        _profile_lock.release()
+
+
+loop_monitor = LoopMonitor()
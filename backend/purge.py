@@ -0,0 +1,188 @@
+"""
+Company Purge
+Deletes a company's data in the background, in bounded batches with progress kept on the job
+
+A deleted company is hidden right away (`companies.deleted_at`) and a
+`purge_jobs` row is queued. The worker then removes analytics and employees
+a batch per transaction, so no statement locks or loads more than one batch,
+and finally deletes the company row; users, subscriptions, invoices and the
+remaining children go with it through ON DELETE CASCADE. Jobs survive
+restarts and are resumed where they stopped.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+import subscription_service
+from database import AsyncSessionLocal, after_commit, is_ready
+from short_links import cache as short_link_cache
+from tenant_hosts import host_map
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+ANALYTICS_BATCH_SIZE = int(os.getenv("PURGE_ANALYTICS_BATCH_SIZE", "5000"))
+# Each employee also cascades to its card, short links and sketches
+EMPLOYEE_BATCH_SIZE = int(os.getenv("PURGE_EMPLOYEE_BATCH_SIZE", "200"))
+POLL_INTERVAL_SECONDS = 10.0
+MAX_ATTEMPTS = 5
+
+# Jobs whose worker stopped heartbeating this long ago (crash, restart) are resumed
+LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+async def queue_company_purge(session: AsyncSession, company: db.Company) -> db.PurgeJob:
+    """Hide a company and queue the deletion of its data. Does not commit.
+
+    Public cards, short links and the custom domain stop resolving as soon
+    as the caller commits; the rows themselves are removed by the worker.
+    The caller cancels a paid subscription in Stripe beforehand, so a Stripe
+    error leaves the company as it was.
+    """
+    subscription = await subscription_service.get_active_subscription(session, company.id)
+    if subscription and subscription.stripe_subscription_id:
+        await subscription_service.cancel_subscription(session, company.id, at_period_end=False)
+
+    company.deleted_at = datetime.utcnow()
+    company.domain = None  # Free the domain for other tenants now
+    job = db.PurgeJob(company_id=company.id, company_name=company.name, status=STATUS_PENDING)
+    session.add(job)
+    await session.flush()
+
+    company_id = company.id
+    after_commit(session, lambda: host_map.remove(company_id))
+    after_commit(session, lambda: short_link_cache.evict_where(lambda link: link.company_id == company_id))
+    after_commit(session, worker.wake)
+    return job
+
+
+async def get_purge_job(session: AsyncSession, company_id: uuid.UUID) -> Optional[db.PurgeJob]:
+    """The latest purge job of a company."""
+    result = await session.execute(
+        select(db.PurgeJob)
+        .where(db.PurgeJob.company_id == company_id)
+        .order_by(db.PurgeJob.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+def _batch(model, column, value, size: int):
+    """DELETE of at most `size` rows matching column == value."""
+    ids = select(model.id).where(column == value).limit(size).scalar_subquery()
+    return delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+
+
+class PurgeWorker:
+    """Runs queued purge jobs one batch per transaction."""
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _claim(self) -> Optional[tuple]:
+        """(job_id, company_id, attempts) of the next job to run, if any."""
+        job = db.PurgeJob
+        candidate = (
+            select(job.id)
+            .where(
+                (job.status == STATUS_PENDING)
+                | ((job.status == STATUS_RUNNING) & (job.locked_at < func.now() - LOCK_TIMEOUT))
+            )
+            .order_by(job.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    update(job)
+                    .where(job.id == candidate.scalar_subquery())
+                    .values(
+                        status=STATUS_RUNNING,
+                        locked_at=func.now(),
+                        attempts=job.attempts + 1,
+                        started_at=func.coalesce(job.started_at, func.now()),
+                    )
+                    .returning(job.id, job.company_id, job.attempts)
+                    .execution_options(synchronize_session=False)
+                )
+                return result.first()
+
+    async def _step(self, job_id: uuid.UUID, company_id: uuid.UUID) -> bool:
+        """Delete one batch and record it on the job; returns False once the company is gone."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                _batch(db.AnalyticsEvent, db.AnalyticsEvent.company_id, company_id, ANALYTICS_BATCH_SIZE)
+            )
+            progress = {"analytics_deleted": db.PurgeJob.analytics_deleted + result.rowcount}
+            if not result.rowcount:
+                result = await session.execute(
+                    _batch(db.Employee, db.Employee.company_id, company_id, EMPLOYEE_BATCH_SIZE)
+                )
+                progress = {"employees_deleted": db.PurgeJob.employees_deleted + result.rowcount}
+            if not result.rowcount:
+                await session.execute(
+                    delete(db.Company)
+                    .where(db.Company.id == company_id)
+                    .execution_options(synchronize_session=False)
+                )
+                progress = {"status": STATUS_DONE, "finished_at": func.now(), "last_error": None}
+            await session.execute(
+                update(db.PurgeJob)
+                .where(db.PurgeJob.id == job_id)
+                .values(locked_at=func.now(), **progress)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        return "status" not in progress
+
+    async def run_job(self, job_id: uuid.UUID, company_id: uuid.UUID, attempts: int) -> None:
+        try:
+            while await self._step(job_id, company_id):
+                await asyncio.sleep(0)  # Let requests in between batches
+            logger.info("Purged company %s (job %s)", company_id, job_id)
+        except Exception as e:
+            failed = attempts >= MAX_ATTEMPTS
+            logger.exception("Purge job %s failed on attempt %d", job_id, attempts)
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(db.PurgeJob)
+                    .where(db.PurgeJob.id == job_id)
+                    # A job left running is retried once its lock times out
+                    .values(status=STATUS_FAILED if failed else STATUS_RUNNING, last_error=repr(e)[:2000])
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+
+    async def run(self) -> None:
+        """Background loop running queued jobs."""
+        while not is_ready():
+            await asyncio.sleep(1)
+        while True:
+            self._wakeup.clear()
+            try:
+                while (claimed := await self._claim()) is not None:
+                    await self.run_job(*claimed)
+            except Exception:
+                logger.exception("Purge worker iteration failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+worker = PurgeWorker()
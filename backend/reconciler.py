@@ -0,0 +1,337 @@
+"""
+Stripe Reconciliation Job
+Pages through Stripe subscriptions and invoices and repairs rows that missed webhooks
+
+Usage:
+    python reconciler.py            # resume or start a pass
+    python reconciler.py --restart  # discard saved cursors and start over
+
+Runs in the background of every API process as well; a Postgres advisory
+lock makes sure only one of them reconciles at a time.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+
+import database_models as db
+import subscription_service
+from database import AsyncSessionLocal, engine, is_ready, lock_engine
+from ids import uuid7
+from stripe_service import from_timestamp, get_stripe
+
+logger = logging.getLogger(__name__)
+
+# On by default wherever Stripe is configured
+RECONCILE_ENABLED = (
+    os.getenv("RECONCILE_ENABLED", "true").lower() == "true" and bool(os.getenv("STRIPE_SECRET_KEY"))
+)
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", str(6 * 3600)))
+# Stripe allows 100 read requests/s in live mode; stay well below it
+STRIPE_SYNC_RATE = float(os.getenv("STRIPE_SYNC_RATE", "20"))
+
+PAGE_SIZE = 100
+ADVISORY_LOCK_KEY = 0x5EC0_0001
+# Invoices are re-checked from this long before the previous completed pass
+INVOICE_LOOKBACK = timedelta(days=2)
+
+SUBSCRIPTIONS_JOB = "stripe_subscriptions"
+INVOICES_JOB = "stripe_invoices"
+
+# Mirrored invoice columns compared against Stripe
+INVOICE_FIELDS = ("status", "amount", "paid_at", "due_date", "period_start", "period_end", "hosted_invoice_url")
+
+
+class TokenBucket:
+    """Async rate limiter allowing `rate` acquisitions per second on average."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Reconciler:
+    """Diffs Stripe's subscriptions and invoices against the database, one page at a time."""
+
+    def __init__(self, rate: float = STRIPE_SYNC_RATE):
+        self.bucket = TokenBucket(rate)
+
+    async def _list(self, resource, **params) -> Any:
+        await self.bucket.acquire()
+        return await asyncio.to_thread(resource.list, limit=PAGE_SIZE, **params)
+
+    async def _load_state(self, name: str) -> db.SyncState:
+        async with AsyncSessionLocal() as session:
+            state = await session.get(db.SyncState, name)
+            if state is None:
+                state = db.SyncState(name=name)
+                session.add(state)
+            if state.cursor is None:
+                state.last_started_at = datetime.utcnow()
+            await session.commit()
+            await session.refresh(state)
+            return state
+
+    async def _save_cursor(self, session, name: str, cursor: Optional[str]) -> None:
+        values: Dict[str, Any] = {"cursor": cursor}
+        if cursor is None:
+            values["last_completed_at"] = datetime.utcnow()
+        await session.execute(
+            update(db.SyncState).where(db.SyncState.name == name).values(**values)
+        )
+
+    # ========== Subscriptions ==========
+
+    async def _apply_subscriptions(self, session, page: List[Dict[str, Any]]) -> int:
+        by_id = {s["id"]: s for s in page}
+        result = await session.execute(
+            select(
+                db.Subscription.id,
+                db.Subscription.stripe_subscription_id,
+                db.Subscription.status,
+                db.Subscription.current_period_start,
+                db.Subscription.current_period_end,
+                db.Subscription.cancel_at,
+            ).where(db.Subscription.stripe_subscription_id.in_(by_id))
+        )
+
+        changes, not_renewing = [], []
+        for row in result:
+            remote = by_id[row.stripe_subscription_id]
+            wanted = {
+                "status": remote["status"],
+                "current_period_start": from_timestamp(remote.get("current_period_start")),
+                "current_period_end": from_timestamp(remote.get("current_period_end")),
+                "cancel_at": from_timestamp(remote.get("cancel_at")),
+            }
+            if all(getattr(row, key) == value for key, value in wanted.items()):
+                continue
+            wanted["id"] = row.id
+            changes.append(wanted)
+            if wanted["status"] == "canceled" or wanted["cancel_at"]:
+                not_renewing.append(row.stripe_subscription_id)
+
+        if changes:
+            # Bulk UPDATE by primary key: one executemany per page
+            await session.execute(update(db.Subscription), changes)
+            canceled = [c["id"] for c in changes if c["status"] == "canceled"]
+            if canceled:
+                await session.execute(
+                    update(db.Subscription)
+                    .where(db.Subscription.id.in_(canceled))
+                    .where(db.Subscription.active.is_(True))
+                    .values(active=False, plan="free", ended_at=func.coalesce(db.Subscription.ended_at, func.now()))
+                    .execution_options(synchronize_session=False)
+                )
+        if not_renewing:
+            await session.execute(
+                delete(db.Invoice)
+                .where(db.Invoice.stripe_subscription_id.in_(not_renewing))
+                .where(db.Invoice.status == "upcoming")
+            )
+        return len(changes)
+
+    async def sync_subscriptions(self) -> Dict[str, int]:
+        stripe = get_stripe()
+        state = await self._load_state(SUBSCRIPTIONS_JOB)
+        cursor, stats = state.cursor, {"pages": 0, "checked": 0, "updated": 0}
+
+        while True:
+            params = {"status": "all"}
+            if cursor:
+                params["starting_after"] = cursor
+            page = await self._list(stripe.Subscription, **params)
+            data = [s.to_dict_recursive() if hasattr(s, "to_dict_recursive") else dict(s) for s in page.data]
+
+            async with AsyncSessionLocal() as session:
+                if data:
+                    stats["updated"] += await self._apply_subscriptions(session, data)
+                cursor = data[-1]["id"] if data and page.has_more else None
+                await self._save_cursor(session, SUBSCRIPTIONS_JOB, cursor)
+                await session.commit()
+
+            stats["pages"] += 1
+            stats["checked"] += len(data)
+            if cursor is None:
+                return stats
+
+    # ========== Invoices ==========
+
+    async def _apply_invoices(self, session, page: List[Dict[str, Any]]) -> Dict[str, int]:
+        by_id = {i["id"]: subscription_service.invoice_values(i) for i in page}
+        result = await session.execute(
+            select(db.Invoice.id, db.Invoice.stripe_invoice_id, *(getattr(db.Invoice, f) for f in INVOICE_FIELDS))
+            .where(db.Invoice.stripe_invoice_id.in_(by_id))
+        )
+
+        changes, known = [], set()
+        for row in result:
+            known.add(row.stripe_invoice_id)
+            wanted = {f: by_id[row.stripe_invoice_id][f] for f in INVOICE_FIELDS}
+            current = {f: getattr(row, f) for f in INVOICE_FIELDS}
+            current["amount"] = float(current["amount"])
+            if current != wanted:
+                changes.append({"id": row.id, **wanted})
+        if changes:
+            await session.execute(update(db.Invoice), changes)
+
+        # Invoices whose webhook never arrived
+        missing = [i for i in page if i["id"] not in known and i.get("subscription")]
+        inserted = 0
+        if missing:
+            result = await session.execute(
+                select(db.Subscription.id, db.Subscription.company_id, db.Subscription.stripe_subscription_id)
+                .where(db.Subscription.stripe_subscription_id.in_({i["subscription"] for i in missing}))
+            )
+            subscriptions = {row.stripe_subscription_id: row for row in result}
+            rows = []
+            for invoice in missing:
+                subscription = subscriptions.get(invoice["subscription"])
+                if subscription:
+                    owner = {"company_id": subscription.company_id, "subscription_id": subscription.id}
+                else:
+                    metadata = (invoice.get("subscription_details") or {}).get("metadata") or {}
+                    if not metadata.get("company_id"):
+                        continue
+                    owner = {"company_id": uuid.UUID(metadata["company_id"]), "subscription_id": None}
+                rows.append({"id": uuid7(), **owner, **by_id[invoice["id"]]})
+            if rows:
+                result = await session.execute(
+                    insert(db.Invoice).values(rows)
+                    .on_conflict_do_nothing(index_elements=[db.Invoice.stripe_invoice_id])
+                    .returning(db.Invoice.id)
+                )
+                inserted = len(result.all())
+
+        subscription_ids = {i["subscription"] for i in page if i.get("subscription")}
+        if subscription_ids:
+            await subscription_service.prune_upcoming_invoices(session, list(subscription_ids))
+
+        return {"updated": len(changes), "inserted": inserted}
+
+    async def sync_invoices(self) -> Dict[str, int]:
+        stripe = get_stripe()
+        state = await self._load_state(INVOICES_JOB)
+        cursor, stats = state.cursor, {"pages": 0, "checked": 0, "updated": 0, "inserted": 0}
+
+        # After a first full pass only recently created invoices can be missing
+        params: Dict[str, Any] = {}
+        if state.last_completed_at:
+            since = (state.last_completed_at - INVOICE_LOOKBACK).replace(tzinfo=timezone.utc)
+            params["created"] = {"gte": int(since.timestamp())}
+
+        while True:
+            if cursor:
+                params["starting_after"] = cursor
+            page = await self._list(stripe.Invoice, **params)
+            data = [i.to_dict_recursive() if hasattr(i, "to_dict_recursive") else dict(i) for i in page.data]
+
+            async with AsyncSessionLocal() as session:
+                if data:
+                    applied = await self._apply_invoices(session, data)
+                    stats["updated"] += applied["updated"]
+                    stats["inserted"] += applied["inserted"]
+                cursor = data[-1]["id"] if data and page.has_more else None
+                await self._save_cursor(session, INVOICES_JOB, cursor)
+                await session.commit()
+
+            stats["pages"] += 1
+            stats["checked"] += len(data)
+            if cursor is None:
+                return stats
+
+    # ========== Entry Points ==========
+
+    async def _completed_recently(self) -> bool:
+        """True if both jobs finished a pass within the last interval and have none pending."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(db.SyncState).where(db.SyncState.name.in_([SUBSCRIPTIONS_JOB, INVOICES_JOB]))
+            )
+            states = result.scalars().all()
+        cutoff = datetime.utcnow() - timedelta(seconds=RECONCILE_INTERVAL_SECONDS)
+        return len(states) == 2 and all(
+            s.cursor is None and s.last_completed_at and s.last_completed_at > cutoff for s in states
+        )
+
+    async def run_once(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """Run a full pass unless one finished recently or another process holds the lock.
+
+        Returns stats, or None when skipped. The lock is held on an unpooled
+        connection, so a long pass doesn't keep a slot of the request pool.
+        """
+        async with lock_engine.connect() as lock_conn:
+            locked = await lock_conn.scalar(select(func.pg_try_advisory_lock(ADVISORY_LOCK_KEY)))
+            await lock_conn.commit()
+            if not locked:
+                return None
+            try:
+                # Every process runs this at boot; only the first after an interval does the work
+                if not force and await self._completed_recently():
+                    return None
+                started = time.monotonic()
+                stats = {
+                    "subscriptions": await self.sync_subscriptions(),
+                    "invoices": await self.sync_invoices(),
+                }
+                stats["seconds"] = round(time.monotonic() - started, 1)
+                logger.info("Stripe reconciliation finished: %s", stats)
+                return stats
+            finally:
+                await lock_conn.scalar(select(func.pg_advisory_unlock(ADVISORY_LOCK_KEY)))
+                await lock_conn.commit()
+
+    async def run(self) -> None:
+        """Background loop reconciling every RECONCILE_INTERVAL_SECONDS."""
+        while not is_ready():
+            await asyncio.sleep(1)
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Stripe reconciliation failed; it resumes from the saved cursor")
+            await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+
+reconciler = Reconciler()
+
+
+async def _main(restart: bool) -> None:
+    if restart:
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(db.SyncState)
+                .where(db.SyncState.name.in_([SUBSCRIPTIONS_JOB, INVOICES_JOB]))
+                .values(cursor=None)
+            )
+            await session.commit()
+    stats = await reconciler.run_once(force=True)
+    print(stats if stats is not None else "⏳ Another process is reconciling; try again later")
+    await engine.dispose()
+    await lock_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Reconcile subscriptions and invoices with Stripe")
+    parser.add_argument("--restart", action="store_true", help="discard saved cursors and start a new pass")
+    asyncio.run(_main(parser.parse_args().restart))
@@ -1,17 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Header, Body, Request
-from fastapi.responses import FileResponse, RedirectResponse, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import Any, List, Optional, Union
+from datetime import date, datetime
+import asyncio
+import base64
+import hashlib
+import json
 import uuid
 import urllib.parse
 
 import services
 import models
+import enrichment
+import short_links
 import vcard_utils
-from database import get_db
-from security import create_access_token, decode_token, verify_password, hash_password
+import subscription_service
+from stripe_service import StripeService
+from subscription_config import TRIAL_DAYS, STRIPE_PRICE_IDS
+import plan_catalog
+import sketch_service
+import timeseries
+import trends
+import profiling
+import purge
+import tenant_hosts
+from pool_metrics import metrics as pool_metrics
+import webhook_worker
+from analytics_codes import known_action
+from analytics_filter import ingest_filter
+from analytics_stream import broker, format_sse
+from database import get_db, is_ready, release_connection
+from security import create_access_token, decode_token
+from settings import settings
 
 router = APIRouter(prefix="/api", tags=["digital-cards"])
+# Served at the root so QR payloads stay short
+short_link_router = APIRouter(tags=["short-links"])
 
 
 # ========== Dependency: Extract user from token ==========
@@ -55,26 +82,68 @@ async def get_current_user(
     user = await services.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    if user.company is not None and user.company.deleted_at is not None:
+        raise HTTPException(status_code=401, detail="Company has been deleted")
+    # Don't hold the pooled connection through the rest of the request;
+    # the route's first query takes a fresh one
+    await release_connection(db)
     
     return {"user_id": user_id, "company_id": company_id, "role": role, "user": user}
 
 
+def get_client_ip(request: Request) -> Optional[str]:
+    """Client address as seen by the server (proxy headers are resolved by uvicorn)."""
+    return request.client.host if request.client else None
+
+
+def should_track(request: Request, card, action: str) -> bool:
+    """Run a hit through the ingestion filter; crawler and repeated hits are only counted."""
+    reason = ingest_filter.check(request.headers.get("user-agent"), get_client_ip(request), card, action)
+    return reason is None
+
+
+def enriched(request: Request, event_data: models.AnalyticsEventCreate) -> models.AnalyticsEventCreate:
+    """The event with device class and region derived from the request where possible.
+
+    Client-sent values only fill in what the server can't derive, and only
+    if they are a known device class or a country code.
+    """
+    device, region = enrichment.describe(request.headers.get("user-agent"), get_client_ip(request))
+    client_device, client_region = enrichment.client_values(event_data.device, event_data.region)
+    return event_data.copy(update={"device": device or client_device, "region": region or client_region})
+
+
 # ========== Public Routes ==========
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """Liveness check: the process is up and serving requests."""
     return {"status": "ok"}
 
 
+@router.get("/ready")
+async def readiness_check():
+    """Readiness check: the database has been reached."""
+    if not is_ready():
+        return Response(
+            content='{"status":"starting"}',
+            media_type="application/json",
+            status_code=503,
+        )
+    return {"status": "ready"}
+
+
 @router.post("/auth/signup", response_model=models.TokenResponse)
 async def signup(user_data: models.UserCreate, db: AsyncSession = Depends(get_db)):
     """Sign up a new user (company admin)."""
+    # Hash before the transaction starts so no connection waits on bcrypt
+    password_hash = await services.hash_password_async(user_data.password)
+    
     existing_user = await services.get_user_by_email(db, user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create company for new user
+    # Company, free subscription and admin user are created atomically
     company_data = models.CompanyCreate(
         name=f"{user_data.full_name}'s Company",
         domain=None,
@@ -82,7 +151,8 @@ async def signup(user_data: models.UserCreate, db: AsyncSession = Depends(get_db
     company = await services.create_company(db, company_data)
     
     # Create admin user
-    user = await services.create_user(db, user_data, company_id=company.id)
+    user = await services.create_user(db, user_data, company_id=company.id, password_hash=password_hash)
+    await db.commit()
     
     # Generate token
     access_token = create_access_token(
@@ -119,11 +189,11 @@ async def change_password(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Verify current password
-    if not verify_password(current_password, user.password_hash):
+    if not await services.verify_password_async(current_password, user.password_hash):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
     
     # Update password
-    user.password_hash = hash_password(new_password)
+    user.password_hash = await services.hash_password_async(new_password)
     db.add(user)
     await db.commit()
     
@@ -160,8 +230,11 @@ async def reset_password_request(
 async def login(credentials: models.UserLogin, db: AsyncSession = Depends(get_db)):
     """Login user."""
     user = await services.get_user_by_email(db, credentials.email)
-    if not user or not verify_password(credentials.password, user.password_hash):
+    await release_connection(db)
+    if not user or not await services.verify_password_async(credentials.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if user.company is not None and user.company.deleted_at is not None:
+        raise HTTPException(status_code=401, detail="Company has been deleted")
     
     access_token = create_access_token(
         user_id=user.id,
@@ -187,28 +260,26 @@ async def get_public_card(
     db: AsyncSession = Depends(get_db),
 ):
     """Get public digital card view (no auth required)."""
-    employee = await services.get_employee_by_slug(db, company_slug, employee_slug)
-    if not employee:
+    card = await services.get_public_card(db, company_slug, employee_slug)
+    if not card:
         raise HTTPException(status_code=404, detail="Card not found")
     
-    card = await services.get_card_by_employee(db, employee.id)
-    
     return models.BusinessCardResponse(
-        employee_id=employee.id,
-        employee_name=employee.full_name,
-        company_name=employee.company.name,
-        company_id=employee.company.id,
-        job_title=employee.job_title,
-        email=employee.email,
-        phone=employee.phone,
-        whatsapp=employee.whatsapp,
-        bio=employee.bio,
-        photo_url=employee.photo_url,
-        social_links=employee.social_links,
-        qr_code=card.qr_code if card else None,
-        vcard_url=card.vcard_url if card else None,
-        company_logo=employee.company.logo_url,
-        company_brand_color=employee.company.brand_color,
+        employee_id=card.employee_id,
+        employee_name=card.full_name,
+        company_name=card.company_name,
+        company_id=card.company_id,
+        job_title=card.job_title,
+        email=card.email,
+        phone=card.phone,
+        whatsapp=card.whatsapp,
+        bio=card.bio,
+        photo_url=card.photo_url,
+        social_links=card.social_links,
+        qr_code=settings.short_url(card.short_code) if card.short_code else None,
+        vcard_url=settings.vcard_url(card.company_slug, card.public_slug),
+        company_logo=card.company_logo,
+        company_brand_color=card.company_brand_color,
     )
 
 
@@ -225,6 +296,7 @@ async def create_company_endpoint(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     company = await services.create_company(db, company_data)
+    await db.commit()
     return company
 
 
@@ -269,10 +341,116 @@ async def update_company_endpoint(
     # Update company
     updated_data = company_update.dict(exclude_unset=True)
     company = await services.update_company(db, company_id, updated_data)
+    await db.commit()
     
     return company
 
 
+def _domain_verification(company) -> models.DomainVerificationResponse:
+    return models.DomainVerificationResponse(
+        domain=company.domain,
+        verified=company.domain_verified_at is not None,
+        verified_at=company.domain_verified_at,
+        record_name=tenant_hosts.verification_record(company.domain),
+        record_value=tenant_hosts.verification_value(company.domain_verification_token or ""),
+    )
+
+
+@router.get("/company/{company_id}/domain", response_model=models.DomainVerificationResponse)
+async def get_company_domain(
+    company_id: uuid.UUID,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """The DNS record that proves ownership of the company's custom domain."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    company = await services.get_company_by_id(db, company_id)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if not company.domain:
+        raise HTTPException(status_code=404, detail="Company has no custom domain")
+    return _domain_verification(company)
+
+
+@router.post("/company/{company_id}/domain/verify", response_model=models.DomainVerificationResponse)
+async def verify_company_domain(
+    company_id: uuid.UUID,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Check the domain's TXT record; cards are served on the domain once it is verified."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    company = await services.get_company_by_id(db, company_id)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if not company.domain:
+        raise HTTPException(status_code=404, detail="Company has no custom domain")
+    if not await services.verify_company_domain(db, company):
+        record = _domain_verification(company)
+        raise HTTPException(
+            status_code=400,
+            detail=f"TXT record {record.record_name} with value {record.record_value} not found",
+        )
+    await db.commit()
+    return _domain_verification(company)
+
+
+@router.delete("/company/{company_id}", response_model=models.PurgeJobResponse, status_code=202)
+async def delete_company_endpoint(
+    company_id: uuid.UUID,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Delete a company and all its data (admin only).
+
+    The company disappears at once, its paid subscription is cancelled and
+    its users can no longer sign in; its rows are removed in the background.
+    A superadmin can poll GET /company/{company_id}/purge for progress.
+    """
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if current_user["role"] not in ["admin", "superadmin"]:
+        raise HTTPException(status_code=403, detail="Only admins can delete companies")
+    
+    company = await services.get_company_by_id(db, company_id, include_deleted=True)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if company.deleted_at:
+        # Already queued; report the running job
+        return await purge.get_purge_job(db, company_id)
+    
+    # Cancel a paid subscription in Stripe first (without holding a pooled connection)
+    subscription = await subscription_service.get_active_subscription(db, company_id)
+    if subscription and subscription.stripe_subscription_id:
+        await release_connection(db)
+        stripe_service = StripeService()
+        await stripe_service.cancel_subscription(subscription.stripe_subscription_id, at_period_end=False)
+    
+    job = await purge.queue_company_purge(db, company)
+    await db.commit()
+    return job
+
+
+@router.get("/company/{company_id}/purge", response_model=models.PurgeJobResponse)
+async def get_company_purge_endpoint(
+    company_id: uuid.UUID,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Progress of a company deletion."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    job = await purge.get_purge_job(db, company_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No deletion queued for this company")
+    return job
+
+
 # ========== Employee Routes ==========
 
 @router.post("/company/{company_id}/employees", response_model=models.EmployeeResponse)
@@ -287,6 +465,7 @@ async def create_employee_endpoint(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     employee = await services.create_employee(db, company_id, employee_data)
+    await db.commit()
     # Convert to dict and add company slug
     emp_data = models.EmployeeResponse.from_orm(employee).dict()
     if hasattr(employee, 'company') and employee.company:
@@ -294,6 +473,40 @@ async def create_employee_endpoint(
     return emp_data
 
 
+# Bulk imports are allocated and inserted in one transaction
+MAX_BULK_EMPLOYEES = 500
+
+
+@router.post("/company/{company_id}/employees/bulk", response_model=List[models.EmployeeResponse])
+async def create_employees_bulk_endpoint(
+    company_id: uuid.UUID,
+    employees_data: List[models.EmployeeCreate],
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Create many employees for a company in one request (bulk import)."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if not employees_data:
+        return []
+    if len(employees_data) > MAX_BULK_EMPLOYEES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_EMPLOYEES} employees per request")
+    
+    try:
+        employees = await services.create_employees_bulk(db, company_id, employees_data)
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    await db.commit()
+    
+    results = []
+    for employee in employees:
+        emp_data = models.EmployeeResponse.from_orm(employee).dict()
+        if employee.company:
+            emp_data['company_slug'] = employee.company.slug
+        results.append(emp_data)
+    return results
+
+
 @router.get("/company/{company_id}/employees", response_model=List[models.EmployeeResponse])
 async def list_employees_endpoint(
     company_id: uuid.UUID,
@@ -359,6 +572,7 @@ async def update_employee_endpoint(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     updated_employee = await services.update_employee(db, employee_id, employee_data)
+    await db.commit()
     # Convert to dict and add company slug
     emp_data = models.EmployeeResponse.from_orm(updated_employee).dict()
     if hasattr(updated_employee, 'company') and updated_employee.company:
@@ -388,6 +602,7 @@ async def delete_employee_endpoint(
     success = await services.delete_employee(db, employee_id)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to delete employee")
+    await db.commit()
     
     return {"message": "Employee deleted successfully", "employee_id": employee_id}
 
@@ -441,6 +656,7 @@ async def update_company_branding(
     
     # Update company branding
     company = await services.update_company_branding(db, company_id, branding_update)
+    await db.commit()
     
     return {
         "status": "updated",
@@ -455,25 +671,99 @@ async def update_company_branding(
 @router.post("/analytics/track")
 async def track_analytics(
     event_data: models.AnalyticsEventCreate,
+    request: Request,
     company_slug: str = Query(...),
     employee_slug: str = Query(...),
     db: AsyncSession = Depends(get_db),
 ):
     """Track an analytics event (public, no auth required)."""
-    employee = await services.get_employee_by_slug(db, company_slug, employee_slug)
-    if not employee:
+    if not should_track(request, (company_slug, employee_slug), event_data.action):
+        return {"status": "ignored"}
+    
+    card = await services.get_public_card(db, company_slug, employee_slug)
+    if not card:
         raise HTTPException(status_code=404, detail="Card not found")
     
     event = await services.track_event(
         db,
-        employee.company_id,
-        employee.id,
-        event_data,
+        card.company_id,
+        enriched(request, event_data),
+        employee_id=card.employee_id,
+        ip_address=get_client_ip(request),
     )
+    await db.commit()
     
     return {"status": "tracked", "event_id": event.id}
 
 
+MAX_BEACON_EVENTS = 20
+MAX_BEACON_BYTES = 8 * 1024
+_beacon_events = TypeAdapter(List[Any])
+_beacon_event = TypeAdapter(models.AnalyticsEventCreate)
+
+
+async def read_body_limited(request: Request, limit: int) -> bytes:
+    """The request body, or 413 once it exceeds `limit` bytes."""
+    too_large = HTTPException(status_code=413, detail=f"Body larger than {limit} bytes")
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise too_large
+    body = b""
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return body
+
+
+@router.post("/analytics/batch")
+async def track_analytics_batch(
+    request: Request,
+    company_slug: str = Query(...),
+    employee_slug: str = Query(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """Track several events for one card (public, no auth required).
+
+    The body is a JSON array of events, as sent by `navigator.sendBeacon`
+    (any content type, so text/plain beacons avoid a CORS preflight).
+    Malformed events are skipped one by one and counted as ignored.
+    """
+    body = await read_body_limited(request, MAX_BEACON_BYTES)
+    try:
+        items = _beacon_events.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    if len(items) > MAX_BEACON_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BEACON_EVENTS} events per batch")
+    
+    events = []
+    for item in items:
+        try:
+            events.append(_beacon_event.validate_python(item))
+        except ValidationError:
+            continue
+    
+    card_key = (company_slug, employee_slug)
+    accepted = [event for event in events if should_track(request, card_key, event.action)]
+    if not accepted:
+        return {"status": "ignored", "tracked": 0, "ignored": len(items)}
+    
+    card = await services.get_public_card(db, company_slug, employee_slug)
+    if not card:
+        raise HTTPException(status_code=404, detail="Card not found")
+    
+    await services.track_events(
+        db,
+        card.company_id,
+        [enriched(request, event) for event in accepted],
+        employee_id=card.employee_id,
+        ip_address=get_client_ip(request),
+    )
+    await db.commit()
+    
+    return {"status": "tracked", "tracked": len(accepted), "ignored": len(items) - len(accepted)}
+
+
 @router.get("/analytics/company/{company_id}")
 async def get_company_analytics(
     company_id: uuid.UUID,
@@ -495,6 +785,185 @@ async def get_company_analytics(
     }
 
 
+@router.get("/analytics/company/{company_id}/stream")
+async def stream_company_analytics(
+    company_id: uuid.UUID,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Stream new analytics events and per-action counters (Server-Sent Events).
+
+    Sends a `summary` frame with the current counters first, then `analytics`
+    frames for new events and coalesced `counters` frames with updated totals.
+    """
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    summary = await services.get_analytics_summary(db, company_id)
+    # Don't hold a pooled connection for the lifetime of the stream
+    await db.close()
+    
+    subscription = broker.subscribe(company_id, summary)
+    
+    async def event_source():
+        try:
+            yield format_sse("summary", summary)
+            async for frame in subscription.frames():
+                if await request.is_disconnected():
+                    break
+                yield frame
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def _month_to_date(start: Optional[date], end: Optional[date]):
+    today = datetime.utcnow().date()
+    end = end or today
+    start = start or end.replace(day=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end
+
+
+@router.get("/analytics/company/{company_id}/uniques")
+async def get_unique_visitors(
+    company_id: uuid.UUID,
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    employee_id: Optional[uuid.UUID] = Query(None),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Approximate unique visitors for a company or card (defaults to this month)."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    start, end = _month_to_date(start, end)
+    unique_visitors = await sketch_service.count_unique_visitors(db, company_id, start, end, employee_id)
+    
+    return {
+        "start": start,
+        "end": end,
+        "employee_id": employee_id,
+        "unique_visitors": unique_visitors,
+    }
+
+
+@router.get("/analytics/company/{company_id}/top")
+async def get_top_dimensions(
+    company_id: uuid.UUID,
+    dimension: str = Query("region", pattern="^(region|device)$"),
+    limit: int = Query(10, ge=1, le=20),
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    employee_id: Optional[uuid.UUID] = Query(None),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Approximate top regions or devices for a company or card (defaults to this month)."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    start, end = _month_to_date(start, end)
+    top = await sketch_service.top_values(db, company_id, dimension, start, end, limit, employee_id)
+    
+    return {
+        "start": start,
+        "end": end,
+        "dimension": dimension,
+        "top": [{"value": value, "count": count} for value, count in top],
+    }
+
+
+@router.get("/analytics/company/{company_id}/timeseries")
+async def get_analytics_timeseries(
+    company_id: uuid.UUID,
+    request: Request,
+    interval: str = Query("day", pattern="^(hour|day|week)$"),
+    start: Optional[Union[datetime, date]] = Query(None, alias="from"),
+    end: Optional[Union[datetime, date]] = Query(None, alias="to"),
+    action: Optional[str] = Query(None),
+    employee_id: Optional[uuid.UUID] = Query(None),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Event counts per hour, day or week in the company's time zone, empty buckets included.
+
+    `from`/`to` (dates or datetimes) without an offset are read in the
+    company's time zone; both ends' buckets are included. Only
+    the ranges still open are counted on each request; the response is
+    cacheable for as long as none of its buckets can change.
+    """
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    company = await services.get_company_by_id(db, company_id)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+
+    try:
+        if action is not None:
+            action = known_action(action)
+        tz = timeseries.zone(company.timezone)
+        first, count = timeseries.bucket_range(interval, tz, start, end, datetime.utcnow())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    series = await timeseries.get_timeseries(db, company_id, interval, tz, first, count, action, employee_id)
+    body = json.dumps({
+        "interval": interval,
+        "timezone": tz.key,
+        "action": action,
+        "employee_id": str(employee_id) if employee_id else None,
+        "buckets": [
+            {"start": bucket_start.isoformat(), "count": bucket_count}
+            for bucket_start, bucket_count in zip(series.starts, series.counts)
+        ],
+        "total": sum(series.counts),
+    }, separators=(",", ":")).encode()
+
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    # Ranges of closed buckets only change if an employee is deleted; others revalidate
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=3600" if series.complete else "private, no-cache"}
+    if etag in request.headers.get("if-none-match", "").replace("W/", "").split(", "):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/analytics/company/{company_id}/trends")
+async def get_card_trends(
+    company_id: uuid.UUID,
+    status: Optional[str] = Query(None, pattern="^(trending|dropping|inactive|new|normal)$"),
+    limit: int = Query(20, ge=1, le=200),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Cards whose recent activity stands out from their own baseline, as of the last daily scoring."""
+    if current_user["company_id"] != company_id and current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    rows = await trends.get_card_trends(db, company_id, status, limit)
+    
+    return {
+        "status": status,
+        "cards": [
+            {**models.CardTrendResponse.from_orm(trend).dict(), "full_name": full_name, "public_slug": public_slug}
+            for trend, full_name, public_slug in rows
+        ],
+    }
+
+
 @router.get("/analytics/employee/{employee_id}")
 async def get_employee_analytics(
     employee_id: uuid.UUID,
@@ -524,6 +993,7 @@ async def get_employee_analytics(
 async def get_vcard(
     company_slug: str,
     employee_slug: str,
+    request: Request,
     db: AsyncSession = Depends(get_db),
 ):
     """Download vCard file for a business card (RFC 3.0 format).
@@ -532,35 +1002,36 @@ async def get_vcard(
     When accessed, it triggers a download of the vCard file.
     """
     # Get employee and verify card exists
-    employee = await services.get_employee_by_slug(db, company_slug, employee_slug)
-    if not employee:
+    card = await services.get_public_card(db, company_slug, employee_slug)
+    if not card:
         raise HTTPException(status_code=404, detail="Card not found")
     
     # Generate vCard content
     vcard_content = vcard_utils.generate_vcard(
-        full_name=employee.full_name,
-        job_title=employee.job_title,
-        email=employee.email,
-        phone=employee.phone,
-        whatsapp=employee.whatsapp,
-        company_name=employee.company.name if employee.company else None,
-        photo_url=employee.photo_url,
-        bio=employee.bio,
-        social_links=employee.social_links,
+        full_name=card.full_name,
+        job_title=card.job_title,
+        email=card.email,
+        phone=card.phone,
+        whatsapp=card.whatsapp,
+        company_name=card.company_name,
+        photo_url=card.photo_url,
+        bio=card.bio,
+        social_links=card.social_links,
     )
     
     # Track analytics event
-    await services.track_event(
-        db,
-        employee.company_id,
-        models.AnalyticsEventCreate(
-            action="download_vcard",
-        ),
-        employee.id,
-    )
+    if should_track(request, (company_slug, employee_slug), "download_vcard"):
+        await services.track_event(
+            db,
+            card.company_id,
+            enriched(request, models.AnalyticsEventCreate(action="download_vcard")),
+            card.employee_id,
+            ip_address=get_client_ip(request),
+        )
+        await db.commit()
     
     # Return as downloadable file
-    filename = f"{employee.full_name.replace(' ', '_')}.vcf"
+    filename = f"{card.full_name.replace(' ', '_')}.vcf"
     return Response(
         content=vcard_content.encode('utf-8'),
         media_type="text/vcard; charset=utf-8",
@@ -579,113 +1050,72 @@ async def get_qr_vcard(
     """Generate QR code that links to vCard download.
     
     This endpoint generates a QR code image that, when scanned, directs users
-    to the vCard download endpoint. Users can then save the contact to their device.
+    through the card's short link to the vCard download endpoint. Users can then
+    save the contact to their device. Scans are recorded by the short link.
     
     The QR code is generated server-side and returned as a redirect to the QR Server API.
     """
     # Get employee and verify card exists
-    employee = await services.get_employee_by_slug(db, company_slug, employee_slug)
-    if not employee:
+    card = await services.get_public_card(db, company_slug, employee_slug)
+    if not card:
         raise HTTPException(status_code=404, detail="Card not found")
     
-    # Build vCard URL using environment variables for dynamic configuration
-    import os
-    API_HOST = os.getenv("API_HOST", "localhost")
-    API_PORT = os.getenv("API_PORT", "8000")
-    ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
-    PROTOCOL = "https" if ENVIRONMENT == "production" else "http"
-    
-    vcard_url = f"{PROTOCOL}://{API_HOST}:{API_PORT}/api/card/{company_slug}/{employee_slug}/vcard"
+    # The QR payload is the card's short link (created here for cards that predate them)
+    code = card.short_code
+    if not code:
+        code = await services.assign_short_link(db, card.employee_id)
+        await db.commit()
+    qr_data = settings.short_url(code)
     
     # Generate QR code URL from QR Server API
-    qr_image_url = f"https://api.qrserver.com/v1/create-qr-code/?size=400x400&data={urllib.parse.quote(vcard_url)}"
-    
-    # Track analytics event
-    await services.track_event(
-        db,
-        employee.company_id,
-        models.AnalyticsEventCreate(
-            action="scan_qr",
-        ),
-        employee.id,
-    )
+    qr_image_url = f"https://api.qrserver.com/v1/create-qr-code/?size=400x400&data={urllib.parse.quote(qr_data)}"
     
     # Redirect to QR Server API to get the image
     return RedirectResponse(url=qr_image_url)
 
 
+@short_link_router.get("/s/{code}")
+async def follow_short_link(
+    code: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+):
+    """Resolve a QR short link, record the scan and redirect to the vCard or card."""
+    link = await short_links.resolve(db, code)
+    if not link:
+        raise HTTPException(status_code=404, detail="Link not found")
+    
+    if should_track(request, code, "scan_qr"):
+        await services.track_event(
+            db,
+            link.company_id,
+            enriched(request, models.AnalyticsEventCreate(action="scan_qr")),
+            link.employee_id,
+            ip_address=get_client_ip(request),
+        )
+        await db.commit()
+    
+    return RedirectResponse(url=short_links.target_url(link), status_code=302)
+
+
 # ========== Subscription & Payment Routes ==========
 
 @router.get("/subscriptions/plans")
-async def get_subscription_plans():
+async def get_subscription_plans(
+    request: Request,
+    currency: Optional[str] = Query(None, description="Only include pricing in this currency"),
+):
     """Get all available subscription plans with pricing"""
-    from subscription_config import (
-        PLAN_FREE, PLAN_PROFESSIONAL, PLAN_ENTERPRISE,
-        PLAN_PRICES_USD, PLAN_PRICES_KWD,
-        PLAN_FEATURES, TRIAL_DAYS, CURRENCY_SYMBOLS
-    )
+    document = plan_catalog.catalog.get(currency)
     
-    plans = [
-        {
-            "id": PLAN_FREE,
-            "name": "Free",
-            "description": "Perfect for getting started",
-            "features": PLAN_FEATURES[PLAN_FREE],
-            "pricing": {
-                "USD": {
-                    "monthly": 0,
-                    "yearly": 0,
-                    "symbol": CURRENCY_SYMBOLS["USD"],
-                },
-                "KWD": {
-                    "monthly": 0,
-                    "yearly": 0,
-                    "symbol": CURRENCY_SYMBOLS["KWD"],
-                },
-            },
-            "trial_days": 0,
-        },
-        {
-            "id": PLAN_PROFESSIONAL,
-            "name": "Professional",
-            "description": "For growing teams",
-            "features": PLAN_FEATURES[PLAN_PROFESSIONAL],
-            "pricing": {
-                "USD": {
-                    "monthly": PLAN_PRICES_USD[PLAN_PROFESSIONAL]["monthly"],
-                    "yearly": PLAN_PRICES_USD[PLAN_PROFESSIONAL]["yearly"],
-                    "symbol": CURRENCY_SYMBOLS["USD"],
-                },
-                "KWD": {
-                    "monthly": PLAN_PRICES_KWD[PLAN_PROFESSIONAL]["monthly"],
-                    "yearly": PLAN_PRICES_KWD[PLAN_PROFESSIONAL]["yearly"],
-                    "symbol": CURRENCY_SYMBOLS["KWD"],
-                },
-            },
-            "trial_days": TRIAL_DAYS,
-        },
-        {
-            "id": PLAN_ENTERPRISE,
-            "name": "Enterprise",
-            "description": "For large organizations",
-            "features": PLAN_FEATURES[PLAN_ENTERPRISE],
-            "pricing": {
-                "USD": {
-                    "monthly": PLAN_PRICES_USD[PLAN_ENTERPRISE]["monthly"],
-                    "yearly": PLAN_PRICES_USD[PLAN_ENTERPRISE]["yearly"],
-                    "symbol": CURRENCY_SYMBOLS["USD"],
-                },
-                "KWD": {
-                    "monthly": PLAN_PRICES_KWD[PLAN_ENTERPRISE]["monthly"],
-                    "yearly": PLAN_PRICES_KWD[PLAN_ENTERPRISE]["yearly"],
-                    "symbol": CURRENCY_SYMBOLS["KWD"],
-                },
-            },
-            "trial_days": TRIAL_DAYS,
-        },
-    ]
+    if not document:
+        raise HTTPException(status_code=400, detail="Unsupported currency")
     
-    return {"plans": plans}
+    headers = {"ETag": document.etag, "Cache-Control": plan_catalog.CACHE_CONTROL}
+    if document.etag in request.headers.get("if-none-match", "").replace("W/", "").split(", "):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=document.body, media_type="application/json", headers=headers)
 
 
 @router.get("/subscriptions/current")
@@ -699,15 +1129,13 @@ async def get_current_subscription(
     if not company_id:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    from subscription_service import get_active_subscription, check_employee_limit
-    
-    subscription = await get_active_subscription(db, company_id)
+    subscription = await subscription_service.get_active_subscription(db, company_id)
     
     if not subscription:
         raise HTTPException(status_code=404, detail="No subscription found")
     
     # Get employee limits
-    limit_info = await check_employee_limit(db, company_id)
+    limit_info = await subscription_service.check_employee_limit(db, company_id)
     
     return {
         "id": subscription.id,
@@ -751,11 +1179,8 @@ async def create_checkout_session(
         raise HTTPException(status_code=404, detail="Company not found")
     
     # Get or create Stripe customer
-    from subscription_service import get_active_subscription
-    from stripe_service import StripeService
-    from subscription_config import STRIPE_PRICE_IDS, TRIAL_DAYS
-    
-    subscription = await get_active_subscription(db, company_id)
+    subscription = await subscription_service.get_active_subscription(db, company_id)
+    await release_connection(db)
     stripe_service = StripeService()
     
     if subscription and subscription.stripe_customer_id:
@@ -777,9 +1202,9 @@ async def create_checkout_session(
     if not price_id:
         raise HTTPException(status_code=400, detail="Price not found for this plan")
     
-    # Create checkout session
-    success_url = checkout_data.get("success_url", f"{os.getenv('FRONTEND_HOST')}/company-admin/subscription/success")
-    cancel_url = checkout_data.get("cancel_url", f"{os.getenv('FRONTEND_HOST')}/company-admin/subscription/cancel")
+    # Create checkout session (no pooled connection is held during the Stripe call)
+    success_url = checkout_data.get("success_url", settings.frontend_url("/company-admin/subscription/success"))
+    cancel_url = checkout_data.get("cancel_url", settings.frontend_url("/company-admin/subscription/cancel"))
     
     session = await stripe_service.create_checkout_session(
         customer_id=customer_id,
@@ -816,10 +1241,19 @@ async def cancel_subscription_endpoint(
     if current_user["role"] not in ["admin", "superadmin"]:
         raise HTTPException(status_code=403, detail="Only admins can cancel subscriptions")
     
-    from subscription_service import cancel_subscription
+    subscription = await subscription_service.get_active_subscription(db, company_id)
+    if subscription and subscription.stripe_subscription_id:
+        # Cancel in Stripe without holding a pooled connection
+        await release_connection(db)
+        stripe_service = StripeService()
+        await stripe_service.cancel_subscription(
+            subscription.stripe_subscription_id,
+            at_period_end=at_period_end
+        )
     
     try:
-        subscription = await cancel_subscription(db, company_id, at_period_end)
+        subscription = await subscription_service.cancel_subscription(db, company_id, at_period_end)
+        await db.commit()
         
         return {
             "message": "Subscription canceled successfully",
@@ -844,16 +1278,14 @@ async def create_portal_session(
     if not company_id:
         raise HTTPException(status_code=400, detail="Company not found")
     
-    from subscription_service import get_active_subscription
-    from stripe_service import StripeService
-    
-    subscription = await get_active_subscription(db, company_id)
+    subscription = await subscription_service.get_active_subscription(db, company_id)
     
     if not subscription or not subscription.stripe_customer_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
+    await release_connection(db)
     
     stripe_service = StripeService()
-    return_url = f"{os.getenv('FRONTEND_HOST')}/company-admin/subscription"
+    return_url = settings.frontend_url("/company-admin/subscription")
     
     portal_session = await stripe_service.create_portal_session(
         customer_id=subscription.stripe_customer_id,
@@ -865,35 +1297,61 @@ async def create_portal_session(
     }
 
 
+def _invoice_response(inv) -> dict:
+    return {
+        "id": inv.id,
+        "amount": float(inv.amount),
+        "currency": inv.currency,
+        "status": inv.status,
+        "paid_at": inv.paid_at,
+        "due_date": inv.due_date,
+        "period_start": inv.period_start,
+        "period_end": inv.period_end,
+        "invoice_pdf_url": inv.invoice_pdf_url,
+        "hosted_invoice_url": inv.hosted_invoice_url,
+        "created_at": inv.created_at,
+    }
+
+
+def _encode_invoice_cursor(inv) -> str:
+    raw = f"{inv.created_at.isoformat()}|{inv.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_invoice_cursor(cursor: str):
+    try:
+        created_at, invoice_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(invoice_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/subscriptions/invoices")
 async def get_invoices(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     current_user: dict = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Get invoices for company"""
+    """Get invoices for company from the local mirror, newest first.
+    
+    Pass `next_cursor` from the previous page as `cursor` to continue.
+    """
     company_id = current_user["company_id"]
     
     if not company_id:
         raise HTTPException(status_code=400, detail="Company not found")
     
-    from subscription_service import list_invoices
-    
-    invoices = await list_invoices(db, company_id, limit=20)
+    before = _decode_invoice_cursor(cursor) if cursor else None
+    invoices = await subscription_service.list_invoices(db, company_id, limit=limit, before=before)
+    upcoming = None
+    if not cursor:
+        upcoming = await subscription_service.get_upcoming_invoice(db, company_id)
     
     return {
-        "invoices": [
-            {
-                "id": inv.id,
-                "amount": float(inv.amount),
-                "currency": inv.currency,
-                "status": inv.status,
-                "paid_at": inv.paid_at,
-                "invoice_pdf_url": inv.invoice_pdf_url,
-                "hosted_invoice_url": inv.hosted_invoice_url,
-                "created_at": inv.created_at,
-            }
-            for inv in invoices
-        ]
+        "invoices": [_invoice_response(inv) for inv in invoices],
+        "upcoming": _invoice_response(upcoming) if upcoming else None,
+        "next_cursor": _encode_invoice_cursor(invoices[-1]) if len(invoices) == limit else None,
     }
 
 
@@ -902,121 +1360,70 @@ async def stripe_webhook(
     request: Request,
     db: AsyncSession = Depends(get_db),
 ):
-    """Handle Stripe webhooks"""
+    """Verify and queue a Stripe webhook; the webhook worker applies it"""
     payload = await request.body()
     signature = request.headers.get("stripe-signature")
     
     if not signature:
         raise HTTPException(status_code=400, detail="Missing signature")
     
-    from stripe_service import StripeService
-    from subscription_service import create_paid_subscription, create_invoice_record
-    
     try:
-        # Verify webhook signature
-        event = StripeService.verify_webhook_signature(payload, signature)
-        
-        # Handle different event types
-        if event["type"] == "checkout.session.completed":
-            # Subscription created successfully
-            session = event["data"]["object"]
-            metadata = session.get("metadata", {})
-            company_id = uuid.UUID(metadata.get("company_id"))
-            plan = metadata.get("plan")
-            billing_cycle = metadata.get("billing_cycle")
-            
-            # Get subscription details from Stripe
-            subscription_id = session.get("subscription")
-            stripe_service = StripeService()
-            stripe_subscription = await stripe_service.get_subscription(subscription_id)
-            
-            # Create subscription in database
-            await create_paid_subscription(
-                db,
-                company_id=company_id,
-                plan=plan,
-                billing_cycle=billing_cycle,
-                stripe_customer_id=session.get("customer"),
-                stripe_subscription_id=subscription_id,
-                stripe_price_id=stripe_subscription["items"]["data"][0]["price"]["id"],
-                currency=session.get("currency", "usd").upper(),
-                amount=session.get("amount_total", 0) / 100,
-            )
-        
-        elif event["type"] == "invoice.paid":
-            # Invoice paid successfully
-            invoice = event["data"]["object"]
-            customer_id = invoice.get("customer")
-            
-            # Find subscription by Stripe customer ID
-            result = await db.execute(
-                select(db.Subscription)
-                .where(db.Subscription.stripe_customer_id == customer_id)
-                .where(db.Subscription.status.in_(["active", "trialing"]))
-            )
-            subscription = result.scalar_one_or_none()
-            
-            if subscription:
-                # Create invoice record
-                await create_invoice_record(
-                    db,
-                    company_id=subscription.company_id,
-                    subscription_id=subscription.id,
-                    stripe_invoice_id=invoice.get("id"),
-                    amount=invoice.get("amount_paid", 0) / 100,
-                    currency=invoice.get("currency", "usd").upper(),
-                    status="paid",
-                    invoice_pdf_url=invoice.get("invoice_pdf"),
-                    hosted_invoice_url=invoice.get("hosted_invoice_url"),
-                    paid_at=datetime.fromtimestamp(invoice.get("status_transitions", {}).get("paid_at", 0)),
-                )
-        
-        elif event["type"] == "customer.subscription.updated":
-            # Subscription updated (renewed, upgraded, etc.)
-            subscription = event["data"]["object"]
-            stripe_subscription_id = subscription.get("id")
-            
-            # Update subscription in database
-            result = await db.execute(
-                select(db.Subscription)
-                .where(db.Subscription.stripe_subscription_id == stripe_subscription_id)
-            )
-            db_subscription = result.scalar_one_or_none()
-            
-            if db_subscription:
-                db_subscription.status = subscription.get("status")
-                db_subscription.current_period_start = datetime.fromtimestamp(subscription.get("current_period_start"))
-                db_subscription.current_period_end = datetime.fromtimestamp(subscription.get("current_period_end"))
-                
-                if subscription.get("cancel_at"):
-                    db_subscription.cancel_at = datetime.fromtimestamp(subscription.get("cancel_at"))
-                
-                await db.commit()
-        
-        elif event["type"] == "customer.subscription.deleted":
-            # Subscription canceled/expired
-            subscription = event["data"]["object"]
-            stripe_subscription_id = subscription.get("id")
-            
-            # Update subscription in database
-            result = await db.execute(
-                select(db.Subscription)
-                .where(db.Subscription.stripe_subscription_id == stripe_subscription_id)
-            )
-            db_subscription = result.scalar_one_or_none()
-            
-            if db_subscription:
-                db_subscription.status = "canceled"
-                db_subscription.active = False
-                db_subscription.ended_at = datetime.utcnow()
-                db_subscription.plan = "free"  # Downgrade to free
-                
-                await db.commit()
-        
-        return {"status": "success"}
-    
+        StripeService.verify_webhook_signature(payload, signature)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"Webhook error: {e}")
-        raise HTTPException(status_code=500, detail="Webhook processing failed")
+    
+    # Stripe retries deliveries, so duplicates are acknowledged without re-queueing
+    if await webhook_worker.enqueue_event(db, json.loads(payload)):
+        webhook_worker.worker.wake()
+    
+    return {"status": "success"}
+
+
+# ========== Admin Instrumentation Routes ==========
+
+@router.get("/admin/loop-stats")
+async def get_loop_stats(current_user: dict = Depends(get_current_user)):
+    """Event-loop lag statistics for this worker (superadmin only)."""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return profiling.loop_monitor.stats()
+
+
+@router.get("/admin/ingest-stats")
+async def get_ingest_stats(current_user: dict = Depends(get_current_user)):
+    """Analytics hits recorded and dropped (bots, duplicates) and enrichment caches of this worker (superadmin only)."""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return {**ingest_filter.stats(), "enrichment": enrichment.stats()}
+
+
+@router.get("/admin/pool-stats")
+async def get_pool_stats(current_user: dict = Depends(get_current_user)):
+    """Database connection hold times per route for this worker (superadmin only)."""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return pool_metrics.stats()
+
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(5, gt=0, le=profiling.MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user),
+):
+    """Sample this worker's stacks and return a collapsed-stack profile (superadmin only).
+
+    The output can be fed straight into flamegraph.pl or speedscope.
+    """
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    try:
+        profile = await asyncio.to_thread(profiling.sample_stacks, seconds, interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return PlainTextResponse(profile)
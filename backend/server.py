@@ -0,0 +1,117 @@
+"""
+Production Server
+Runs the API on uvicorn worker processes under gunicorn
+
+Usage:
+    python server.py
+
+Runs one worker per CPU unless WEB_CONCURRENCY says otherwise. Live
+analytics streams are shared through Postgres LISTEN/NOTIFY, so a dashboard
+sees events tracked by any worker. What still lives in each worker's memory:
+
+- Ingestion dedup window (ANALYTICS_DEDUP_WINDOW_SECONDS): a repeat hit is
+  only dropped when it reaches the worker that saw the first one, so with N
+  workers a burst of duplicates can be counted up to N times.
+- Sketch buffer: each worker merges its own into the database every 10
+  seconds and on shutdown, so reports lag by up to that long; nothing is lost.
+- Short link and time series caches: a deletion evicts entries in the worker
+  that handled it; other workers keep serving them until their TTL (300
+  seconds and ANALYTICS_TIMESERIES_CACHE_TTL) runs out.
+- Custom domain host map: a domain verified on one worker is accepted by the
+  others after their next refresh (HOST_REFRESH_SECONDS).
+- Webhook and purge wake-ups only reach the worker that queued the job; the
+  other workers pick jobs up on their next poll (5 and 10 seconds).
+
+The app is imported once in the master and forked into the workers. On
+SIGTERM each worker stops accepting connections, ends open analytics
+streams, waits for in-flight requests and then runs the app's shutdown
+(which flushes buffered analytics) before exiting.
+"""
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from uvicorn.main import Server
+from uvicorn.workers import UvicornWorker
+
+# Seconds gunicorn waits for a worker to exit after SIGTERM before killing it
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# Part of the graceful window reserved for draining requests; the rest is
+# left for the lifespan shutdown to flush buffers
+DRAIN_TIMEOUT = max(1, GRACEFUL_TIMEOUT - 10)
+
+
+class DrainingServer(Server):
+    """Uvicorn server that ends long-lived event streams as soon as shutdown begins.
+
+    Otherwise open dashboard streams would hold the worker until gunicorn
+    kills it, skipping the application shutdown.
+    """
+
+    def handle_exit(self, sig, frame) -> None:
+        from analytics_stream import broker
+        broker.close_all()
+        super().handle_exit(sig, frame)
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": "auto",
+        "http": "auto",
+        "timeout_graceful_shutdown": DRAIN_TIMEOUT,
+    }
+
+    async def _serve(self) -> None:
+        # Same as UvicornWorker._serve, with the draining server
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+def post_fork(server, worker) -> None:
+    # Never share pooled connections opened in the master with a child
+    from database import engine
+    engine.sync_engine.dispose(close=False)
+
+
+class ProductionServer(BaseApplication):
+    """Gunicorn application that preloads `main.app` before forking workers."""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        return app
+
+
+def main() -> None:
+    options = {
+        "bind": f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}",
+        "workers": int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+        "worker_class": Worker,
+        "preload_app": True,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": int(os.getenv("WORKER_TIMEOUT", "60")),
+        "keepalive": 5,
+        # Only trust X-Forwarded-For from the reverse proxy: client addresses feed
+        # unique visitors, dedup and geo lookups
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        "accesslog": "-",
+        "post_fork": post_fork,
+    }
+    ProductionServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
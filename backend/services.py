@@ -1,44 +1,64 @@
+"""
+Core Services
+Company, employee, card, user and analytics operations
+
+Services run inside the caller's transaction: they add and flush but never
+commit, so a route can combine several of them and commit once.
+"""
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, bindparam, insert, update, delete, and_
 from sqlalchemy.orm import selectinload
-from typing import List, Optional
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+import asyncio
 import uuid
-import slugify
 
+import analytics_dimensions
 import database_models as db
 import models
-from security import hash_password
+import short_links
+import slugs
+import subscription_service
+import timeseries
+from analytics_codes import storable_ip
+from analytics_stream import CHANNEL as STREAM_CHANNEL, notify_payloads
+from database import after_commit
+from ids import uuid7
+from sketch_service import aggregator
+from security import hash_password, verify_password
+from settings import settings
+from tenant_hosts import check_verification, host_map, new_verification_token
 
 
 # ========== Company Services ==========
 
 async def create_company(session: AsyncSession, company_data: models.CompanyCreate) -> db.Company:
     """Create a new company."""
-    base_slug = slugify.slugify(company_data.name)
-    # Add UUID suffix to ensure uniqueness
-    slug = f"{base_slug}-{str(uuid.uuid4())[:8]}"
-    
     company = db.Company(
         name=company_data.name,
         domain=company_data.domain,
+        domain_verification_token=new_verification_token() if company_data.domain else None,
         logo_url=company_data.logo_url,
         brand_color=company_data.brand_color,
-        slug=slug,
     )
-    session.add(company)
-    await session.commit()
-    await session.refresh(company)
+    await slugs.add_with_slugs(
+        session, [company], db.Company.slug, [slugs.base_slug(company_data.name, "company")]
+    )
     
     # Create free subscription for new company
-    from subscription_service import create_free_subscription
-    await create_free_subscription(session, company.id)
+    await subscription_service.create_free_subscription(session, company.id)
     
     return company
 
 
-async def get_company_by_id(session: AsyncSession, company_id: uuid.UUID) -> Optional[db.Company]:
-    """Get a company by ID."""
-    result = await session.execute(select(db.Company).where(db.Company.id == company_id))
+async def get_company_by_id(
+    session: AsyncSession, company_id: uuid.UUID, include_deleted: bool = False
+) -> Optional[db.Company]:
+    """Get a company by ID; companies being purged only with `include_deleted`."""
+    query = select(db.Company).where(db.Company.id == company_id)
+    if not include_deleted:
+        query = query.where(db.Company.deleted_at.is_(None))
+    result = await session.execute(query)
     return result.scalar_one_or_none()
 
 
@@ -49,26 +69,46 @@ async def get_company_by_slug(session: AsyncSession, slug: str) -> Optional[db.C
 
 
 async def update_company(session: AsyncSession, company_id: uuid.UUID, company_data: dict) -> Optional[db.Company]:
-    """Update company details (name, domain, logo_url, brand_color)."""
+    """Update company details (name, domain, logo_url, brand_color, timezone)."""
     company = await get_company_by_id(session, company_id)
     if not company:
         return None
     
     if "name" in company_data:
         company.name = company_data["name"]
-    if "domain" in company_data:
+    if "domain" in company_data and company_data["domain"] != company.domain:
+        # A new domain has to be verified again before it is served
         company.domain = company_data["domain"]
+        company.domain_verification_token = new_verification_token() if company.domain else None
+        company.domain_verified_at = None
     if "logo_url" in company_data:
         company.logo_url = company_data["logo_url"]
     if "brand_color" in company_data:
         company.brand_color = company_data["brand_color"]
+    if company_data.get("timezone"):
+        company.timezone = company_data["timezone"]
     
     session.add(company)
-    await session.commit()
-    await session.refresh(company)
+    await session.flush()
+    if "domain" in company_data:
+        after_commit(session, lambda: host_map.update(company))
     return company
 
 
+async def verify_company_domain(session: AsyncSession, company: db.Company) -> bool:
+    """Mark the company's domain verified if its TXT record carries the token; True once verified."""
+    if company.domain_verified_at is not None:
+        return True
+    if not company.domain or not company.domain_verification_token:
+        return False
+    if not await check_verification(company.domain, company.domain_verification_token):
+        return False
+    company.domain_verified_at = datetime.utcnow()
+    await session.flush()
+    after_commit(session, lambda: host_map.update(company))
+    return True
+
+
 async def update_company_branding(session: AsyncSession, company_id: uuid.UUID, branding_data: dict) -> db.Company:
     """Update company branding (brand_color and/or logo_url)."""
     company = await get_company_by_id(session, company_id)
@@ -81,8 +121,7 @@ async def update_company_branding(session: AsyncSession, company_id: uuid.UUID,
         company.logo_url = branding_data["logo_url"]
     
     session.add(company)
-    await session.commit()
-    await session.refresh(company)
+    await session.flush()
     return company
 
 
@@ -101,15 +140,48 @@ async def create_employee(
 ) -> db.Employee:
     """Create a new employee."""
     # Check subscription limits
-    from subscription_service import enforce_employee_limit
-    await enforce_employee_limit(session, company_id)
+    await subscription_service.enforce_employee_limit(session, company_id)
     
-    # Generate slug from name
-    base_slug = slugify.slugify(employee_data.full_name)
-    public_slug = f"{base_slug}-{str(uuid.uuid4())[:8]}"
+    # Usually already in the identity map (loaded with the current user)
+    company = await session.get(db.Company, company_id)
+    employee = _new_employee(company, employee_data)
+    await slugs.add_with_slugs(
+        session, [employee], db.Employee.public_slug, [slugs.base_slug(employee_data.full_name, "card")]
+    )
     
-    employee = db.Employee(
-        company_id=company_id,
+    # Create a card for the employee
+    await create_cards(session, [employee])
+    
+    return employee
+
+
+async def create_employees_bulk(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    employees_data: List[models.EmployeeCreate]
+) -> List[db.Employee]:
+    """Create many employees at once (bulk import), allocating their slugs in one batch."""
+    limit_info = await subscription_service.check_employee_limit(session, company_id)
+    if limit_info["current"] + len(employees_data) > limit_info["limit"]:
+        raise ValueError(
+            f"Employee limit reached ({limit_info['current']}/{limit_info['limit']}). "
+            f"Upgrade your plan to add more employees."
+        )
+    
+    company = await session.get(db.Company, company_id)
+    employees = [_new_employee(company, data) for data in employees_data]
+    await slugs.add_with_slugs(
+        session, employees, db.Employee.public_slug,
+        [slugs.base_slug(data.full_name, "card") for data in employees_data],
+    )
+    await create_cards(session, employees)
+    
+    return employees
+
+
+def _new_employee(company: db.Company, employee_data: models.EmployeeCreate) -> db.Employee:
+    return db.Employee(
+        company_id=company.id,
         full_name=employee_data.full_name,
         job_title=employee_data.job_title,
         email=employee_data.email,
@@ -118,16 +190,7 @@ async def create_employee(
         photo_url=getattr(employee_data, 'photo_url', None),
         bio=getattr(employee_data, 'bio', None),
         social_links=getattr(employee_data, 'social_links', {}),
-        public_slug=public_slug,
     )
-    session.add(employee)
-    await session.commit()
-    await session.refresh(employee, ["company"])
-    
-    # Create a card for the employee
-    await create_card(session, employee)
-    
-    return employee
 
 
 async def get_employee_by_id(session: AsyncSession, employee_id: uuid.UUID) -> Optional[db.Employee]:
@@ -140,24 +203,69 @@ async def get_employee_by_id(session: AsyncSession, employee_id: uuid.UUID) -> O
     return result.scalar_one_or_none()
 
 
-async def get_employee_by_slug(
+class PublicCard(NamedTuple):
+    """Read model for the public card endpoints: employee, company and QR short-link columns."""
+    employee_id: uuid.UUID
+    company_id: uuid.UUID
+    full_name: str
+    job_title: Optional[str]
+    email: Optional[str]
+    phone: Optional[str]
+    whatsapp: Optional[str]
+    bio: Optional[str]
+    photo_url: Optional[str]
+    social_links: Optional[dict]
+    public_slug: str
+    company_name: str
+    company_slug: str
+    company_logo: Optional[str]
+    company_brand_color: Optional[str]
+    short_code: Optional[str]
+
+
+# Built once so SQLAlchemy's compiled cache and the driver's prepared statements are reused
+_PUBLIC_CARD_QUERY = (
+    select(
+        db.Employee.id,
+        db.Employee.company_id,
+        db.Employee.full_name,
+        db.Employee.job_title,
+        db.Employee.email,
+        db.Employee.phone,
+        db.Employee.whatsapp,
+        db.Employee.bio,
+        db.Employee.photo_url,
+        db.Employee.social_links,
+        db.Employee.public_slug,
+        db.Company.name,
+        db.Company.slug,
+        db.Company.logo_url,
+        db.Company.brand_color,
+        db.ShortLink.code,
+    )
+    .join(db.Company, db.Employee.company_id == db.Company.id)
+    .outerjoin(
+        db.ShortLink,
+        and_(db.ShortLink.employee_id == db.Employee.id, db.ShortLink.target == "vcard"),
+    )
+    .where(db.Company.slug == bindparam("company_slug"))
+    .where(db.Employee.public_slug == bindparam("employee_slug"))
+    .where(db.Company.deleted_at.is_(None))
+    .limit(1)
+)
+
+
+async def get_public_card(
     session: AsyncSession,
     company_slug: str,
     employee_slug: str
-) -> Optional[dict]:
-    """Get an employee by company and employee slug (public lookup).
-
-    Returns the ORM `Employee` instance with its `company` relationship loaded
-    (so callers can access `employee.company.slug`).
-    """
+) -> Optional[PublicCard]:
+    """Public lookup by company and employee slug, in a single query."""
     result = await session.execute(
-        select(db.Employee)
-        .join(db.Company, db.Employee.company_id == db.Company.id)
-        .where(db.Company.slug == company_slug)
-        .where(db.Employee.public_slug == employee_slug)
-        .options(selectinload(db.Employee.company))
+        _PUBLIC_CARD_QUERY, {"company_slug": company_slug, "employee_slug": employee_slug}
     )
-    return result.scalar_one_or_none()
+    row = result.first()
+    return PublicCard(*row) if row else None
 
 
 async def list_employees(session: AsyncSession, company_id: uuid.UUID, skip: int = 0, limit: int = 100) -> List[db.Employee]:
@@ -188,8 +296,7 @@ async def update_employee(
             setattr(employee, key, value)
     
     session.add(employee)
-    await session.commit()
-    await session.refresh(employee)
+    await session.flush()
     return employee
 
 
@@ -197,60 +304,55 @@ async def delete_employee(
     session: AsyncSession,
     employee_id: uuid.UUID
 ) -> bool:
-    """Delete an employee and associated card."""
-    employee = await get_employee_by_id(session, employee_id)
-    if not employee:
+    """Delete an employee with one DELETE.
+
+    Card, short links, analytics and sketches go with it via ON DELETE
+    CASCADE, so nothing is loaded into the session however many scans
+    the card has.
+    """
+    result = await session.execute(
+        delete(db.Employee).where(db.Employee.id == employee_id).returning(db.Employee.company_id)
+    )
+    company_id = result.scalar_one_or_none()
+    if company_id is None:
         return False
-    
-    # Delete associated card first (foreign key constraint)
-    card = await get_card_by_employee(session, employee_id)
-    if card:
-        await session.delete(card)
-    
-    # Delete employee
-    await session.delete(employee)
-    await session.commit()
+
+    def evict():
+        short_links.evict_employee(employee_id)
+        timeseries.evict_company(company_id)
+    after_commit(session, evict)
     return True
 
 
 # ========== Card Services ==========
 
-async def create_card(session: AsyncSession, employee: db.Employee) -> db.Card:
-    """Create a digital card for an employee."""
-    # Resolve company slug so public URLs use human-friendly slugs (not UUIDs)
-    company = await get_company_by_id(session, employee.company_id)
-    company_slug = company.slug if company else str(employee.company_id)
-
-    # Use environment variables for URLs - allows dynamic configuration on network changes
-    import os
-    API_HOST = os.getenv("API_HOST", "localhost")
-    API_PORT = os.getenv("API_PORT", "8000")
-    FRONTEND_HOST = os.getenv("FRONTEND_HOST", "localhost")
-    FRONTEND_PORT = os.getenv("FRONTEND_PORT", "3000")
-    ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
-    
-    # Determine protocol based on environment
-    PROTOCOL = "https" if ENVIRONMENT == "production" else "http"
-    
-    # Card URL for viewing the digital card
-    card_url = f"{PROTOCOL}://{FRONTEND_HOST}:{FRONTEND_PORT}/card/{company_slug}/{employee.public_slug}"
-    
-    # QR code URL - points to the new QR endpoint that redirects to the QR image
-    qr_url = f"{PROTOCOL}://{API_HOST}:{API_PORT}/api/card/{company_slug}/{employee.public_slug}/qr-vcard"
-
-    # vCard URL - points to the API endpoint that returns the .vcf file
-    vcard_url = f"{PROTOCOL}://{API_HOST}:{API_PORT}/api/card/{company_slug}/{employee.public_slug}/vcard"
+async def create_cards(session: AsyncSession, employees: List[db.Employee]) -> List[db.Card]:
+    """Create digital cards for new employees (their `company` must be set)."""
+    codes = await short_links.create_many(session, [employee.id for employee in employees], "vcard")
     
-    card = db.Card(
-        employee_id=employee.id,
-        url=card_url,
-        qr_code=qr_url,
-        vcard_url=vcard_url,
+    # Stored copies for exports and integrations; API responses derive URLs from the
+    # slugs, and card_urls.py rewrites these rows when the host settings change
+    cards = []
+    for employee in employees:
+        company_slug = employee.company.slug
+        cards.append(db.Card(
+            employee_id=employee.id,
+            url=settings.card_url(company_slug, employee.public_slug),
+            qr_code=settings.short_url(codes[employee.id]),
+            vcard_url=settings.vcard_url(company_slug, employee.public_slug),
+        ))
+    session.add_all(cards)
+    await session.flush()
+    return cards
+
+
+async def assign_short_link(session: AsyncSession, employee_id: uuid.UUID) -> str:
+    """Give an existing card a short-link QR payload and return its code."""
+    code = await short_links.get_or_create(session, employee_id, "vcard")
+    await session.execute(
+        update(db.Card).where(db.Card.employee_id == employee_id).values(qr_code=settings.short_url(code))
     )
-    session.add(card)
-    await session.commit()
-    await session.refresh(card)
-    return card
+    return code
 
 
 async def get_card_by_employee(session: AsyncSession, employee_id: uuid.UUID) -> Optional[db.Card]:
@@ -265,23 +367,36 @@ async def get_card_by_employee(session: AsyncSession, employee_id: uuid.UUID) ->
 
 # ========== User Services ==========
 
+async def hash_password_async(password: str) -> str:
+    """bcrypt is deliberately slow (~250ms); keep it off the event loop."""
+    return await asyncio.to_thread(hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await asyncio.to_thread(verify_password, password, password_hash)
+
+
 async def create_user(
     session: AsyncSession,
     user_data: models.UserCreate,
-    company_id: uuid.UUID
+    company_id: uuid.UUID,
+    password_hash: Optional[str] = None
 ) -> db.User:
-    """Create a new user."""
+    """Create a new user.
+    
+    Pass `password_hash` (from `hash_password_async`) to hash before the
+    transaction starts instead of while it holds a connection.
+    """
     user = db.User(
         company_id=company_id,
         email=user_data.email,
-        password_hash=hash_password(user_data.password),
+        password_hash=password_hash or await hash_password_async(user_data.password),
         full_name=user_data.full_name,
         role=getattr(user_data, 'role', 'admin'),
         is_active=True,
     )
     session.add(user)
-    await session.commit()
-    await session.refresh(user)
+    await session.flush()
     return user
 
 
@@ -307,54 +422,131 @@ async def get_user_by_id(session: AsyncSession, user_id: uuid.UUID) -> Optional[
 
 # ========== Analytics Services ==========
 
+class AnalyticsRow(NamedTuple):
+    """An analytics event with its encoded columns decoded."""
+    id: uuid.UUID
+    employee_id: Optional[uuid.UUID]
+    company_id: uuid.UUID
+    timestamp: datetime
+    device: Optional[str]
+    region: Optional[str]
+    action: str
+    ip_address: Optional[str] = None  # Only set on freshly tracked events, untruncated
+
+
+
 async def track_event(
     session: AsyncSession,
     company_id: uuid.UUID,
     event_data: models.AnalyticsEventCreate,
     employee_id: Optional[uuid.UUID] = None,
-) -> db.AnalyticsEvent:
+    ip_address: Optional[str] = None,
+) -> AnalyticsRow:
     """Track an analytics event."""
-    from datetime import datetime
-    
-    event = db.AnalyticsEvent(
-        company_id=company_id,
-        employee_id=employee_id,
-        timestamp=datetime.utcnow(),
-        device=event_data.device,
-        region=event_data.region,
-        action=event_data.action,
-        ip_address=getattr(event_data, 'ip_address', None),
+    events = await track_events(session, company_id, [event_data], employee_id, ip_address)
+    return events[0]
+
+
+async def track_events(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    events_data: List[models.AnalyticsEventCreate],
+    employee_id: Optional[uuid.UUID] = None,
+    ip_address: Optional[str] = None,
+) -> List[AnalyticsRow]:
+    """Track several events from one visitor with a single INSERT."""
+    now = datetime.utcnow()
+    events = [
+        AnalyticsRow(
+            id=uuid7(),
+            employee_id=employee_id,
+            company_id=company_id,
+            timestamp=now,
+            device=analytics_dimensions.normalize(data.device),
+            region=analytics_dimensions.normalize(data.region),
+            action=data.action,
+            ip_address=ip_address,
+        )
+        for data in events_data
+    ]
+    device_ids = await analytics_dimensions.devices.ids_for(session, [e.device for e in events])
+    region_ids = await analytics_dimensions.regions.ids_for(session, [e.region for e in events])
+    stored_ip = storable_ip(ip_address)
+    await session.execute(
+        insert(db.AnalyticsEvent).values([
+            {
+                "id": event.id,
+                "company_id": company_id,
+                "employee_id": employee_id,
+                "timestamp": event.timestamp,
+                "device_id": device_ids.get(event.device),
+                "region_id": region_ids.get(event.region),
+                "action": event.action,
+                "ip_address": stored_ip,
+            }
+            for event in events
+        ])
+    )
+
+    # Live dashboards on every worker get the events once this commits
+    for payload in notify_payloads(events):
+        await session.execute(select(func.pg_notify(STREAM_CHANNEL, payload)))
+
+    def record():
+        for event in events:
+            aggregator.record(event)
+    after_commit(session, record)
+    return events
+
+
+# Decodes device and region ids back into names
+_ANALYTICS_ROWS = (
+    select(
+        db.AnalyticsEvent.id,
+        db.AnalyticsEvent.employee_id,
+        db.AnalyticsEvent.company_id,
+        db.AnalyticsEvent.timestamp,
+        db.AnalyticsDevice.name,
+        db.AnalyticsRegion.name,
+        db.AnalyticsEvent.action,
     )
-    session.add(event)
-    await session.commit()
-    await session.refresh(event)
-    return event
+    .outerjoin(db.AnalyticsDevice, db.AnalyticsEvent.device_id == db.AnalyticsDevice.id)
+    .outerjoin(db.AnalyticsRegion, db.AnalyticsEvent.region_id == db.AnalyticsRegion.id)
+)
 
 
 async def get_analytics_by_company(
     session: AsyncSession,
-    company_id: uuid.UUID
-) -> List[db.AnalyticsEvent]:
-    """Get all analytics events for a company."""
+    company_id: uuid.UUID,
+    skip: int = 0,
+    limit: int = 1000,
+) -> List[AnalyticsRow]:
+    """Get a page of a company's analytics events, newest first."""
     result = await session.execute(
-        select(db.AnalyticsEvent)
+        _ANALYTICS_ROWS
         .where(db.AnalyticsEvent.company_id == company_id)
         .order_by(db.AnalyticsEvent.timestamp.desc())
+        .offset(skip)
+        .limit(limit)
     )
-    return result.scalars().all()
+    return [AnalyticsRow(*row) for row in result.all()]
 
 
 async def get_analytics_by_employee(
     session: AsyncSession,
-    employee_id: uuid.UUID
-) -> List[db.AnalyticsEvent]:
-    """Get all analytics events for an employee."""
+    employee_id: uuid.UUID,
+    skip: int = 0,
+    limit: int = 1000,
+) -> List[AnalyticsRow]:
+    """Get a page of an employee's analytics events, newest first."""
     result = await session.execute(
-        select(db.AnalyticsEvent)
+        _ANALYTICS_ROWS
         .where(db.AnalyticsEvent.employee_id == employee_id)
         .order_by(db.AnalyticsEvent.timestamp.desc())
+        .offset(skip)
+        .limit(limit)
     )
-    return result.scalars().all()
+    return [AnalyticsRow(*row) for row in result.all()]
 
 
 async def get_analytics_summary(session: AsyncSession, company_id: uuid.UUID) -> dict:
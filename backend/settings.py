@@ -0,0 +1,71 @@
+"""
+Public URL Settings
+Host configuration read once at startup, and the builders for every public URL the API hands out
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+def _base_url(protocol: str, host: str, port: str) -> str:
+    if not port or DEFAULT_PORTS[protocol] == port:
+        return f"{protocol}://{host}"
+    return f"{protocol}://{host}:{port}"
+
+
+@dataclass(frozen=True)
+class Settings:
+    api_host: str = "localhost"
+    api_port: str = "8000"
+    frontend_host: str = "localhost"
+    frontend_port: str = "3000"
+    environment: str = "development"
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            api_host=os.getenv("API_HOST", cls.api_host),
+            api_port=os.getenv("API_PORT", cls.api_port),
+            frontend_host=os.getenv("FRONTEND_HOST", cls.frontend_host),
+            frontend_port=os.getenv("FRONTEND_PORT", cls.frontend_port),
+            environment=os.getenv("ENVIRONMENT", cls.environment),
+        )
+
+    @property
+    def protocol(self) -> str:
+        return "https" if self.environment == "production" else "http"
+
+    @property
+    def api_base_url(self) -> str:
+        return _base_url(self.protocol, self.api_host, self.api_port)
+
+    @property
+    def frontend_base_url(self) -> str:
+        return _base_url(self.protocol, self.frontend_host, self.frontend_port)
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever any derived URL would change."""
+        return hashlib.sha256(f"{self.api_base_url} {self.frontend_base_url}".encode()).hexdigest()[:16]
+
+    # ---- URL builders ----
+
+    def frontend_url(self, path: str) -> str:
+        return f"{self.frontend_base_url}{path}"
+
+    def card_url(self, company_slug: str, employee_slug: str) -> str:
+        """The card page in the frontend."""
+        return self.frontend_url(f"/card/{company_slug}/{employee_slug}")
+
+    def vcard_url(self, company_slug: str, employee_slug: str) -> str:
+        """The .vcf download."""
+        return f"{self.api_base_url}/api/card/{company_slug}/{employee_slug}/vcard"
+
+    def short_url(self, code: str) -> str:
+        """A QR short link."""
+        return f"{self.api_base_url}/s/{code}"
+
+
+settings = Settings.from_env()
@@ -0,0 +1,118 @@
+"""
+Short Links
+Compact `/s/{code}` URLs for QR payloads, resolved with one key read and an in-memory cache
+"""
+import os
+import secrets
+import string
+import uuid
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+from cache import LRUCache
+from settings import settings
+
+# 62^7 ≈ 3.5e12 codes; collisions are retried
+CODE_ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 7
+MAX_ATTEMPTS = 5
+
+TARGETS = ("vcard", "card")
+
+# Entries expire so a card deleted through another worker stops resolving here too
+cache = LRUCache(maxsize=int(os.getenv("SHORT_LINK_CACHE_SIZE", "50000")), ttl=300)
+
+
+class ShortTarget(NamedTuple):
+    employee_id: uuid.UUID
+    company_id: uuid.UUID
+    company_slug: str
+    employee_slug: str
+    target: str
+
+
+def _new_code() -> str:
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def target_url(link: ShortTarget) -> str:
+    """Where a scan of the short link is redirected."""
+    if link.target == "card":
+        return settings.card_url(link.company_slug, link.employee_slug)
+    # Relative, so links followed on a custom domain stay on it
+    return f"/api/card/{link.company_slug}/{link.employee_slug}/vcard"
+
+
+async def get_or_create(session: AsyncSession, employee_id: uuid.UUID, target: str = "vcard") -> str:
+    """The employee's code for `target`, creating it if needed. Does not commit."""
+    for _ in range(MAX_ATTEMPTS):
+        result = await session.execute(
+            insert(db.ShortLink)
+            .values(code=_new_code(), employee_id=employee_id, target=target)
+            .on_conflict_do_nothing()
+            .returning(db.ShortLink.code)
+        )
+        code = result.scalar_one_or_none()
+        if code:
+            return code
+        # Either the employee already has a code or the random code collided
+        existing = await session.execute(
+            select(db.ShortLink.code)
+            .where(db.ShortLink.employee_id == employee_id, db.ShortLink.target == target)
+        )
+        code = existing.scalar_one_or_none()
+        if code:
+            return code
+    raise RuntimeError("Could not allocate a short link code")
+
+
+async def create_many(session: AsyncSession, employee_ids: List[uuid.UUID], target: str = "vcard") -> Dict[uuid.UUID, str]:
+    """Codes for new employees in one INSERT; rare collisions fall back to `get_or_create`."""
+    if not employee_ids:
+        return {}
+    result = await session.execute(
+        insert(db.ShortLink)
+        .values([{"code": _new_code(), "employee_id": eid, "target": target} for eid in employee_ids])
+        .on_conflict_do_nothing()
+        .returning(db.ShortLink.employee_id, db.ShortLink.code)
+    )
+    codes = dict(result.all())
+    for employee_id in employee_ids:
+        if employee_id not in codes:
+            codes[employee_id] = await get_or_create(session, employee_id, target)
+    return codes
+
+
+async def resolve(session: AsyncSession, code: str) -> Optional[ShortTarget]:
+    """Look up a code, from the cache or with a single primary-key read."""
+    link = cache.get(code)
+    if link is not None:
+        return link
+    result = await session.execute(
+        select(
+            db.ShortLink.employee_id,
+            db.Employee.company_id,
+            db.Company.slug,
+            db.Employee.public_slug,
+            db.ShortLink.target,
+        )
+        .join(db.Employee, db.ShortLink.employee_id == db.Employee.id)
+        .join(db.Company, db.Employee.company_id == db.Company.id)
+        .where(db.ShortLink.code == code)
+        .where(db.Company.deleted_at.is_(None))
+    )
+    row = result.first()
+    if row is None:
+        return None
+    link = ShortTarget(*row)
+    cache.put(code, link)
+    return link
+
+
+def evict_employee(employee_id: uuid.UUID) -> None:
+    """Forget cached codes of a deleted employee."""
+    cache.evict_where(lambda link: link.employee_id == employee_id)
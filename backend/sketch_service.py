@@ -0,0 +1,222 @@
+"""
+Analytics Sketch Service
+Maintains per-day unique-visitor and top-region/device sketches for cards and companies
+"""
+import asyncio
+import logging
+import uuid
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import select, and_, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+from database import AsyncSessionLocal
+from ids import uuid7
+from sketches import HyperLogLog, TopK
+
+logger = logging.getLogger(__name__)
+
+KIND_VISITORS = "visitors"
+KIND_REGIONS = "regions"
+KIND_DEVICES = "devices"
+TOP_KINDS = {"region": KIND_REGIONS, "device": KIND_DEVICES}
+
+# How often buffered sketch updates are merged into the database
+FLUSH_INTERVAL_SECONDS = 10.0
+
+Sketch = Union[HyperLogLog, TopK]
+SketchKey = Tuple[uuid.UUID, Optional[uuid.UUID], date, str]
+
+
+def _new_sketch(kind: str) -> Sketch:
+    return HyperLogLog() if kind == KIND_VISITORS else TopK()
+
+
+def _load_sketch(kind: str, data: bytes) -> Sketch:
+    return HyperLogLog.from_bytes(data) if kind == KIND_VISITORS else TopK.from_bytes(data)
+
+
+class SketchAggregator:
+    """Buffers sketch updates in memory and periodically merges them into `analytics_sketches`."""
+
+    def __init__(self):
+        self._pending: Dict[SketchKey, Sketch] = {}
+
+    def _sketch(self, key: SketchKey) -> Sketch:
+        sketch = self._pending.get(key)
+        if sketch is None:
+            sketch = self._pending[key] = _new_sketch(key[3])
+        return sketch
+
+    def record(self, event) -> None:
+        """Fold a tracked event (`services.AnalyticsRow`) into the card-level and company-level sketches."""
+        day = event.timestamp.date()
+        for employee_id in {None, event.employee_id}:
+            if event.ip_address:
+                self._sketch((event.company_id, employee_id, day, KIND_VISITORS)).add(event.ip_address)
+            if event.region:
+                self._sketch((event.company_id, employee_id, day, KIND_REGIONS)).add(event.region)
+            if event.device:
+                self._sketch((event.company_id, employee_id, day, KIND_DEVICES)).add(event.device)
+
+    def pending(self, key: SketchKey) -> Optional[Sketch]:
+        return self._pending.get(key)
+
+    def _requeue(self, key: SketchKey, sketch: Sketch) -> None:
+        current = self._pending.get(key)
+        if current is None:
+            self._pending[key] = sketch
+        else:
+            current.merge(sketch)
+
+    async def flush(self) -> None:
+        """Merge all buffered sketches into the database."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    leftovers = await _merge_into_db(session, pending)
+        except BaseException:
+            # Including cancellation at shutdown, so the final flush still has them
+            for key, sketch in pending.items():
+                self._requeue(key, sketch)
+            raise
+        # Rows created concurrently by another worker are merged on the next flush
+        for key in leftovers:
+            self._requeue(key, pending[key])
+
+    async def run(self) -> None:
+        """Background loop flushing buffered sketches."""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush analytics sketches")
+
+
+async def _merge_into_db(session: AsyncSession, pending: Dict[SketchKey, Sketch]) -> List[SketchKey]:
+    company_keys = [(c, d, k) for (c, e, d, k) in pending if e is None]
+    employee_keys = [(e, d, k) for (c, e, d, k) in pending if e is not None]
+
+    conditions = []
+    if company_keys:
+        conditions.append(and_(
+            db.AnalyticsSketch.employee_id.is_(None),
+            tuple_(db.AnalyticsSketch.company_id, db.AnalyticsSketch.day, db.AnalyticsSketch.kind).in_(company_keys),
+        ))
+    if employee_keys:
+        conditions.append(
+            tuple_(db.AnalyticsSketch.employee_id, db.AnalyticsSketch.day, db.AnalyticsSketch.kind).in_(employee_keys)
+        )
+
+    result = await session.execute(
+        select(db.AnalyticsSketch).where(or_(*conditions)).with_for_update()
+    )
+    existing = {
+        (row.company_id, row.employee_id, row.day, row.kind): row
+        for row in result.scalars().all()
+    }
+
+    new_rows = []
+    for key, sketch in pending.items():
+        row = existing.get(key)
+        if row is not None:
+            merged = _load_sketch(row.kind, row.data)
+            merged.merge(sketch)
+            row.data = merged.to_bytes()
+        else:
+            company_id, employee_id, day, kind = key
+            new_rows.append({
+                "id": uuid7(),
+                "company_id": company_id,
+                "employee_id": employee_id,
+                "day": day,
+                "kind": kind,
+                "data": sketch.to_bytes(),
+            })
+
+    if not new_rows:
+        return []
+
+    inserted = await session.execute(
+        insert(db.AnalyticsSketch)
+        .values(new_rows)
+        .on_conflict_do_nothing()
+        .returning(db.AnalyticsSketch.id)
+    )
+    inserted_ids = set(inserted.scalars().all())
+    return [
+        (row["company_id"], row["employee_id"], row["day"], row["kind"])
+        for row in new_rows
+        if row["id"] not in inserted_ids
+    ]
+
+
+async def _merged_sketch(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    kind: str,
+    start: date,
+    end: date,
+    employee_id: Optional[uuid.UUID] = None,
+) -> Sketch:
+    """Merge the stored (and still-buffered) daily sketches for a date range."""
+    query = (
+        select(db.AnalyticsSketch.data)
+        .where(db.AnalyticsSketch.company_id == company_id)
+        .where(db.AnalyticsSketch.kind == kind)
+        .where(db.AnalyticsSketch.day >= start)
+        .where(db.AnalyticsSketch.day <= end)
+    )
+    if employee_id is None:
+        query = query.where(db.AnalyticsSketch.employee_id.is_(None))
+    else:
+        query = query.where(db.AnalyticsSketch.employee_id == employee_id)
+
+    merged = _new_sketch(kind)
+    for data in (await session.execute(query)).scalars():
+        merged.merge(_load_sketch(kind, data))
+
+    day = start
+    while day <= end:
+        buffered = aggregator.pending((company_id, employee_id, day, kind))
+        if buffered is not None:
+            merged.merge(buffered)
+        day += timedelta(days=1)
+
+    return merged
+
+
+async def count_unique_visitors(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    start: date,
+    end: date,
+    employee_id: Optional[uuid.UUID] = None,
+) -> int:
+    """Approximate number of distinct visitors (by IP) in [start, end]."""
+    sketch = await _merged_sketch(session, company_id, KIND_VISITORS, start, end, employee_id)
+    return sketch.count()
+
+
+async def top_values(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    dimension: str,
+    start: date,
+    end: date,
+    limit: int = 10,
+    employee_id: Optional[uuid.UUID] = None,
+) -> List[Tuple[str, int]]:
+    """Approximate most frequent regions or devices in [start, end]."""
+    sketch = await _merged_sketch(session, company_id, TOP_KINDS[dimension], start, end, employee_id)
+    return sketch.top(limit)
+
+
+aggregator = SketchAggregator()
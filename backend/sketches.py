@@ -0,0 +1,147 @@
+"""
+Probabilistic Sketches
+Fixed-size summaries for unique counts (HyperLogLog) and heavy hitters (Count-Min + top-k)
+"""
+import hashlib
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """HyperLogLog cardinality estimator (~1.6% standard error at p=12)."""
+
+    def __init__(self, precision: int = 12, registers: Optional[bytearray] = None):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str) -> None:
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        remaining_bits = 64 - self.p
+        w = x & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - w.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes([self.p]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        raw = zlib.decompress(data)
+        return cls(precision=raw[0], registers=bytearray(raw[1:]))
+
+
+# Count-Min counters are stored as little-endian uint32 and stop at the maximum instead of wrapping
+COUNTER_MAX = 0xFFFFFFFF
+
+
+def _counters_to_bytes(counters: array) -> bytes:
+    if sys.byteorder == "big":
+        counters = array("I", counters)
+        counters.byteswap()
+    return counters.tobytes()
+
+
+def _counters_from_bytes(data: bytes) -> array:
+    counters = array("I")
+    counters.frombytes(data)
+    if sys.byteorder == "big":
+        counters.byteswap()
+    return counters
+
+
+class TopK:
+    """Count-Min sketch with a bounded set of heavy-hitter candidates."""
+
+    _HEADER = struct.Struct(">HBB")
+
+    def __init__(
+        self,
+        width: int = 512,
+        depth: int = 4,
+        k: int = 20,
+        counters: Optional[array] = None,
+        candidates: Optional[Dict[str, int]] = None,
+    ):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.counters = counters if counters is not None else array("I", bytes(4 * width * depth))
+        self.candidates: Dict[str, int] = candidates or {}
+
+    def _cells(self, value: str) -> List[int]:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def estimate(self, value: str) -> int:
+        return min(self.counters[cell] for cell in self._cells(value))
+
+    def add(self, value: str, count: int = 1) -> None:
+        cells = self._cells(value)
+        for cell in cells:
+            self.counters[cell] = min(self.counters[cell] + count, COUNTER_MAX)
+        self._offer(value, min(self.counters[cell] for cell in cells))
+
+    def _offer(self, value: str, estimate: int) -> None:
+        if value in self.candidates or len(self.candidates) < self.k:
+            self.candidates[value] = estimate
+            return
+        weakest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[value] = estimate
+
+    def merge(self, other: "TopK") -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge sketches of different dimensions")
+        for i, value in enumerate(other.counters):
+            self.counters[i] = min(self.counters[i] + value, COUNTER_MAX)
+        for value in set(self.candidates) | set(other.candidates):
+            self.candidates.pop(value, None)
+            self._offer(value, self.estimate(value))
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int]]:
+        ranked = sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def to_bytes(self) -> bytes:
+        candidates = json.dumps(self.candidates, separators=(",", ":")).encode("utf-8")
+        header = self._HEADER.pack(self.width, self.depth, self.k)
+        return zlib.compress(header + _counters_to_bytes(self.counters) + candidates)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TopK":
+        raw = zlib.decompress(data)
+        width, depth, k = cls._HEADER.unpack_from(raw)
+        offset = cls._HEADER.size
+        counters = _counters_from_bytes(raw[offset:offset + 4 * width * depth])
+        candidates = json.loads(raw[offset + 4 * width * depth:].decode("utf-8"))
+        return cls(width=width, depth=depth, k=k, counters=counters, candidates=candidates)
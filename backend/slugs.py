@@ -0,0 +1,106 @@
+"""
+Slug Allocation
+Hands out the shortest free slug (`acme`, `acme-2`, `acme-3`, ...) for companies and cards
+"""
+import re
+from typing import Iterable, List, Sequence, Set
+
+import slugify
+from sqlalchemy import String, bindparam, select, or_, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Leaves room for a numeric suffix within the 255-character columns
+MAX_BASE_LENGTH = 240
+MAX_ATTEMPTS = 5
+
+
+def base_slug(name: str, fallback: str) -> str:
+    """Slugify a display name; names with no usable characters get `fallback`."""
+    return slugify.slugify(name or "", max_length=MAX_BASE_LENGTH) or fallback
+
+
+def _candidate(base: str, n: int) -> str:
+    return base if n == 1 else f"{base}-{n}"
+
+
+def _root(base: str) -> str:
+    """The base without a numeric suffix: `acme-2` and `acme` compete for the same slugs."""
+    return re.sub(r"-\d+$", "", base) or base
+
+
+async def _taken_slugs(session: AsyncSession, column, bases: Iterable[str]) -> Set[str]:
+    """Slugs in use that any of the bases could be allocated, in one indexed prefix query."""
+    roots = {_root(base) for base in bases}
+    # Slugs contain no LIKE wildcards, so a prefix match can use the pattern-ops index
+    result = await session.execute(
+        select(column).where(or_(*(
+            or_(column == root, column.like(f"{root}-%")) for root in roots
+        )))
+    )
+    return {slug for (slug,) in result}
+
+
+async def _lock_bases(session: AsyncSession, column, bases: Iterable[str]) -> None:
+    """Serialize allocation per root until the transaction ends.
+
+    Without this, concurrent signups for the same name all read the same free
+    number (uncommitted rows are invisible) and keep colliding on retry. The
+    lock is on the root so that "Acme" and "Acme 2" wait for each other too.
+    All locks are taken by one statement, in sorted order so batches cannot
+    deadlock each other.
+    """
+    table = column.class_.__tablename__
+    keys = sorted({f"{table}.{column.key}:{_root(base)}" for base in bases})
+    key = func.unnest(bindparam("keys", keys, type_=ARRAY(String))).table_valued("key").render_derived()
+    await session.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(key.c.key))).select_from(key).order_by(key.c.key)
+    )
+
+
+async def allocate(session: AsyncSession, column, bases: Sequence[str]) -> List[str]:
+    """Shortest free slug for each base, distinct within the batch.
+
+    Availability is read, not reserved: a writer that skips `add_with_slugs`
+    can still take the same slug first, so inserts must go through it.
+    """
+    # One set of full slugs: `jane-smith` numbered 2 and a plain `jane-smith-2` are the same slug
+    taken = await _taken_slugs(session, column, bases)
+    slugs = []
+    for base in bases:
+        n = 1
+        while _candidate(base, n) in taken:
+            n += 1
+        slug = _candidate(base, n)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def _is_slug_conflict(error: IntegrityError, column) -> bool:
+    constraint = getattr(error.orig.__cause__, "constraint_name", None) or str(error.orig)
+    return column.key in constraint
+
+
+async def add_with_slugs(session: AsyncSession, objects: Sequence, column, bases: Sequence[str]) -> None:
+    """Add objects with freshly allocated slugs and flush them.
+
+    Allocation holds a per-base advisory lock until the caller commits, so
+    commit promptly. Each attempt runs in a savepoint; if a slug was still
+    taken in the meantime, the savepoint is rolled back and the batch is
+    re-allocated. Does not commit.
+    """
+    attr = column.key
+    await _lock_bases(session, column, bases)
+    for attempt in range(MAX_ATTEMPTS):
+        for obj, slug in zip(objects, await allocate(session, column, bases)):
+            setattr(obj, attr, slug)
+        try:
+            async with session.begin_nested():
+                session.add_all(objects)
+                await session.flush()
+            return
+        except IntegrityError as e:
+            if not _is_slug_conflict(e, column) or attempt == MAX_ATTEMPTS - 1:
+                raise
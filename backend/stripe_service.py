@@ -2,21 +2,55 @@
 Stripe Payment Integration Service
 Handles all Stripe API interactions
 """
+from __future__ import annotations
+
+import asyncio
 import os
-import stripe
-from typing import Optional, Dict, Any
+import threading
+from typing import TYPE_CHECKING, Optional, Dict, Any
 from datetime import datetime, timedelta
 import uuid
 
-# Initialize Stripe
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+if TYPE_CHECKING:
+    import stripe
 
 # Webhook secret for signature verification
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 
+_stripe = None
+_stripe_lock = threading.Lock()
+
+
+def get_stripe():
+    """Import and configure the Stripe SDK once, on first use.
+
+    The SDK takes a few hundred milliseconds to import, so it is kept off
+    the startup path; `main` warms it up in a background thread.
+    """
+    global _stripe
+    if _stripe is None:
+        with _stripe_lock:
+            if _stripe is None:
+                import stripe
+                stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+                # Point at a local stand-in (see fake_stripe.py) for offline testing
+                if os.getenv("STRIPE_API_BASE"):
+                    stripe.api_base = os.getenv("STRIPE_API_BASE")
+                _stripe = stripe
+    return _stripe
+
+
+def from_timestamp(value: Optional[int]) -> Optional[datetime]:
+    """Stripe's Unix timestamps as the naive UTC datetimes stored in the database."""
+    return datetime.utcfromtimestamp(value) if value else None
+
 
 class StripeService:
-    """Service for handling Stripe operations"""
+    """Service for handling Stripe operations
+
+    The SDK is blocking, so every API call runs in a worker thread instead of
+    stalling the event loop.
+    """
 
     @staticmethod
     async def create_customer(
@@ -37,13 +71,15 @@ class StripeService:
         Returns:
             Stripe Customer object
         """
+        stripe = get_stripe()
         customer_metadata = metadata or {}
         customer_metadata.update({
             "company_id": str(company_id),
             "company_name": company_name,
         })
         
-        customer = stripe.Customer.create(
+        customer = await asyncio.to_thread(
+            stripe.Customer.create,
             email=email,
             name=company_name,
             metadata=customer_metadata,
@@ -74,6 +110,7 @@ class StripeService:
         Returns:
             Stripe Checkout Session
         """
+        stripe = get_stripe()
         session_params = {
             "customer": customer_id,
             "payment_method_types": ["card"],
@@ -87,16 +124,15 @@ class StripeService:
             "success_url": success_url,
             "cancel_url": cancel_url,
             "metadata": metadata or {},
+            # Copied onto the subscription, so its invoices can be matched to the company
+            "subscription_data": {"metadata": metadata or {}},
         }
         
         # Add trial period if specified
         if trial_days > 0:
-            session_params["subscription_data"] = {
-                "trial_period_days": trial_days,
-                "metadata": metadata or {},
-            }
+            session_params["subscription_data"]["trial_period_days"] = trial_days
         
-        session = stripe.checkout.Session.create(**session_params)
+        session = await asyncio.to_thread(stripe.checkout.Session.create, **session_params)
         return session
 
     @staticmethod
@@ -118,6 +154,7 @@ class StripeService:
         Returns:
             Stripe Subscription object
         """
+        stripe = get_stripe()
         subscription_params = {
             "customer": customer_id,
             "items": [{"price": price_id}],
@@ -128,7 +165,7 @@ class StripeService:
             trial_end = datetime.utcnow() + timedelta(days=trial_days)
             subscription_params["trial_end"] = int(trial_end.timestamp())
         
-        subscription = stripe.Subscription.create(**subscription_params)
+        subscription = await asyncio.to_thread(stripe.Subscription.create, **subscription_params)
         return subscription
 
     @staticmethod
@@ -146,13 +183,15 @@ class StripeService:
         Returns:
             Updated Stripe Subscription
         """
+        stripe = get_stripe()
         if at_period_end:
-            subscription = stripe.Subscription.modify(
+            subscription = await asyncio.to_thread(
+                stripe.Subscription.modify,
                 subscription_id,
                 cancel_at_period_end=True
             )
         else:
-            subscription = stripe.Subscription.delete(subscription_id)
+            subscription = await asyncio.to_thread(stripe.Subscription.delete, subscription_id)
         
         return subscription
 
@@ -167,7 +206,9 @@ class StripeService:
         Returns:
             Updated Stripe Subscription
         """
-        subscription = stripe.Subscription.modify(
+        stripe = get_stripe()
+        subscription = await asyncio.to_thread(
+            stripe.Subscription.modify,
             subscription_id,
             cancel_at_period_end=False
         )
@@ -190,9 +231,11 @@ class StripeService:
         Returns:
             Updated Stripe Subscription
         """
-        subscription = stripe.Subscription.retrieve(subscription_id)
+        stripe = get_stripe()
+        subscription = await asyncio.to_thread(stripe.Subscription.retrieve, subscription_id)
         
-        updated_subscription = stripe.Subscription.modify(
+        updated_subscription = await asyncio.to_thread(
+            stripe.Subscription.modify,
             subscription_id,
             items=[{
                 "id": subscription["items"]["data"][0].id,
@@ -206,17 +249,21 @@ class StripeService:
     @staticmethod
     async def get_subscription(subscription_id: str) -> stripe.Subscription:
         """Get subscription details"""
-        return stripe.Subscription.retrieve(subscription_id)
+        stripe = get_stripe()
+        return await asyncio.to_thread(stripe.Subscription.retrieve, subscription_id)
 
     @staticmethod
     async def get_customer(customer_id: str) -> stripe.Customer:
         """Get customer details"""
-        return stripe.Customer.retrieve(customer_id)
+        stripe = get_stripe()
+        return await asyncio.to_thread(stripe.Customer.retrieve, customer_id)
 
     @staticmethod
     async def list_invoices(customer_id: str, limit: int = 10) -> list:
         """Get customer invoices"""
-        invoices = stripe.Invoice.list(
+        stripe = get_stripe()
+        invoices = await asyncio.to_thread(
+            stripe.Invoice.list,
             customer=customer_id,
             limit=limit
         )
@@ -225,8 +272,9 @@ class StripeService:
     @staticmethod
     async def get_upcoming_invoice(customer_id: str) -> Optional[stripe.Invoice]:
         """Get upcoming invoice preview"""
+        stripe = get_stripe()
         try:
-            invoice = stripe.Invoice.upcoming(customer=customer_id)
+            invoice = await asyncio.to_thread(stripe.Invoice.upcoming, customer=customer_id)
             return invoice
         except stripe.error.InvalidRequestError:
             return None
@@ -246,6 +294,7 @@ class StripeService:
         Raises:
             ValueError: If signature is invalid
         """
+        stripe = get_stripe()
         try:
             event = stripe.Webhook.construct_event(
                 payload, signature, STRIPE_WEBHOOK_SECRET
@@ -271,7 +320,9 @@ class StripeService:
         Returns:
             Portal session with URL
         """
-        session = stripe.billing_portal.Session.create(
+        stripe = get_stripe()
+        session = await asyncio.to_thread(
+            stripe.billing_portal.Session.create,
             customer=customer_id,
             return_url=return_url,
         )
@@ -292,13 +343,16 @@ class StripeService:
         Returns:
             Payment method object
         """
-        payment_method = stripe.PaymentMethod.attach(
+        stripe = get_stripe()
+        payment_method = await asyncio.to_thread(
+            stripe.PaymentMethod.attach,
             payment_method_id,
             customer=customer_id,
         )
         
         # Set as default
-        stripe.Customer.modify(
+        await asyncio.to_thread(
+            stripe.Customer.modify,
             customer_id,
             invoice_settings={
                 "default_payment_method": payment_method_id,
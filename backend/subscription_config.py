@@ -71,6 +71,12 @@ PLAN_PRICES_KWD = {
     },
 }
 
+# Prices by currency; add a currency here (and to CURRENCY_SYMBOLS) to offer it
+PLAN_PRICES = {
+    "USD": PLAN_PRICES_USD,
+    "KWD": PLAN_PRICES_KWD,
+}
+
 # Stripe Price IDs (set these after creating prices in Stripe Dashboard)
 STRIPE_PRICE_IDS = {
     "USD": {
@@ -90,6 +96,25 @@ STRIPE_PRICE_IDS = {
 # Trial Configuration
 TRIAL_DAYS = 3
 
+# Plan Display (for frontend), in the order plans are listed
+PLAN_DISPLAY = {
+    PLAN_FREE: {
+        "name": "Free",
+        "description": "Perfect for getting started",
+        "trial": False,
+    },
+    PLAN_PROFESSIONAL: {
+        "name": "Professional",
+        "description": "For growing teams",
+        "trial": True,
+    },
+    PLAN_ENTERPRISE: {
+        "name": "Enterprise",
+        "description": "For large organizations",
+        "trial": True,
+    },
+}
+
 # Plan Features Display (for frontend)
 PLAN_FEATURES = {
     PLAN_FREE: [
@@ -119,7 +144,7 @@ PLAN_FEATURES = {
 }
 
 # Currency Configuration
-SUPPORTED_CURRENCIES = ["USD", "KWD"]
+SUPPORTED_CURRENCIES = list(PLAN_PRICES)
 DEFAULT_CURRENCY = "USD"
 
 # Currency Symbols
@@ -137,11 +162,7 @@ CURRENCY_NAMES = {
 
 def get_plan_price(plan: str, billing_cycle: str, currency: str = "USD"):
     """Get price for a plan in specific currency"""
-    if currency == "USD":
-        return PLAN_PRICES_USD.get(plan, {}).get(billing_cycle, 0)
-    elif currency == "KWD":
-        return PLAN_PRICES_KWD.get(plan, {}).get(billing_cycle, 0)
-    return 0
+    return PLAN_PRICES.get(currency, {}).get(plan, {}).get(billing_cycle, 0)
 
 
 def get_plan_limits(plan: str):
@@ -1,19 +1,22 @@
 """
 Subscription Management Service
-Business logic for handling subscriptions
+Business logic for handling subscriptions (functions flush; the caller commits)
 """
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import Optional, Dict, Any
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 import uuid
 
 import database_models as db
+from ids import uuid7
 from subscription_config import (
     PLAN_FREE, PLAN_PROFESSIONAL, PLAN_ENTERPRISE,
     PLAN_LIMITS, TRIAL_DAYS, get_plan_limits
 )
-from stripe_service import StripeService
+from stripe_service import from_timestamp
 
 
 async def create_free_subscription(
@@ -41,8 +44,7 @@ async def create_free_subscription(
     )
     
     session.add(subscription)
-    await session.commit()
-    await session.refresh(subscription)
+    await session.flush()
     
     return subscription
 
@@ -217,8 +219,7 @@ async def create_paid_subscription(
     )
     
     session.add(subscription)
-    await session.commit()
-    await session.refresh(subscription)
+    await session.flush()
     
     return subscription
 
@@ -229,7 +230,8 @@ async def cancel_subscription(
     at_period_end: bool = True
 ) -> db.Subscription:
     """
-    Cancel a subscription
+    Cancel a subscription in the database; the caller cancels a paid one in
+    Stripe first. Does not commit.
     
     Args:
         session: Database session
@@ -244,15 +246,6 @@ async def cancel_subscription(
     if not subscription:
         raise ValueError("No active subscription found")
     
-    # Cancel in Stripe if paid subscription
-    if subscription.stripe_subscription_id:
-        stripe_service = StripeService()
-        await stripe_service.cancel_subscription(
-            subscription.stripe_subscription_id,
-            at_period_end=at_period_end
-        )
-    
-    # Update database
     if at_period_end:
         subscription.cancel_at = subscription.current_period_end
         subscription.status = "active"  # Still active until period end
@@ -264,8 +257,7 @@ async def cancel_subscription(
         # Downgrade to free plan
         subscription.plan = PLAN_FREE
     
-    await session.commit()
-    await session.refresh(subscription)
+    await session.flush()
     
     return subscription
 
@@ -278,7 +270,8 @@ async def upgrade_subscription(
     new_price_id: str
 ) -> db.Subscription:
     """
-    Upgrade subscription to new plan
+    Upgrade subscription to new plan in the database; the caller updates the
+    Stripe subscription first. Does not commit.
     
     Args:
         session: Database session
@@ -298,21 +291,11 @@ async def upgrade_subscription(
     if not subscription.stripe_subscription_id:
         raise ValueError("Cannot upgrade free plan this way")
     
-    # Update in Stripe
-    stripe_service = StripeService()
-    await stripe_service.update_subscription(
-        subscription.stripe_subscription_id,
-        new_price_id,
-        proration_behavior="always_invoice"
-    )
-    
-    # Update database
     subscription.plan = new_plan
     subscription.billing_cycle = new_billing_cycle
     subscription.stripe_price_id = new_price_id
     
-    await session.commit()
-    await session.refresh(subscription)
+    await session.flush()
     
     return subscription
 
@@ -384,33 +367,192 @@ async def create_invoice_record(
     )
     
     session.add(invoice)
-    await session.commit()
-    await session.refresh(invoice)
+    await session.flush()
     
     return invoice
 
 
+# Stripe invoice status -> invoices.status
+INVOICE_STATUSES = {
+    "draft": "draft",
+    "open": "open",
+    "paid": "paid",
+    "uncollectible": "failed",
+    "void": "void",
+}
+
+# A real invoice created this close to the predicted renewal replaces the preview
+UPCOMING_SUPERSEDE_WINDOW = timedelta(days=1)
+
+
+def invoice_values(invoice: Dict[str, Any], status: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Map a Stripe invoice object onto `invoices` columns
+    
+    Args:
+        invoice: Stripe invoice (dict)
+        status: Override the mapped status (e.g. "failed" after a failed payment)
+        
+    Returns:
+        Column values, without company/subscription ids
+    """
+    status = status or INVOICE_STATUSES.get(invoice.get("status"), invoice.get("status"))
+    amount = invoice.get("amount_paid") if status == "paid" else invoice.get("amount_due")
+    return {
+        "stripe_invoice_id": invoice.get("id"),
+        "stripe_subscription_id": invoice.get("subscription"),
+        "stripe_payment_intent_id": invoice.get("payment_intent"),
+        "amount": (amount or 0) / 100,
+        "currency": (invoice.get("currency") or "usd").upper(),
+        "status": status,
+        "invoice_pdf_url": invoice.get("invoice_pdf"),
+        "hosted_invoice_url": invoice.get("hosted_invoice_url"),
+        "period_start": from_timestamp(invoice.get("period_start")),
+        "period_end": from_timestamp(invoice.get("period_end")),
+        "paid_at": from_timestamp((invoice.get("status_transitions") or {}).get("paid_at")),
+        "due_date": from_timestamp(invoice.get("due_date")),
+        "created_at": from_timestamp(invoice.get("created")) or datetime.utcnow(),
+    }
+
+
+async def upsert_invoice(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    subscription_id: Optional[uuid.UUID],
+    invoice: Dict[str, Any],
+    status: Optional[str] = None
+) -> None:
+    """
+    Insert or refresh the local mirror of a Stripe invoice
+    
+    Args:
+        session: Database session
+        company_id: Company ID
+        subscription_id: Local subscription ID, if known yet
+        invoice: Stripe invoice (dict)
+        status: Override the mapped status
+    """
+    values = invoice_values(invoice, status)
+    stmt = insert(db.Invoice).values(
+        id=uuid7(), company_id=company_id, subscription_id=subscription_id, **values
+    )
+    updates = {key: stmt.excluded[key] for key in values if key != "stripe_invoice_id"}
+    updates["subscription_id"] = func.coalesce(stmt.excluded.subscription_id, db.Invoice.subscription_id)
+    updates["updated_at"] = func.now()
+    await session.execute(
+        stmt.on_conflict_do_update(index_elements=[db.Invoice.stripe_invoice_id], set_=updates)
+    )
+
+    if values["stripe_subscription_id"]:
+        await prune_upcoming_invoices(session, [values["stripe_subscription_id"]])
+
+
+async def prune_upcoming_invoices(session: AsyncSession, stripe_subscription_ids: List[str]) -> None:
+    """Remove upcoming previews that a real invoice has replaced."""
+    real = aliased(db.Invoice)
+    await session.execute(
+        delete(db.Invoice)
+        .where(db.Invoice.stripe_subscription_id.in_(stripe_subscription_ids))
+        .where(db.Invoice.status == "upcoming")
+        .where(
+            select(real.id)
+            .where(real.stripe_subscription_id == db.Invoice.stripe_subscription_id)
+            .where(real.status != "upcoming")
+            .where(real.created_at >= db.Invoice.created_at - UPCOMING_SUPERSEDE_WINDOW)
+            .exists()
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def upsert_upcoming_invoice(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    subscription_id: Optional[uuid.UUID],
+    invoice: Dict[str, Any]
+) -> None:
+    """
+    Store Stripe's preview of a subscription's next invoice (one per subscription)
+    
+    Args:
+        session: Database session
+        company_id: Company ID
+        subscription_id: Local subscription ID, if known yet
+        invoice: Stripe upcoming invoice (dict, has no id)
+    """
+    values = invoice_values(invoice, status="upcoming")
+    values["stripe_invoice_id"] = None
+    # Listed at the date it will be charged
+    values["created_at"] = (
+        from_timestamp(invoice.get("next_payment_attempt"))
+        or from_timestamp(invoice.get("period_end"))
+        or values["created_at"]
+    )
+    stmt = insert(db.Invoice).values(
+        id=uuid7(), company_id=company_id, subscription_id=subscription_id, **values
+    )
+    updates = {key: stmt.excluded[key] for key in values}
+    updates["updated_at"] = func.now()
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[db.Invoice.stripe_subscription_id],
+            index_where=db.Invoice.status == "upcoming",
+            set_=updates,
+        )
+    )
+
+
+async def delete_upcoming_invoice(session: AsyncSession, stripe_subscription_id: str) -> None:
+    """Drop the preview of a subscription that will not renew."""
+    await session.execute(
+        delete(db.Invoice)
+        .where(db.Invoice.stripe_subscription_id == stripe_subscription_id)
+        .where(db.Invoice.status == "upcoming")
+    )
+
+
 async def list_invoices(
     session: AsyncSession,
     company_id: uuid.UUID,
-    limit: int = 10
-) -> list:
+    limit: int = 10,
+    before: Optional[Tuple[datetime, uuid.UUID]] = None
+) -> List[db.Invoice]:
     """
-    Get invoices for a company
+    Get a page of a company's invoices, newest first (excluding the upcoming preview)
     
     Args:
         session: Database session
         company_id: Company ID
         limit: Maximum number of invoices
+        before: (created_at, id) of the last invoice on the previous page
         
     Returns:
         List of invoices
     """
-    result = await session.execute(
+    query = (
         select(db.Invoice)
         .where(db.Invoice.company_id == company_id)
-        .order_by(db.Invoice.created_at.desc())
-        .limit(limit)
+        .where(db.Invoice.status != "upcoming")
     )
+    if before:
+        query = query.where(tuple_(db.Invoice.created_at, db.Invoice.id) < tuple_(*before))
     
+    result = await session.execute(
+        query.order_by(db.Invoice.created_at.desc(), db.Invoice.id.desc()).limit(limit)
+    )
     return result.scalars().all()
+
+
+async def get_upcoming_invoice(
+    session: AsyncSession,
+    company_id: uuid.UUID
+) -> Optional[db.Invoice]:
+    """Get the company's next expected invoice, if any."""
+    result = await session.execute(
+        select(db.Invoice)
+        .where(db.Invoice.company_id == company_id)
+        .where(db.Invoice.status == "upcoming")
+        .order_by(db.Invoice.created_at)
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
@@ -0,0 +1,217 @@
+"""
+Custom Domain Routing
+In-memory host → company map and the middleware that validates hosts and serves cards on tenant domains
+
+A company's domain is only served once it has been verified: the company
+publishes its verification token in a TXT record, see `check_verification`.
+"""
+import asyncio
+import logging
+import os
+import re
+import secrets
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+import dns.asyncresolver
+import dns.exception
+from sqlalchemy import select
+from starlette.responses import PlainTextResponse, RedirectResponse
+
+import database_models as db
+from database import AsyncSessionLocal, is_ready
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "localhost,127.0.0.1,192.168.1.123").split(",")
+# Other workers' domain changes are picked up within this interval
+HOST_REFRESH_SECONDS = float(os.getenv("HOST_REFRESH_SECONDS", "30"))
+# Full reloads drop domains of deleted companies
+FULL_RELOAD_SECONDS = 600
+# updated_at is the writer's transaction start time, so re-read a margin behind
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+# First path segments on tenant hosts that are never employee slugs
+RESERVED_SEGMENTS = {"api", "s", "docs", "redoc", "openapi.json", "favicon.ico"}
+CARD_PATH = re.compile(r"^/([^/]+)(/vcard|/qr-vcard)?/?$")
+
+# Ownership proof: a TXT record `<prefix>.<domain>` containing `<value prefix><token>`
+VERIFICATION_RECORD_PREFIX = "_bcards"
+VERIFICATION_VALUE_PREFIX = "bcards-verification="
+DNS_TIMEOUT_SECONDS = 5.0
+
+
+class Tenant(NamedTuple):
+    company_id: object
+    company_slug: str
+
+
+def normalize_host(host: Optional[str]) -> str:
+    """Lower-cased host without port or trailing dot."""
+    host = (host or "").strip().lower()
+    if host.startswith("["):  # IPv6 literal
+        return host.split("]")[0] + "]"
+    return host.split(":")[0].rstrip(".")
+
+
+def new_verification_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def verification_record(domain: str) -> str:
+    """Name of the TXT record that proves ownership of `domain`."""
+    return f"{VERIFICATION_RECORD_PREFIX}.{normalize_host(domain)}"
+
+
+def verification_value(token: str) -> str:
+    return f"{VERIFICATION_VALUE_PREFIX}{token}"
+
+
+async def check_verification(domain: str, token: str) -> bool:
+    """True if the domain's verification TXT record carries the token."""
+    try:
+        answer = await dns.asyncresolver.resolve(verification_record(domain), "TXT", lifetime=DNS_TIMEOUT_SECONDS)
+    except dns.exception.DNSException:
+        return False
+    expected = verification_value(token)
+    return any(
+        b"".join(record.strings).decode("ascii", "replace") == expected
+        for record in answer
+    )
+
+
+HOST_COLUMNS = (
+    db.Company.id, db.Company.slug, db.Company.domain, db.Company.domain_verified_at, db.Company.updated_at,
+)
+
+
+class HostMap:
+    """Custom domains → companies, kept current without restarting workers.
+
+    Changes made through `update_company` are applied immediately in this
+    worker; other workers catch up through the incremental refresh on
+    `companies.updated_at`.
+    """
+
+    def __init__(self, allowed_hosts=ALLOWED_HOSTS):
+        self.allowed_hosts = [normalize_host(h) for h in allowed_hosts if h.strip()]
+        self.allow_any = "*" in self.allowed_hosts
+        self.tenants: Dict[str, Tenant] = {}
+        self.domains: Dict[object, str] = {}  # company_id → domain, to drop stale entries
+        self.since: Optional[datetime] = None
+        self.loaded = False
+
+    def is_static(self, host: str) -> bool:
+        for pattern in self.allowed_hosts:
+            if host == pattern or (pattern.startswith("*.") and host.endswith(pattern[1:])):
+                return True
+        return False
+
+    def resolve(self, host: str) -> Optional[Tenant]:
+        return self.tenants.get(host)
+
+    def update(self, company) -> None:
+        """Apply a company's current domain (None or unverified removes it)."""
+        self.remove(company.id)
+        domain = normalize_host(company.domain)
+        if domain and company.domain_verified_at is not None:
+            self.tenants[domain] = Tenant(company.id, company.slug)
+            self.domains[company.id] = domain
+
+    def remove(self, company_id) -> None:
+        domain = self.domains.pop(company_id, None)
+        tenant = self.tenants.get(domain)
+        if tenant and tenant.company_id == company_id:
+            del self.tenants[domain]
+
+    async def load(self) -> None:
+        """Rebuild the map from every company with a verified domain."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(*HOST_COLUMNS)
+                .where(db.Company.domain.isnot(None), db.Company.domain_verified_at.isnot(None))
+            )
+            rows = result.all()
+        self.tenants, self.domains = {}, {}
+        for row in rows:
+            self.update(row)
+        self.since = max((row.updated_at for row in rows if row.updated_at), default=datetime.utcnow())
+        self.loaded = True
+        logger.info("Loaded %d custom domains", len(self.tenants))
+
+    async def refresh(self) -> None:
+        """Apply companies changed since the last load or refresh."""
+        if not self.loaded:
+            return await self.load()
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(*HOST_COLUMNS)
+                .where(db.Company.updated_at >= self.since - REFRESH_OVERLAP)
+            )
+            rows = result.all()
+        for row in rows:
+            self.update(row)
+            if row.updated_at and row.updated_at > self.since:
+                self.since = row.updated_at
+
+    async def run(self) -> None:
+        """Background loop: full load, then periodic incremental refreshes."""
+        while not is_ready():
+            await asyncio.sleep(1)
+        last_full = None
+        while True:
+            try:
+                now = asyncio.get_running_loop().time()
+                if last_full is None or now - last_full >= FULL_RELOAD_SECONDS:
+                    await self.load()
+                    last_full = now
+                else:
+                    await self.refresh()
+            except Exception:
+                logger.exception("Custom domain refresh failed")
+            await asyncio.sleep(HOST_REFRESH_SECONDS)
+
+
+host_map = HostMap()
+
+
+class TenantHostMiddleware:
+    """Host validation from ALLOWED_HOSTS plus the custom-domain map.
+
+    Hosts listed in ALLOWED_HOSTS are never treated as tenant domains. On a
+    tenant domain, `/{employee_slug}` redirects to the card page in the
+    frontend, while `/{employee_slug}/vcard` and `/{employee_slug}/qr-vcard`
+    are served by the public card routes of that company; other paths pass
+    through unchanged.
+    """
+
+    def __init__(self, app, hosts: HostMap = host_map):
+        self.app = app
+        self.hosts = hosts
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        host = normalize_host(headers.get(b"host", b"").decode("latin-1"))
+        if self.hosts.is_static(host):
+            return await self.app(scope, receive, send)
+        tenant = self.hosts.resolve(host)
+        if tenant is None:
+            if self.hosts.allow_any:
+                return await self.app(scope, receive, send)
+            response = PlainTextResponse("Invalid host header", status_code=400)
+            return await response(scope, receive, send)
+
+        match = CARD_PATH.match(scope["path"])
+        if match and match.group(1) not in RESERVED_SEGMENTS:
+            if scope["type"] == "http" and not match.group(2):
+                # The card page is rendered by the frontend
+                response = RedirectResponse(settings.card_url(tenant.company_slug, match.group(1)), status_code=302)
+                return await response(scope, receive, send)
+            path = f"/api/card/{tenant.company_slug}/{match.group(1)}{match.group(2) or ''}"
+            scope = dict(scope, path=path, raw_path=path.encode())
+        scope.setdefault("state", {})["tenant"] = tenant
+        return await self.app(scope, receive, send)
@@ -0,0 +1,220 @@
+"""
+Analytics Time Series
+Bucketed, gap-filled event counts in a company's time zone, with closed buckets cached as arrays
+"""
+import os
+import uuid
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+from analytics_codes import ACTION_CODES
+from cache import LRUCache
+
+INTERVALS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+# Range shown when the caller gives no start
+DEFAULT_BUCKETS = {"hour": 48, "day": 30, "week": 26}
+MAX_BUCKETS = int(os.getenv("ANALYTICS_TIMESERIES_MAX_BUCKETS", "2000"))
+
+# Events are stamped when their request is handled and committed a moment
+# later, so a bucket is only treated as closed this long after it ends
+CLOSE_GRACE = timedelta(seconds=60)
+
+# Closed buckets never change, except when an employee (and their analytics)
+# is deleted: that evicts the company here, and the TTL covers other workers
+_series = LRUCache(
+    int(os.getenv("ANALYTICS_TIMESERIES_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("ANALYTICS_TIMESERIES_CACHE_TTL", "3600")),
+)
+
+
+class _Series(NamedTuple):
+    """Counts of consecutive closed buckets from `start` (local wall time)."""
+    company_id: uuid.UUID
+    start: datetime
+    counts: array
+
+
+class TimeSeries(NamedTuple):
+    zone: ZoneInfo
+    starts: List[datetime]  # Local bucket starts, timezone-aware
+    counts: array
+    closed: int  # Leading buckets that are closed (and cached)
+
+    @property
+    def complete(self) -> bool:
+        """True if every bucket is closed, so the series can't change any more."""
+        return self.closed == len(self.counts)
+
+
+def zone(name: str) -> ZoneInfo:
+    """An IANA time zone; raises ValueError for unknown names."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone '{name}'")
+
+
+def valid_timezone(value: Optional[str]) -> Optional[str]:
+    """Validator for client-supplied time zone names."""
+    if value is not None:
+        zone(value)
+    return value
+
+
+def truncate(moment: datetime, interval: str) -> datetime:
+    """Start of the bucket containing a local wall time (weeks start on Monday, like date_trunc)."""
+    if interval == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+def to_local(moment: datetime, tz: ZoneInfo) -> datetime:
+    """Naive UTC (as stored) or aware time -> naive local wall time."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(tz).replace(tzinfo=None)
+
+
+def to_utc(local: datetime, tz: ZoneInfo) -> datetime:
+    """Naive local wall time -> naive UTC (as stored)."""
+    return local.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_range(
+    interval: str,
+    tz: ZoneInfo,
+    start: Union[datetime, date, None],
+    end: Union[datetime, date, None],
+    now: datetime,
+) -> Tuple[datetime, int]:
+    """(first bucket, bucket count) covering start..end, both in local wall time.
+
+    Dates and naive times for `start`/`end` are read as local times in
+    `tz`. `end` defaults to now and `start` to DEFAULT_BUCKETS before it.
+    Raises ValueError for an inverted or too long range.
+    """
+    step = INTERVALS[interval]
+    last = truncate(to_local(now, tz) if end is None else _wall_time(end, tz), interval)
+    if start is None:
+        first = last - step * (DEFAULT_BUCKETS[interval] - 1)
+    else:
+        first = truncate(_wall_time(start, tz), interval)
+    if first > last:
+        raise ValueError("from must not be after to")
+    count = (last - first) // step + 1
+    if count > MAX_BUCKETS:
+        raise ValueError(f"Range spans {count} buckets; at most {MAX_BUCKETS} per request")
+    return first, count
+
+
+def _wall_time(moment: Union[datetime, date], tz: ZoneInfo) -> datetime:
+    if not isinstance(moment, datetime):
+        return datetime(moment.year, moment.month, moment.day)
+    return moment if moment.tzinfo is None else to_local(moment, tz)
+
+
+async def _query_counts(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    interval: str,
+    tz: ZoneInfo,
+    first: datetime,
+    count: int,
+    action: Optional[str],
+    employee_id: Optional[uuid.UUID],
+) -> array:
+    """Gap-filled counts of `count` buckets from `first`, grouped by the database."""
+    step = INTERVALS[interval]
+    # Stored timestamps are UTC: read them as such, then as wall time in the company's zone
+    local_timestamp = func.timezone(tz.key, func.timezone("UTC", db.AnalyticsEvent.timestamp))
+    bucket = func.date_trunc(interval, local_timestamp).label("bucket")
+    conditions = [
+        db.AnalyticsEvent.company_id == company_id,
+        db.AnalyticsEvent.timestamp >= to_utc(first, tz),
+        db.AnalyticsEvent.timestamp < to_utc(first + step * count, tz),
+    ]
+    if action is not None:
+        conditions.append(db.AnalyticsEvent.action == action)
+    if employee_id is not None:
+        conditions.append(db.AnalyticsEvent.employee_id == employee_id)
+    result = await session.execute(
+        select(bucket, func.count()).where(and_(*conditions)).group_by("bucket")
+    )
+
+    counts = array("q", [0]) * count
+    for start, total in result:
+        index = (start - first) // step
+        if 0 <= index < count:
+            counts[index] = total
+    return counts
+
+
+async def get_timeseries(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    interval: str,
+    tz: ZoneInfo,
+    first: datetime,
+    count: int,
+    action: Optional[str] = None,
+    employee_id: Optional[uuid.UUID] = None,
+    now: Optional[datetime] = None,
+) -> TimeSeries:
+    """Event counts per bucket, from `bucket_range`.
+
+    Closed buckets come from the cached array for the same company, card,
+    action, interval and zone when it covers them; only the rest (usually
+    just the current bucket) is counted by the database, and newly closed
+    buckets are appended to the cached array.
+    """
+    if action is not None and action not in ACTION_CODES:
+        raise ValueError(f"Unknown action '{action}'")
+    step = INTERVALS[interval]
+    now = now or datetime.utcnow()
+    open_bucket = truncate(to_local(now - CLOSE_GRACE, tz), interval)
+    closed = min(max((open_bucket - first) // step, 0), count)
+
+    key = (company_id, employee_id, action, interval, tz.key)
+    cached: Optional[_Series] = _series.get(key)
+    offset = (first - cached.start) // step if cached else -1
+    reused = 0
+    if cached and 0 <= offset < len(cached.counts):
+        reused = min(closed, len(cached.counts) - offset)
+
+    counts = array("q", cached.counts[offset:offset + reused]) if reused else array("q")
+    if reused < count:
+        counts.extend(await _query_counts(
+            session, company_id, interval, tz, first + step * reused, count - reused, action, employee_id
+        ))
+
+    if closed > reused:
+        if cached and 0 <= offset <= len(cached.counts):
+            # Contiguous with the cached buckets: extend them
+            series = _Series(company_id, cached.start, cached.counts[:offset] + counts[:closed])
+        else:
+            series = _Series(company_id, first, counts[:closed])
+        excess = len(series.counts) - 2 * MAX_BUCKETS
+        if excess > 0:
+            series = _Series(company_id, series.start + step * excess, series.counts[excess:])
+        _series.put(key, series)
+
+    starts = [(first + step * i).replace(tzinfo=tz) for i in range(count)]
+    return TimeSeries(tz, starts, counts, closed)
+
+
+def evict_company(company_id: uuid.UUID) -> int:
+    """Forget cached buckets of a company whose analytics were deleted."""
+    return _series.evict_where(lambda series: series.company_id == company_id)
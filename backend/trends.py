@@ -0,0 +1,317 @@
+"""
+Card Activity Trends
+Scores every card's recent activity against its own rolling baseline, for all tenants in one vectorized pass
+
+Usage:
+    python trends.py          # score the days up to yesterday unless already done
+    python trends.py --force  # score again regardless
+
+Also runs in the background of every API process, checking hourly; the last
+day scored is kept in sync_state, and an advisory lock lets only one process
+run a pass. A pass runs on a thread with its own event loop and an unpooled
+connection, so it neither stalls request handling nor holds a pool slot.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import Date, DateTime, Float, Integer, String, bindparam, cast, delete, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, aggregate_order_by, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_models as db
+from database import AsyncSessionLocal, engine, is_ready, lock_engine
+
+logger = logging.getLogger(__name__)
+
+TRENDS_ENABLED = os.getenv("TRENDS_ENABLED", "true").lower() == "true"
+# The recent window is compared with every window of the same length in the baseline before it
+RECENT_DAYS = int(os.getenv("TRENDS_RECENT_DAYS", "7"))
+BASELINE_DAYS = int(os.getenv("TRENDS_BASELINE_DAYS", "28"))
+SPIKE_Z = float(os.getenv("TRENDS_SPIKE_Z", "3"))
+# Trending needs this many recent events, dropping this many in an average baseline window
+MIN_EVENTS = int(os.getenv("TRENDS_MIN_EVENTS", "10"))
+
+CHECK_INTERVAL_SECONDS = 3600
+SYNC_NAME = "card_trends"
+ADVISORY_LOCK_KEY = 0x5EC0_0003
+WRITE_BATCH_SIZE = 20000  # Cards per upsert; each column goes as one array parameter
+
+STATUS_TRENDING = "trending"
+STATUS_DROPPING = "dropping"
+STATUS_INACTIVE = "inactive"
+STATUS_NEW = "new"  # Not old enough for a baseline window
+STATUS_NORMAL = "normal"
+
+
+class Cards(NamedTuple):
+    """Per-card daily counts, one row per card and one column per day from `first_day`."""
+    employee_ids: List[uuid.UUID]
+    company_ids: List[uuid.UUID]
+    created: np.ndarray  # Column of the day each card was created (0 if before the history)
+    counts: np.ndarray
+    first_day: date
+
+
+async def load_counts(session: AsyncSession, first_day: date, days: int) -> Cards:
+    """Daily event counts of every card of every live company, zeros included.
+
+    One statement numbers the cards and groups their events by (card row,
+    day column); both come back as arrays, so nothing is looped over per row.
+    """
+    start = datetime.combine(first_day, datetime.min.time())
+    cards = (
+        select(
+            db.Employee.id,
+            db.Employee.company_id,
+            func.coalesce(cast(db.Employee.created_at, Date) - first_day, 0).label("created"),
+            (func.row_number().over(order_by=db.Employee.id) - 1).label("row"),
+        )
+        .join(db.Company, db.Company.id == db.Employee.company_id)
+        .where(db.Company.deleted_at.is_(None))
+        .cte("cards")
+    )
+    # Sparse (card, day, count) triples, grouped by the database
+    daily = (
+        select(
+            cards.c.row,
+            (cast(db.AnalyticsEvent.timestamp, Date) - first_day).label("day"),
+            func.count().label("events"),
+        )
+        .join(cards, cards.c.id == db.AnalyticsEvent.employee_id)
+        .where(db.AnalyticsEvent.timestamp >= start, db.AnalyticsEvent.timestamp < start + timedelta(days=days))
+        .group_by(cards.c.row, "day")
+        .cte("daily")
+    )
+
+    def by_row(column):
+        return select(func.array_agg(aggregate_order_by(column, cards.c.row))).scalar_subquery()
+
+    def collect(column):
+        return select(func.array_agg(column)).scalar_subquery()
+
+    result = await session.execute(select(
+        by_row(cards.c.id), by_row(cards.c.company_id), by_row(cards.c.created),
+        collect(daily.c.row), collect(daily.c.day), collect(daily.c.events),
+    ))
+    employee_ids, company_ids, created, rows, columns, values = (column or [] for column in result.one())
+
+    counts = np.zeros((len(employee_ids), days), dtype=np.int32)
+    counts[np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)] = np.asarray(values, dtype=np.int64)
+    return Cards(employee_ids, company_ids, np.clip(np.asarray(created, dtype=np.int64), 0, days), counts, first_day)
+
+
+def score(counts: np.ndarray, created: np.ndarray, recent_days: int = RECENT_DAYS) -> Dict[str, np.ndarray]:
+    """Trend statistics for every row of a (cards x days) count matrix at once.
+
+    The last `recent_days` columns are the recent window. Its total is
+    compared with the totals of every earlier window of the same length
+    (rolling, one day apart): their mean and standard deviation are the
+    card's baseline. Windows starting before the card was created are left
+    out so a new card doesn't look like it suddenly took off.
+    """
+    cards, days = counts.shape
+    history = days - recent_days
+    recent = counts[:, history:].sum(axis=1, dtype=np.int64)
+
+    cumulative = np.zeros((cards, history + 1), dtype=np.int64)
+    np.cumsum(counts[:, :history], axis=1, out=cumulative[:, 1:])
+    windows = cumulative[:, recent_days:] - cumulative[:, :-recent_days]
+    valid = np.arange(windows.shape[1]) >= created[:, None]
+    samples = valid.sum(axis=1)
+    has_baseline = samples > 0
+    divisor = np.maximum(samples, 1)
+    mean = np.where(valid, windows, 0).sum(axis=1) / divisor
+    std = np.sqrt(np.where(valid, (windows - mean[:, None]) ** 2, 0).sum(axis=1) / divisor)
+    # Event counts are roughly Poisson: don't trust a spread below sqrt(mean), or 1
+    z_score = (recent - mean) / np.maximum(std, np.sqrt(np.maximum(mean, 1.0)))
+    growth_rate = (recent + 1) / (mean + 1) - 1
+
+    active = counts > 0
+    last_active = np.where(active.any(axis=1), days - 1 - np.argmax(active[:, ::-1], axis=1), -1)
+
+    # First matching condition wins
+    status = np.select(
+        [
+            (recent == 0) & (created <= history),
+            ~has_baseline,
+            (z_score >= SPIKE_Z) & (recent >= MIN_EVENTS),
+            (z_score <= -SPIKE_Z) & (mean >= MIN_EVENTS),
+        ],
+        [STATUS_INACTIVE, STATUS_NEW, STATUS_TRENDING, STATUS_DROPPING],
+        default=STATUS_NORMAL,
+    )
+    return {
+        "status": status,
+        "recent_count": recent,
+        "has_baseline": has_baseline,
+        "baseline_mean": mean,
+        "baseline_std": std,
+        "growth_rate": growth_rate,
+        "z_score": z_score,
+        "last_active": last_active,
+    }
+
+
+def _array(name: str, item_type):
+    return bindparam(name, type_=ARRAY(item_type))
+
+
+# One row per array element: columns travel as arrays, not as a parameter per value
+_UPSERT_COLUMNS = {
+    "employee_id": UUID(as_uuid=True),
+    "company_id": UUID(as_uuid=True),
+    "status": String,
+    "recent_count": Integer,
+    "baseline_mean": Float,
+    "baseline_std": Float,
+    "growth_rate": Float,
+    "z_score": Float,
+    "last_active": Integer,  # Days after first_day
+}
+_rows = func.unnest(*(_array(name, item_type) for name, item_type in _UPSERT_COLUMNS.items())).table_valued(
+    *_UPSERT_COLUMNS
+).render_derived(name="scored")
+_upsert = insert(db.CardTrend).from_select(
+    [*_UPSERT_COLUMNS, "computed_for", "computed_at"],
+    select(
+        *(_rows.c[name] for name in _UPSERT_COLUMNS if name != "last_active"),
+        bindparam("first_day", type_=Date) + _rows.c.last_active,
+        bindparam("computed_for", type_=Date),
+        bindparam("computed_at", type_=DateTime),
+    ),
+)
+_upsert = _upsert.on_conflict_do_update(
+    index_elements=[db.CardTrend.employee_id],
+    set_={name: _upsert.excluded[name] for name in [*_UPSERT_COLUMNS, "computed_for", "computed_at"] if name != "employee_id"},
+)
+
+
+async def _store(session: AsyncSession, cards: Cards, scores: Dict[str, np.ndarray], last_day: date) -> None:
+    """Upsert one row per card and drop rows of cards no longer scored."""
+    baseline = scores["has_baseline"]
+    columns = {
+        "status": scores["status"].tolist(),
+        "recent_count": scores["recent_count"].tolist(),
+        # NULL where there is no baseline (or no activity)
+        **{name: np.where(baseline, scores[name], None).tolist()
+           for name in ("baseline_mean", "baseline_std", "growth_rate", "z_score")},
+        "last_active": np.where(scores["last_active"] >= 0, scores["last_active"], None).tolist(),
+    }
+    params = {"first_day": cards.first_day, "computed_for": last_day, "computed_at": datetime.utcnow()}
+    # Core execution: given a dict, the ORM session would treat this as a bulk insert
+    connection = await session.connection()
+    for offset in range(0, len(cards.employee_ids), WRITE_BATCH_SIZE):
+        batch = slice(offset, offset + WRITE_BATCH_SIZE)
+        await connection.execute(_upsert, {
+            **params,
+            "employee_id": cards.employee_ids[batch],
+            "company_id": cards.company_ids[batch],
+            **{name: values[batch] for name, values in columns.items()},
+        })
+    # Cards of companies being purged
+    await session.execute(delete(db.CardTrend).where(db.CardTrend.computed_for < last_day))
+
+
+async def _compute_trends(force: bool) -> Optional[Dict[str, Any]]:
+    last_day = datetime.utcnow().date() - timedelta(days=1)
+    async with AsyncSessionLocal(bind=lock_engine) as session:
+        if not await session.scalar(select(func.pg_try_advisory_xact_lock(ADVISORY_LOCK_KEY))):
+            return None
+        state = await session.get(db.SyncState, SYNC_NAME)
+        if not force and state and state.cursor == last_day.isoformat():
+            return None
+
+        started = time.monotonic()
+        days = BASELINE_DAYS + RECENT_DAYS
+        cards = await load_counts(session, last_day - timedelta(days=days - 1), days)
+        scores = score(cards.counts, cards.created)
+        await _store(session, cards, scores, last_day)
+
+        now = datetime.utcnow()
+        await session.execute(
+            insert(db.SyncState)
+            .values(name=SYNC_NAME, cursor=last_day.isoformat(), last_started_at=now, last_completed_at=now)
+            .on_conflict_do_update(
+                index_elements=[db.SyncState.name],
+                set_={"cursor": last_day.isoformat(), "last_started_at": now, "last_completed_at": now},
+            )
+        )
+        await session.commit()
+
+    return {
+        "computed_for": last_day.isoformat(),
+        "cards": len(cards.employee_ids),
+        "statuses": dict(Counter(scores["status"].tolist())),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+async def compute_trends(force: bool = False) -> Optional[Dict[str, Any]]:
+    """Score all cards up to yesterday (UTC); None if already done or running elsewhere.
+
+    The pass (loading, scoring and writing) runs on a worker thread with its
+    own event loop; lock_engine connections aren't pooled, so they don't tie
+    either loop to the other.
+    """
+    stats = await asyncio.to_thread(asyncio.run, _compute_trends(force))
+    if stats is not None:
+        logger.info("Card trends computed: %s", stats)
+    return stats
+
+
+async def get_card_trends(
+    session: AsyncSession,
+    company_id: uuid.UUID,
+    status: Optional[str] = None,
+    limit: int = 20,
+) -> List[Any]:
+    """Stored trends of a company's cards with the card's name and slug, strongest signal first."""
+    query = (
+        select(db.CardTrend, db.Employee.full_name, db.Employee.public_slug)
+        .join(db.Employee, db.Employee.id == db.CardTrend.employee_id)
+        .where(db.CardTrend.company_id == company_id)
+    )
+    if status is not None:
+        query = query.where(db.CardTrend.status == status)
+    if status == STATUS_INACTIVE:
+        order = [db.CardTrend.last_active.asc().nulls_first()]
+    elif status == STATUS_DROPPING:
+        order = [db.CardTrend.z_score.asc()]
+    else:
+        order = [db.CardTrend.z_score.desc().nulls_last()]
+    result = await session.execute(query.order_by(*order, db.CardTrend.employee_id).limit(limit))
+    return result.all()
+
+
+async def run() -> None:
+    """Background loop: score each day once it has ended."""
+    while not is_ready():
+        await asyncio.sleep(1)
+    while True:
+        try:
+            await compute_trends()
+        except Exception:
+            logger.exception("Card trend computation failed; retrying in an hour")
+        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+
+
+async def _main(force: bool) -> None:
+    stats = await compute_trends(force)
+    print(f"✅ {stats}" if stats is not None else "✅ Trends already current (or being computed elsewhere)")
+    await engine.dispose()
+    await lock_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Score card activity trends")
+    parser.add_argument("--force", action="store_true", help="recompute even if yesterday is already scored")
+    asyncio.run(_main(parser.parse_args().force))
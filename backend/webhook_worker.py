@@ -0,0 +1,345 @@
+"""
+Stripe Webhook Worker
+Queues verified Stripe events and applies them in the background, in order per customer
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select, update, exists, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+import database_models as db
+import subscription_service
+from database import AsyncSessionLocal, is_ready
+from ids import uuid7
+from stripe_service import from_timestamp, get_stripe
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_PROCESSED = "processed"
+STATUS_DEAD = "dead"
+
+BATCH_SIZE = 20
+POLL_INTERVAL_SECONDS = 5.0
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 3600
+
+# Events stuck in `processing` longer than this (worker crashed) are retried
+LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+def _event_customer_id(obj: Dict[str, Any]) -> Optional[str]:
+    if obj.get("object") == "customer":
+        return obj.get("id")
+    customer = obj.get("customer")
+    if isinstance(customer, dict):
+        return customer.get("id")
+    return customer
+
+
+async def enqueue_event(session: AsyncSession, event: Dict[str, Any]) -> bool:
+    """Persist a verified event; returns False if Stripe already delivered it."""
+    result = await session.execute(
+        insert(db.StripeEvent)
+        .values(
+            id=uuid7(),
+            stripe_event_id=event["id"],
+            type=event["type"],
+            customer_id=_event_customer_id(event["data"]["object"]),
+            stripe_created=from_timestamp(event["created"]),
+            payload=event,
+            status=STATUS_PENDING,
+            attempts=0,
+        )
+        .on_conflict_do_nothing(index_elements=[db.StripeEvent.stripe_event_id])
+        .returning(db.StripeEvent.id)
+    )
+    inserted = result.scalar_one_or_none() is not None
+    await session.commit()
+    return inserted
+
+
+# ========== Event Handlers ==========
+# Handlers don't commit: the worker commits their changes together with the
+# event's processed status. Each must still be idempotent, since a stale lock
+# can be reclaimed while a slow attempt is in flight.
+
+async def _find_subscription(session: AsyncSession, invoice: Dict[str, Any]) -> Optional[db.Subscription]:
+    """The local subscription an invoice belongs to, if it is stored yet."""
+    if invoice.get("subscription"):
+        # Not stored yet means a checkout still being applied; never guess by
+        # customer, who may also own an older, cancelled subscription
+        result = await session.execute(
+            select(db.Subscription)
+            .where(db.Subscription.stripe_subscription_id == invoice["subscription"])
+        )
+        return result.scalar_one_or_none()
+
+    if not invoice.get("customer"):
+        return None
+    # One-off invoices: the customer's current subscription (they keep the
+    # customer id across re-subscriptions, so there can be several rows)
+    result = await session.execute(
+        select(db.Subscription)
+        .where(db.Subscription.stripe_customer_id == invoice["customer"])
+        .where(db.Subscription.status.in_(["active", "trialing"]))
+        .order_by(db.Subscription.created_at.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def _invoice_owner(
+    session: AsyncSession, invoice: Dict[str, Any]
+) -> Tuple[Optional[uuid.UUID], Optional[uuid.UUID]]:
+    """(company_id, subscription_id) for an invoice.
+
+    The first invoice of a checkout can arrive before the subscription is
+    stored; the company then comes from the subscription metadata and the
+    row is linked once checkout.session.completed is applied.
+    """
+    subscription = await _find_subscription(session, invoice)
+    if subscription:
+        return subscription.company_id, subscription.id
+    metadata = (invoice.get("subscription_details") or {}).get("metadata") or {}
+    if metadata.get("company_id"):
+        return uuid.UUID(metadata["company_id"]), None
+    return None, None
+
+
+async def handle_checkout_completed(session: AsyncSession, checkout: Dict[str, Any]) -> None:
+    subscription_id = checkout.get("subscription")
+    if not subscription_id:
+        return
+
+    result = await session.execute(
+        select(db.Subscription.id)
+        .where(db.Subscription.stripe_subscription_id == subscription_id)
+    )
+    if result.scalar_one_or_none():
+        return  # Already applied
+
+    stripe = get_stripe()
+    stripe_subscription = await asyncio.to_thread(stripe.Subscription.retrieve, subscription_id)
+
+    metadata = checkout.get("metadata") or {}
+    subscription = await subscription_service.create_paid_subscription(
+        session,
+        company_id=uuid.UUID(metadata["company_id"]),
+        plan=metadata.get("plan"),
+        billing_cycle=metadata.get("billing_cycle"),
+        stripe_customer_id=checkout.get("customer"),
+        stripe_subscription_id=subscription_id,
+        stripe_price_id=stripe_subscription["items"]["data"][0]["price"]["id"],
+        currency=(checkout.get("currency") or "usd").upper(),
+        amount=(checkout.get("amount_total") or 0) / 100,
+    )
+
+    # Link invoices mirrored before the subscription existed
+    await session.execute(
+        update(db.Invoice)
+        .where(db.Invoice.stripe_subscription_id == subscription_id)
+        .where(db.Invoice.subscription_id.is_(None))
+        .values(subscription_id=subscription.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _mirror_invoice(session: AsyncSession, invoice: Dict[str, Any], status: Optional[str] = None) -> None:
+    company_id, subscription_id = await _invoice_owner(session, invoice)
+    if not company_id:
+        logger.info("No company for invoice %s; skipping", invoice.get("id"))
+        return
+    await subscription_service.upsert_invoice(session, company_id, subscription_id, invoice, status)
+
+
+async def handle_invoice(session: AsyncSession, invoice: Dict[str, Any]) -> None:
+    await _mirror_invoice(session, invoice)
+
+
+async def handle_invoice_payment_failed(session: AsyncSession, invoice: Dict[str, Any]) -> None:
+    # Stripe keeps the invoice `open` while it retries the payment
+    await _mirror_invoice(session, invoice, status="failed")
+
+
+async def handle_invoice_upcoming(session: AsyncSession, invoice: Dict[str, Any]) -> None:
+    company_id, subscription_id = await _invoice_owner(session, invoice)
+    if company_id and invoice.get("subscription"):
+        await subscription_service.upsert_upcoming_invoice(session, company_id, subscription_id, invoice)
+
+
+async def handle_subscription_updated(session: AsyncSession, subscription: Dict[str, Any]) -> None:
+    result = await session.execute(
+        select(db.Subscription)
+        .where(db.Subscription.stripe_subscription_id == subscription.get("id"))
+    )
+    db_subscription = result.scalar_one_or_none()
+    if not db_subscription:
+        return
+
+    db_subscription.status = subscription.get("status")
+    db_subscription.current_period_start = from_timestamp(subscription.get("current_period_start"))
+    db_subscription.current_period_end = from_timestamp(subscription.get("current_period_end"))
+    db_subscription.cancel_at = from_timestamp(subscription.get("cancel_at"))
+
+    if subscription.get("cancel_at_period_end") or subscription.get("cancel_at"):
+        await subscription_service.delete_upcoming_invoice(session, subscription.get("id"))
+
+
+async def handle_subscription_deleted(session: AsyncSession, subscription: Dict[str, Any]) -> None:
+    await subscription_service.delete_upcoming_invoice(session, subscription.get("id"))
+
+    result = await session.execute(
+        select(db.Subscription)
+        .where(db.Subscription.stripe_subscription_id == subscription.get("id"))
+    )
+    db_subscription = result.scalar_one_or_none()
+    if not db_subscription or db_subscription.status == "canceled":
+        return
+
+    db_subscription.status = "canceled"
+    db_subscription.active = False
+    db_subscription.ended_at = from_timestamp(subscription.get("ended_at")) or datetime.utcnow()
+    db_subscription.plan = "free"  # Downgrade to free
+
+
+HANDLERS: Dict[str, Callable[[AsyncSession, Dict[str, Any]], Awaitable[None]]] = {
+    "checkout.session.completed": handle_checkout_completed,
+    "invoice.created": handle_invoice,
+    "invoice.finalized": handle_invoice,
+    "invoice.updated": handle_invoice,
+    "invoice.paid": handle_invoice,
+    "invoice.voided": handle_invoice,
+    "invoice.marked_uncollectible": handle_invoice,
+    "invoice.payment_failed": handle_invoice_payment_failed,
+    "invoice.upcoming": handle_invoice_upcoming,
+    "customer.subscription.updated": handle_subscription_updated,
+    "customer.subscription.deleted": handle_subscription_deleted,
+}
+
+
+# ========== Worker ==========
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+class WebhookWorker:
+    """Claims queued events with SKIP LOCKED so several processes can share the queue."""
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        """Process newly queued events now instead of at the next poll."""
+        self._wakeup.set()
+
+    async def _claim(self) -> list:
+        event = db.StripeEvent
+        earlier = aliased(db.StripeEvent)
+        # An event waits while an older event for the same customer is unfinished
+        blocked = exists().where(
+            earlier.customer_id == event.customer_id,
+            earlier.status.in_([STATUS_PENDING, STATUS_PROCESSING]),
+            # Stripe timestamps have one-second resolution; ties go by arrival
+            tuple_(earlier.stripe_created, earlier.created_at, earlier.id)
+            < tuple_(event.stripe_created, event.created_at, event.id),
+        )
+        candidates = (
+            select(event.id)
+            .where(event.status == STATUS_PENDING)
+            .where(event.next_attempt_at <= func.now())
+            .where(~blocked)
+            .order_by(event.stripe_created, event.created_at, event.id)
+            .limit(BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    update(event)
+                    .where(event.id.in_(candidates.scalar_subquery()))
+                    .values(status=STATUS_PROCESSING, locked_at=func.now(), attempts=event.attempts + 1)
+                    .returning(event.id, event.type, event.payload, event.attempts)
+                    .execution_options(synchronize_session=False)
+                )
+                return result.all()
+
+    async def _reclaim_stale(self) -> None:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.execute(
+                    update(db.StripeEvent)
+                    .where(db.StripeEvent.status == STATUS_PROCESSING)
+                    .where(db.StripeEvent.locked_at < func.now() - LOCK_TIMEOUT)
+                    .values(status=STATUS_PENDING, locked_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+
+    async def _process(self, event_id: uuid.UUID, event_type: str, payload: Dict[str, Any], attempts: int) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                handler = HANDLERS.get(event_type)
+                if handler:
+                    await handler(session, payload["data"]["object"])
+                await session.execute(
+                    update(db.StripeEvent)
+                    .where(db.StripeEvent.id == event_id)
+                    .values(status=STATUS_PROCESSED, processed_at=func.now(), locked_at=None, last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+        except Exception as e:
+            dead = attempts >= MAX_ATTEMPTS
+            logger.exception(
+                "Stripe event %s (%s) failed on attempt %d%s",
+                event_id, event_type, attempts, "; moved to dead letter" if dead else "",
+            )
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(db.StripeEvent)
+                    .where(db.StripeEvent.id == event_id)
+                    .values(
+                        status=STATUS_DEAD if dead else STATUS_PENDING,
+                        last_error=repr(e)[:2000],
+                        locked_at=None,
+                        next_attempt_at=func.now() + _backoff(attempts),
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+
+    async def process_batch(self) -> int:
+        """Claim and apply one batch; returns the number of events claimed."""
+        claimed = await self._claim()
+        # At most one event per customer is claimed at a time, so a batch can run concurrently
+        await asyncio.gather(*(self._process(*row) for row in claimed))
+        return len(claimed)
+
+    async def run(self) -> None:
+        """Background loop draining the queue."""
+        while not is_ready():
+            await asyncio.sleep(1)
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._reclaim_stale()
+                while await self.process_batch():
+                    pass
+            except Exception:
+                logger.exception("Stripe webhook worker iteration failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+worker = WebhookWorker()
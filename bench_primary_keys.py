@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Primary key benchmark - insert throughput and index size of random (uuid4)
+versus time-ordered (uuid7) primary keys
+
+Creates scratch tables shaped like `analytics` in DATABASE_URL, fills each
+with the same number of rows in batches, and drops them afterwards.
+
+Usage:
+    python bench_primary_keys.py                 # 10M rows per key type
+    python bench_primary_keys.py --rows 1000000 --keep
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from sqlalchemy import text  # noqa: E402
+
+from database import engine  # noqa: E402
+from ids import uuid7  # noqa: E402
+
+
+class Colors:
+    GREEN = '\033[92m'
+    BLUE = '\033[94m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_header(text: str):
+    print(f"\n{Colors.BLUE}{'=' * 70}\n{text}\n{'=' * 70}{Colors.END}")
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_info(text: str):
+    print(f"{Colors.YELLOW}ℹ️  {text}{Colors.END}")
+
+
+GENERATORS = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+COLUMNS = ["id", "company_id", "timestamp", "action"]
+
+
+def mb(size: int) -> str:
+    return f"{size / 1024 / 1024:,.1f} MB"
+
+
+async def bench(kind: str, rows: int, batch_size: int, keep: bool) -> dict:
+    table = f"bench_pk_{kind}"
+    new_id = GENERATORS[kind]
+    company_id = uuid.uuid4()
+    async with engine.connect() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await conn.execute(text(
+            f"CREATE TABLE {table} (id uuid PRIMARY KEY, company_id uuid NOT NULL, "
+            f"timestamp timestamp NOT NULL, action varchar(50) NOT NULL)"
+        ))
+        await conn.commit()
+        raw = (await conn.get_raw_connection()).driver_connection
+
+        elapsed, tail_elapsed, tail_rows = 0.0, 0.0, 0
+        done = 0
+        while done < rows:
+            count = min(batch_size, rows - done)
+            now = datetime.utcnow()
+            records = [(new_id(), company_id, now, "view") for _ in range(count)]
+            started = time.perf_counter()
+            await raw.copy_records_to_table(table, records=records, columns=COLUMNS)
+            took = time.perf_counter() - started
+            elapsed += took
+            done += count
+            # Throughput once the index is large is what matters
+            if done > rows * 0.9:
+                tail_elapsed += took
+                tail_rows += count
+
+        await conn.execute(text(f"ANALYZE {table}"))
+        index_size = (await conn.execute(text(f"SELECT pg_relation_size('{table}_pkey')"))).scalar()
+        table_size = (await conn.execute(text(f"SELECT pg_relation_size('{table}')"))).scalar()
+        if not keep:
+            await conn.execute(text(f"DROP TABLE {table}"))
+        await conn.commit()
+
+    return {
+        "kind": kind,
+        "rows_per_s": rows / elapsed,
+        "tail_rows_per_s": tail_rows / tail_elapsed if tail_elapsed else 0.0,
+        "index_size": index_size,
+        "table_size": table_size,
+    }
+
+
+async def run(rows: int, batch_size: int, keep: bool):
+    print_header(f"Primary key benchmark: {rows:,} rows per key type")
+    results = []
+    for kind in GENERATORS:
+        print_info(f"Inserting {rows:,} rows with {kind} keys...")
+        result = await bench(kind, rows, batch_size, keep)
+        results.append(result)
+        print_success(
+            f"{kind}: {result['rows_per_s']:,.0f} rows/s overall, "
+            f"{result['tail_rows_per_s']:,.0f} rows/s over the last 10%, "
+            f"index {mb(result['index_size'])}, table {mb(result['table_size'])}"
+        )
+    await engine.dispose()
+
+    random_keys, ordered_keys = results
+    print_header("uuid7 vs uuid4")
+    print(f"  Insert throughput:      {ordered_keys['rows_per_s'] / random_keys['rows_per_s']:.2f}x")
+    print(f"  Throughput, last 10%:   {ordered_keys['tail_rows_per_s'] / random_keys['tail_rows_per_s']:.2f}x")
+    print(f"  Primary key index size: {ordered_keys['index_size'] / random_keys['index_size']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare uuid4 and uuid7 primary keys")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="rows inserted per key type")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows per COPY")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch tables for inspection")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.batch_size, args.keep))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+const MAX_BODY_BYTES = 8 * 1024;
+
+function getBackendUrl(): string {
+  const apiHost = process.env.NEXT_PUBLIC_API_HOST || process.env.API_HOST || '127.0.0.1';
+  const apiPort = process.env.NEXT_PUBLIC_API_PORT || process.env.API_PORT || '8000';
+  return `http://${apiHost}:${apiPort}/api`;
+}
+
+// Batched card analytics from navigator.sendBeacon, forwarded to the backend
+// with the visitor's user agent and address
+export async function POST(request: NextRequest) {
+  const { searchParams } = new URL(request.url);
+  const company_slug = searchParams.get('company_slug');
+  const employee_slug = searchParams.get('employee_slug');
+
+  if (!company_slug || !employee_slug) {
+    return NextResponse.json(
+      { error: 'Missing parameters' },
+      { status: 400 }
+    );
+  }
+
+  const body = await request.text();
+  if (body.length > MAX_BODY_BYTES) {
+    return NextResponse.json(
+      { error: 'Body too large' },
+      { status: 413 }
+    );
+  }
+
+  const headers: Record<string, string> = {
+    'Content-Type': 'application/json',
+  };
+  const userAgent = request.headers.get('user-agent');
+  if (userAgent) {
+    headers['User-Agent'] = userAgent;
+  }
+  const forwardedFor = request.headers.get('x-forwarded-for') || request.ip;
+  if (forwardedFor) {
+    headers['X-Forwarded-For'] = forwardedFor;
+  }
+
+  try {
+    const apiBase = getBackendUrl();
+    const backendUrl = `${apiBase}/analytics/batch?company_slug=${encodeURIComponent(company_slug)}&employee_slug=${encodeURIComponent(employee_slug)}`;
+
+    const response = await fetch(backendUrl, {
+      method: 'POST',
+      headers,
+      body,
+    });
+
+    // Beacons ignore the response; only the status matters
+    return new NextResponse(null, { status: response.ok ? 204 : response.status });
+  } catch (error) {
+    console.error('Beacon API route error:', error);
+    return new NextResponse(null, { status: 502 });
+  }
+}
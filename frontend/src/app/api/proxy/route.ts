@@ -6,6 +6,19 @@ function getBackendUrl(): string {
   return `http://${apiHost}:${apiPort}/api`;
 }
 
+// Pass the visitor's user agent and address on, so analytics don't see every
+// hit as coming from this server
+function forwardClient(request: NextRequest, headers: Record<string, string>) {
+  const userAgent = request.headers.get('user-agent');
+  if (userAgent) {
+    headers['User-Agent'] = userAgent;
+  }
+  const forwardedFor = request.headers.get('x-forwarded-for') || request.ip;
+  if (forwardedFor) {
+    headers['X-Forwarded-For'] = forwardedFor;
+  }
+}
+
 export async function GET(request: NextRequest) {
   const { searchParams } = new URL(request.url);
   const path = searchParams.get('path');
@@ -22,13 +35,14 @@ export async function GET(request: NextRequest) {
     const apiBase = getBackendUrl();
     const backendUrl = `${apiBase}/api${path}`;
     
-    const headers: HeadersInit = {
+    const headers: Record<string, string> = {
       'Content-Type': 'application/json',
     };
 
     if (auth_header) {
       headers['Authorization'] = auth_header;
     }
+    forwardClient(request, headers);
 
     const response = await fetch(backendUrl, {
       method: 'GET',
@@ -70,13 +84,14 @@ export async function POST(request: NextRequest) {
     const apiBase = getBackendUrl();
     const backendUrl = `${apiBase}/api${path}`;
     
-    const headers: HeadersInit = {
+    const headers: Record<string, string> = {
       'Content-Type': 'application/json',
     };
 
     if (auth_header) {
       headers['Authorization'] = auth_header;
     }
+    forwardClient(request, headers);
 
     const response = await fetch(backendUrl, {
       method: 'POST',
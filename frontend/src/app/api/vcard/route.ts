@@ -22,11 +22,23 @@ export async function GET(request: NextRequest) {
     const apiBase = getBackendUrl();
     const backendUrl = `${apiBase}/card/${company_slug}/${employee_slug}/vcard`;
     
+    // Pass the visitor's user agent and address on, so the download is
+    // counted (and filtered) as theirs rather than this server's
+    const headers: Record<string, string> = {
+      'Content-Type': 'text/vcard',
+    };
+    const userAgent = request.headers.get('user-agent');
+    if (userAgent) {
+      headers['User-Agent'] = userAgent;
+    }
+    const forwardedFor = request.headers.get('x-forwarded-for') || request.ip;
+    if (forwardedFor) {
+      headers['X-Forwarded-For'] = forwardedFor;
+    }
+
     const response = await fetch(backendUrl, {
       method: 'GET',
-      headers: {
-        'Content-Type': 'text/vcard',
-      },
+      headers,
     });
 
     if (!response.ok) {
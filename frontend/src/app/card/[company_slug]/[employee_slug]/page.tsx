@@ -1,7 +1,8 @@
 'use client';
 
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
+import { createAnalyticsBeacon } from '@/lib/analyticsBeacon';
 
 interface CardData {
   employee_id: string;
@@ -30,6 +31,13 @@ export default function PublicCardPage({
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [showQR, setShowQR] = useState(false);
+  const beacon = useRef<ReturnType<typeof createAnalyticsBeacon> | null>(null);
+
+  useEffect(() => {
+    // Interactions are batched and sent once when the visitor leaves
+    beacon.current = createAnalyticsBeacon(params.company_slug, params.employee_slug);
+    return () => beacon.current?.close();
+  }, [params.company_slug, params.employee_slug]);
 
   useEffect(() => {
     const fetchCard = async () => {
@@ -40,12 +48,7 @@ export default function PublicCardPage({
           `/api/card?company_slug=${params.company_slug}&employee_slug=${params.employee_slug}`
         );
         setCard(response.data);
-
-        // Track analytics via proxy route
-        await axios.post(
-          `/api/proxy?path=/analytics/track?company_slug=${params.company_slug}&employee_slug=${params.employee_slug}`,
-          { action: 'view', device: 'web' }
-        ).catch(() => {});
+        trackAction('view');
       } catch (err: any) {
         console.error('Card fetch error:', {
           status: err.response?.status,
@@ -390,9 +393,6 @@ export default function PublicCardPage({
   );
 
   function trackAction(action: string) {
-    axios.post(
-      `/api/proxy?path=/analytics/track?company_slug=${params.company_slug}&employee_slug=${params.employee_slug}`,
-      { action, device: 'web' }
-    ).catch(() => {});
+    beacon.current?.track({ action, device: 'web' });
   }
 }
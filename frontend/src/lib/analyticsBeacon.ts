@@ -0,0 +1,57 @@
+// Collects card page interactions and sends them in one request per visit
+// (or per MAX_EVENTS), using navigator.sendBeacon so events survive the
+// visitor navigating away (tel:, mailto:, WhatsApp links).
+
+const MAX_EVENTS = 20; // Matches the backend's MAX_BEACON_EVENTS
+const FLUSH_DELAY_MS = 10000;
+
+export interface BeaconEvent {
+  action: string;
+  device?: string;
+  region?: string;
+}
+
+export function createAnalyticsBeacon(companySlug: string, employeeSlug: string) {
+  const url = `/api/beacon?company_slug=${encodeURIComponent(companySlug)}&employee_slug=${encodeURIComponent(employeeSlug)}`;
+  let queue: BeaconEvent[] = [];
+  let timer: ReturnType<typeof setTimeout> | null = null;
+
+  function flush() {
+    if (timer) {
+      clearTimeout(timer);
+      timer = null;
+    }
+    if (queue.length === 0) return;
+    const body = JSON.stringify(queue);
+    queue = [];
+    // text/plain keeps the beacon a simple request
+    const sent = navigator.sendBeacon?.(url, new Blob([body], { type: 'text/plain' }));
+    if (!sent) {
+      fetch(url, { method: 'POST', body, keepalive: true }).catch(() => {});
+    }
+  }
+
+  function onHide() {
+    if (document.visibilityState === 'hidden') flush();
+  }
+
+  document.addEventListener('visibilitychange', onHide);
+  window.addEventListener('pagehide', flush);
+
+  return {
+    track(event: BeaconEvent) {
+      queue.push(event);
+      if (queue.length >= MAX_EVENTS) {
+        flush();
+      } else if (!timer) {
+        timer = setTimeout(flush, FLUSH_DELAY_MS);
+      }
+    },
+    flush,
+    close() {
+      flush();
+      document.removeEventListener('visibilitychange', onHide);
+      window.removeEventListener('pagehide', flush);
+    },
+  };
+}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Analytics ingestion filter test - crawlers are recognised by user agent and
+a repeated hit is dropped only within the dedup window
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from analytics_filter import (  # noqa: E402
+    PROXY_CHECK_HITS,
+    REASON_BOT,
+    REASON_DUPLICATE,
+    IngestFilter,
+    SlidingWindowDedup,
+    is_bot,
+)
+
+BROWSER = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1"
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_is_bot():
+    """Crawlers, link previewers, tools and missing user agents count as bots."""
+    bots = [
+        None,
+        "",
+        "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+        "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+        "WhatsApp/2.23.20.0",
+        "curl/8.4.0",
+        "python-requests/2.31.0",
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 HeadlessChrome/120.0 Safari/537.36",
+    ]
+    for user_agent in bots:
+        assert is_bot(user_agent), user_agent
+    assert not is_bot(BROWSER)
+    assert not is_bot("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36")
+
+
+def test_sliding_window():
+    """A key is a repeat within the window and accepted again once it has passed."""
+    clock = FakeClock()
+    dedup = SlidingWindowDedup(window=30, maxsize=100, clock=clock)
+    assert not dedup.seen("a")
+    clock.now += 29
+    assert dedup.seen("a")
+    clock.now += 2
+    assert not dedup.seen("a"), "the window counts from the accepted hit, not the repeat"
+    clock.now += 31
+    assert not dedup.seen("b")
+    assert len(dedup) == 1, "expired keys are trimmed"
+
+
+def test_sliding_window_maxsize():
+    """At maxsize the oldest key is forgotten early."""
+    dedup = SlidingWindowDedup(window=30, maxsize=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        assert not dedup.seen(key)
+    assert len(dedup) == 2
+    assert not dedup.seen("a")
+    assert dedup.seen("c")
+
+
+def test_ingest_filter():
+    """Bots and repeats are dropped and counted per reason and action."""
+    ingest = IngestFilter(window=30, maxsize=100)
+    assert ingest.check("curl/8.4.0", "203.0.113.5", "card", "view") == REASON_BOT
+    assert ingest.check(BROWSER, "203.0.113.5", "card", "view") is None
+    assert ingest.check(BROWSER, "203.0.113.5", "card", "view") == REASON_DUPLICATE
+    assert ingest.check(BROWSER, "203.0.113.5", "card", "click") is None
+    assert ingest.check(BROWSER, "203.0.113.6", "card", "view") is None
+    assert ingest.check(BROWSER, None, "card", "view") is None
+    stats = ingest.stats()
+    assert stats["accepted"] == 4, stats
+    assert stats["dropped"] == {"bot": {"view": 1}, "duplicate": {"view": 1}}, stats
+
+
+def test_proxy_warning():
+    """Hits that all come from one private address are reported as a proxy."""
+    ingest = IngestFilter(window=30, maxsize=1000)
+    for i in range(PROXY_CHECK_HITS):
+        ingest.check(BROWSER, "10.0.0.2", f"card-{i}", "view")
+    assert ingest.stats()["proxy_ip"] == "10.0.0.2"
+
+    ingest = IngestFilter(window=30, maxsize=1000)
+    ingest.check(BROWSER, "203.0.113.5", "card", "view")
+    for i in range(PROXY_CHECK_HITS):
+        ingest.check(BROWSER, "10.0.0.2", f"card-{i}", "view")
+    assert ingest.stats()["proxy_ip"] is None
+
+    ingest = IngestFilter(window=30, maxsize=1000)
+    for i in range(PROXY_CHECK_HITS):
+        ingest.check(BROWSER, "8.8.8.8", f"card-{i}", "view")
+    assert ingest.stats()["proxy_ip"] is None, "a single public address is a visitor"
+
+
+def main():
+    failures = 0
+    for test in (test_is_bot, test_sliding_window, test_sliding_window_maxsize, test_ingest_filter, test_proxy_warning):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+GeoIP range file test - building merges and validates ranges, lookups find
+the range containing an IPv4 or IPv6 address
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import geoip  # noqa: E402
+
+ROWS = [
+    ("1.0.0.0", "1.0.0.255", "AU"),
+    ("1.0.1.0", "1.0.1.255", "AU"),  # Adjacent with the same name: merged
+    ("1.0.0.128", "1.0.2.0", "XX"),  # Overlaps: skipped
+    ("5.0.0.0", "5.0.0.255", "KW"),
+    ("2001:db8::", "2001:db8::ffff", "DE"),
+    ("not-an-ip", "1.2.3.4", "FR"),  # Invalid: skipped
+    ("9.0.0.0", "9.0.0.255", " "),  # No name: skipped
+]
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+def _build(directory: str):
+    path = os.path.join(directory, "geoip.bin")
+    return geoip.build(ROWS, path), geoip.GeoIPDatabase(path)
+
+
+def test_build():
+    """Adjacent ranges are merged; overlapping, invalid and unnamed ones are skipped."""
+    with tempfile.TemporaryDirectory() as directory:
+        records, database = _build(directory)
+        try:
+            assert records == 3, records
+            assert database.count == 3
+            assert database.names == ["AU", "DE", "KW"], database.names
+        finally:
+            database.close()
+
+
+def test_lookup():
+    """Addresses resolve to the range containing them, and nothing outside."""
+    expected = {
+        "1.0.0.0": "AU",
+        "1.0.1.200": "AU",
+        "1.0.2.0": None,
+        "5.0.0.255": "KW",
+        "0.255.255.255": None,
+        "255.255.255.255": None,
+        "2001:db8::1": "DE",
+        "2001:db8::1:0": None,
+        "::ffff:5.0.0.7": "KW",
+        "not-an-ip": None,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        _, database = _build(directory)
+        try:
+            actual = {address: database.lookup(address) for address in expected}
+        finally:
+            database.close()
+    assert actual == expected, actual
+
+
+def test_rejects_other_files():
+    """A file without the range file header is rejected."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "geoip.bin")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 64)
+        try:
+            geoip.GeoIPDatabase(path)
+        except ValueError:
+            return
+    raise AssertionError("opening a file without the header must fail")
+
+
+def main():
+    failures = 0
+    for test in (test_build, test_lookup, test_rejects_other_files):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
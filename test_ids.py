@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Primary key test - UUIDv7 ids are well formed and strictly increasing within
+a process, even within one millisecond or when the clock steps back
+"""
+
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import ids  # noqa: E402
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+class FakeTime:
+    """Stands in for the `time` module in `ids`, with a clock set by the test."""
+
+    def __init__(self, ahead_ms: int):
+        # Ahead of any id generated so far, which the generator never goes below
+        self.ms = time.time_ns() // 1_000_000 + ahead_ms
+
+    def time_ns(self) -> int:
+        return self.ms * 1_000_000
+
+
+def _generate(count: int, clock: FakeTime = None, steps=()) -> list:
+    """`count` ids; with a clock, `steps` maps an index to a clock change in ms before it."""
+    real_time, state = ids.time, (ids._last_ms, ids._counter)
+    if clock is not None:
+        ids.time = clock
+    try:
+        generated = []
+        for i in range(count):
+            if clock is not None:
+                clock.ms += dict(steps).get(i, 0)
+            generated.append(ids.uuid7())
+        return generated
+    finally:
+        if clock is not None:
+            # Don't leave later ids stamped with the fake time
+            ids.time = real_time
+            ids._last_ms, ids._counter = state
+
+
+def _assert_increasing(generated: list):
+    for previous, current in zip(generated, generated[1:]):
+        assert previous.int < current.int, f"{previous} is not before {current}"
+
+
+def test_format():
+    """Ids are version 7, RFC 4122 variant, stamped with the current time."""
+    before = time.time_ns() // 1_000_000
+    value = ids.uuid7()
+    after = time.time_ns() // 1_000_000
+    assert value.version == 7, value.version
+    assert value.variant == uuid.RFC_4122, value.variant
+    assert before <= ids.timestamp_ms(value) <= after
+
+
+def test_monotonic():
+    """Ids from a burst are unique and strictly increasing."""
+    generated = _generate(20000)
+    assert len(set(generated)) == len(generated)
+    _assert_increasing(generated)
+
+
+def test_same_millisecond():
+    """Within one millisecond the counter orders ids; when it runs out the next millisecond is borrowed."""
+    clock = FakeTime(60_000)
+    start = clock.ms
+    generated = _generate(5000, clock)
+    _assert_increasing(generated)
+    stamps = {ids.timestamp_ms(value) for value in generated}
+    assert min(stamps) == start and max(stamps) > start, stamps
+
+
+def test_clock_step_back():
+    """A clock stepping back keeps ids increasing."""
+    clock = FakeTime(120_000)
+    generated = _generate(100, clock, steps={50: -5})
+    _assert_increasing(generated)
+
+
+def main():
+    failures = 0
+    for test in (test_format, test_monotonic, test_same_millisecond, test_clock_step_back):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
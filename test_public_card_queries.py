@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Public card query test - the public card endpoints must read employee,
+company and card in a single database round trip
+
+Runs the app in-process against DATABASE_URL (the schema is created if missing).
+Run it directly, or through pytest, which skips it when the database can't be reached.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from typing import Optional
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+os.environ.setdefault("ALLOWED_HOSTS", "testserver")
+
+from sqlalchemy import event  # noqa: E402
+
+import database  # noqa: E402
+from main import app  # noqa: E402
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+def print_info(text: str):
+    print(f"{Colors.YELLOW}ℹ️  {text}{Colors.END}")
+
+
+class QueryCounter:
+    """Records every statement sent to the database while active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(database.engine.sync_engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(database.engine.sync_engine, "before_cursor_execute", self._record)
+
+
+async def create_card(client: httpx.AsyncClient) -> tuple:
+    email = f"query-test-{uuid.uuid4().hex[:8]}@example.com"
+    signup = await client.post(
+        "/api/auth/signup",
+        json={"email": email, "password": "secret123", "full_name": "Query Test"},
+    )
+    assert signup.status_code == 200, signup.text
+    token = signup.json()
+    employee = await client.post(
+        f"/api/company/{token['company_id']}/employees",
+        json={"full_name": "Jane Smith", "email": "jane@example.com"},
+        headers={"Authorization": f"Bearer {token['access_token']}"},
+    )
+    assert employee.status_code == 200, employee.text
+    return employee.json()["company_slug"], employee.json()["public_slug"]
+
+
+async def run() -> Optional[int]:
+    """Number of failed checks; None if the database can't be reached."""
+    try:
+        # One attempt: init_db keeps retrying for a minute and a half
+        async with database.engine.connect():
+            pass
+    except Exception as e:
+        print_error(f"Database unreachable: {e}")
+        await database.engine.dispose()
+        return None
+    await database.init_db()
+    failures = 0
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        company_slug, employee_slug = await create_card(client)
+
+        with QueryCounter() as counter:
+            response = await client.get(f"/api/card/{company_slug}/{employee_slug}")
+        try:
+            assert response.status_code == 200, response.text
+            assert response.json()["qr_code"], "card columns missing from the response"
+            assert len(counter.statements) == 1, (
+                f"expected 1 query, got {len(counter.statements)}:\n" + "\n---\n".join(counter.statements)
+            )
+            print_success("GET /api/card/{company_slug}/{employee_slug} issues exactly one query")
+        except AssertionError as e:
+            failures += 1
+            print_error(str(e))
+
+        with QueryCounter() as counter:
+            response = await client.get(f"/api/card/{company_slug}/no-such-employee")
+        try:
+            assert response.status_code == 404, response.status_code
+            assert len(counter.statements) == 1, f"expected 1 query, got {len(counter.statements)}"
+            print_success("Unknown cards are rejected with a single query")
+        except AssertionError as e:
+            failures += 1
+            print_error(str(e))
+
+    print_info(f"prepared statement cache size: {database.PREPARED_STATEMENT_CACHE_SIZE}")
+    await database.engine.dispose()
+    return failures
+
+
+def test_public_card_queries():
+    import pytest
+
+    failures = asyncio.run(run())
+    if failures is None:
+        pytest.skip("database unreachable")
+    assert failures == 0
+
+
+def main():
+    failures = asyncio.run(run())
+    sys.exit(0 if failures == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Sketch encoding test - HyperLogLog and Count-Min/top-k sketches must survive
+a round trip through their stored form, store counters little-endian and
+saturate instead of wrapping
+"""
+
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from sketches import COUNTER_MAX, HyperLogLog, TopK  # noqa: E402
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+def test_hyperloglog_round_trip():
+    """HyperLogLog estimates within 5% and round-trips through bytes."""
+    sketch = HyperLogLog()
+    for i in range(20000):
+        sketch.add(f"visitor-{i}")
+    assert abs(sketch.count() - 20000) < 1000, sketch.count()
+
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.p == sketch.p
+    assert restored.registers == sketch.registers
+    assert restored.count() == sketch.count()
+
+
+def test_hyperloglog_merge():
+    """Merging HyperLogLogs estimates the union, not the sum."""
+    left, right = HyperLogLog(), HyperLogLog()
+    for i in range(10000):
+        left.add(f"visitor-{i}")
+        right.add(f"visitor-{i + 5000}")
+    left.merge(right)
+    assert abs(left.count() - 15000) < 750, left.count()
+
+    try:
+        left.merge(HyperLogLog(precision=10))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("merging different precisions must fail")
+
+
+def test_topk_round_trip():
+    """Top-k counters and candidates round-trip through bytes."""
+    sketch = TopK()
+    for i, region in enumerate(["KW", "SA", "AE", "US", "GB"]):
+        sketch.add(region, count=(i + 1) * 10)
+    restored = TopK.from_bytes(sketch.to_bytes())
+    assert (restored.width, restored.depth, restored.k) == (sketch.width, sketch.depth, sketch.k)
+    assert restored.counters == sketch.counters
+    assert restored.top(3) == [("GB", 50), ("US", 40), ("AE", 30)], restored.top(3)
+
+
+def test_topk_little_endian():
+    """Stored Count-Min counters are little-endian uint32 whatever the host byte order."""
+    sketch = TopK(width=8, depth=2, k=4)
+    sketch.add("KW", count=0x01020304)
+    raw = zlib.decompress(sketch.to_bytes())
+    counters = raw[TopK._HEADER.size:TopK._HEADER.size + 4 * 8 * 2]
+    cells = [counters[i:i + 4] for i in range(0, len(counters), 4)]
+    assert cells.count(b"\x04\x03\x02\x01") == 2, cells
+    assert cells.count(b"\x00\x00\x00\x00") == 14, cells
+    assert TopK.from_bytes(sketch.to_bytes()).estimate("KW") == 0x01020304
+
+
+def test_topk_saturation():
+    """Counters stop at the uint32 maximum on add and merge instead of wrapping."""
+    sketch = TopK(width=8, depth=2, k=4)
+    sketch.add("KW", count=COUNTER_MAX - 1)
+    sketch.add("KW", count=5)
+    assert sketch.estimate("KW") == COUNTER_MAX
+
+    other = TopK(width=8, depth=2, k=4)
+    other.add("KW", count=COUNTER_MAX)
+    sketch.merge(other)
+    assert sketch.estimate("KW") == COUNTER_MAX
+    assert TopK.from_bytes(sketch.to_bytes()).estimate("KW") == COUNTER_MAX
+
+
+def main():
+    failures = 0
+    for test in (
+        test_hyperloglog_round_trip,
+        test_hyperloglog_merge,
+        test_topk_round_trip,
+        test_topk_little_endian,
+        test_topk_saturation,
+    ):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
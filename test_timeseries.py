@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Analytics time series test - bucket ranges follow the company's time zone,
+and closed buckets are served from the cache so only open ones are counted
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from array import array
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import timeseries  # noqa: E402
+
+UTC = timeseries.zone("UTC")
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+def _raises_value_error(*args) -> bool:
+    try:
+        timeseries.bucket_range(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def test_bucket_range_defaults():
+    """Without a start, the range is DEFAULT_BUCKETS ending with the bucket containing now."""
+    now = datetime(2026, 3, 4, 15, 40)  # A Wednesday
+    assert timeseries.bucket_range("hour", UTC, None, None, now) == (datetime(2026, 3, 2, 16), 48)
+    assert timeseries.bucket_range("day", UTC, None, None, now) == (datetime(2026, 2, 3), 30)
+    first, count = timeseries.bucket_range("week", UTC, None, None, now)
+    assert count == 26 and first == datetime(2026, 3, 2) - timedelta(weeks=25), first
+    assert first.weekday() == 0, "weeks start on Monday"
+
+
+def test_bucket_range_time_zone():
+    """Now and aware times are read in the company's zone; dates and naive times are local."""
+    kuwait = timeseries.zone("Asia/Kuwait")
+    now = datetime(2026, 3, 1, 22, 30)  # 01:30 on March 2nd in Kuwait
+    assert timeseries.bucket_range("day", kuwait, date(2026, 2, 25), None, now) == (datetime(2026, 2, 25), 6)
+
+    new_york = timeseries.zone("America/New_York")
+    # Across the start of daylight saving time: three local days
+    assert timeseries.bucket_range("day", new_york, date(2026, 3, 7), date(2026, 3, 9), now) == (
+        datetime(2026, 3, 7), 3,
+    )
+    aware_end = datetime(2026, 3, 9, 3, 0, tzinfo=UTC)  # Still March 8th in New York
+    assert timeseries.bucket_range("day", new_york, date(2026, 3, 7), aware_end, now) == (datetime(2026, 3, 7), 2)
+
+
+def test_bucket_range_limits():
+    """Inverted and overlong ranges are rejected."""
+    now = datetime(2026, 3, 4, 15, 40)
+    assert _raises_value_error("day", UTC, date(2026, 3, 5), date(2026, 3, 4), now)
+    too_long = date(2026, 3, 4) - timedelta(days=timeseries.MAX_BUCKETS)
+    assert _raises_value_error("day", UTC, too_long, date(2026, 3, 4), now)
+    assert not _raises_value_error("day", UTC, too_long + timedelta(days=1), date(2026, 3, 4), now)
+
+
+async def _cache_reuse():
+    queries = []
+
+    async def query_counts(session, company_id, interval, tz, first, count, action, employee_id):
+        queries.append((first, count))
+        return array("q", [1]) * count
+
+    real_query_counts = timeseries._query_counts
+    timeseries._query_counts = query_counts
+    try:
+        company_id = uuid.uuid4()
+        now = datetime(2026, 3, 4, 15, 40)
+        first, count = timeseries.bucket_range("hour", UTC, None, None, now)
+
+        series = await timeseries.get_timeseries(None, company_id, "hour", UTC, first, count, now=now)
+        assert queries == [(first, 48)], queries
+        assert series.closed == 47 and not series.complete
+        assert list(series.counts) == [1] * 48
+
+        # Same range again: only the open bucket is counted
+        queries.clear()
+        series = await timeseries.get_timeseries(None, company_id, "hour", UTC, first, count, now=now)
+        assert queries == [(datetime(2026, 3, 4, 15), 1)], queries
+        assert list(series.counts) == [1] * 48
+
+        # An hour later: the newly closed bucket is counted once, then cached as well
+        later = now + timedelta(hours=1)
+        first, count = timeseries.bucket_range("hour", UTC, None, None, later)
+        queries.clear()
+        await timeseries.get_timeseries(None, company_id, "hour", UTC, first, count, now=later)
+        await timeseries.get_timeseries(None, company_id, "hour", UTC, first, count, now=later)
+        assert queries == [(datetime(2026, 3, 4, 15), 2), (datetime(2026, 3, 4, 16), 1)], queries
+
+        # A wholly closed range is complete and served without a query
+        queries.clear()
+        series = await timeseries.get_timeseries(
+            None, company_id, "hour", UTC, datetime(2026, 3, 3), 10, now=later,
+        )
+        assert queries == [] and series.complete, queries
+
+        # Evicting the company drops its cached buckets
+        assert timeseries.evict_company(company_id) == 1
+        queries.clear()
+        await timeseries.get_timeseries(None, company_id, "hour", UTC, first, count, now=later)
+        assert queries == [(first, 48)], queries
+    finally:
+        timeseries._query_counts = real_query_counts
+
+
+def test_cache_reuse():
+    """Closed buckets are counted once; repeated requests only count the open bucket."""
+    asyncio.run(_cache_reuse())
+
+
+def main():
+    failures = 0
+    for test in (test_bucket_range_defaults, test_bucket_range_time_zone, test_bucket_range_limits, test_cache_reuse):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Trend scoring test - every card is scored against its own rolling baseline,
+ignoring the days before it existed
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import trends  # noqa: E402
+
+DAYS = 35
+RECENT = 7
+HISTORY = DAYS - RECENT
+
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+def print_success(text: str):
+    print(f"{Colors.GREEN}✅ {text}{Colors.END}")
+
+
+def print_error(text: str):
+    print(f"{Colors.RED}❌ {text}{Colors.END}")
+
+
+def _score(*cards):
+    """Score (daily counts, created column) pairs; counts are per-day lists of length DAYS."""
+    counts = np.array([daily for daily, _ in cards], dtype=np.int32)
+    created = np.array([created for _, created in cards], dtype=np.int64)
+    return trends.score(counts, created, recent_days=RECENT)
+
+
+def test_statuses():
+    """Steady, spiking, dropping, idle and new cards get their status."""
+    result = _score(
+        ([5] * DAYS, 0),
+        ([2] * HISTORY + [20] * RECENT, 0),
+        ([20] * HISTORY + [2] * RECENT, 0),
+        ([3] * HISTORY + [0] * RECENT, 0),
+        ([0] * 30 + [4] * 5, 30),
+    )
+    assert list(result["status"]) == [
+        trends.STATUS_NORMAL,
+        trends.STATUS_TRENDING,
+        trends.STATUS_DROPPING,
+        trends.STATUS_INACTIVE,
+        trends.STATUS_NEW,
+    ], list(result["status"])
+    assert list(result["has_baseline"]) == [True, True, True, True, False]
+
+
+def test_baseline_statistics():
+    """The baseline is the mean and spread of every earlier window of the same length."""
+    result = _score(([5] * DAYS, 0), ([2] * HISTORY + [20] * RECENT, 0))
+    assert list(result["recent_count"]) == [35, 140]
+    assert np.allclose(result["baseline_mean"], [35, 14])
+    assert np.allclose(result["baseline_std"], [0, 0])
+    assert np.allclose(result["z_score"][0], 0)
+    # Spread is floored at sqrt(mean): (140 - 14) / sqrt(14)
+    assert np.isclose(result["z_score"][1], 126 / np.sqrt(14))
+    assert np.isclose(result["growth_rate"][1], 141 / 15 - 1)
+
+
+def test_windows_before_creation_ignored():
+    """A card created mid-history is compared only with windows after it existed."""
+    result = _score(([0] * 14 + [5] * (DAYS - 14), 14))
+    assert result["status"][0] == trends.STATUS_NORMAL, result["status"][0]
+    assert np.isclose(result["baseline_mean"][0], 35)
+
+
+def test_last_active():
+    """last_active is the column of the latest day with events, or -1."""
+    result = _score(
+        ([1] + [0] * (DAYS - 1), 0),
+        ([0] * (DAYS - 1) + [1], 0),
+        ([0] * DAYS, 0),
+    )
+    assert list(result["last_active"]) == [0, DAYS - 1, -1], list(result["last_active"])
+
+
+def main():
+    failures = 0
+    for test in (test_statuses, test_baseline_statistics, test_windows_before_creation_ignored, test_last_active):
+        try:
+            test()
+            print_success(test.__doc__.strip())
+        except Exception as e:
+            failures += 1
+            print_error(f"{test.__name__}: {e!r}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()